@@ -372,6 +372,23 @@ class AmortizableMLP(nn.Module):
         mlp_def["used_ranks"]=used_ranks
         mlp_def["num_params"]=num_amortization_params
 
+        ## slicing plan (u, v and b slices of each matrix within the parameters of this MLP) .. computed once here instead of splitting the parameter tensor in every forward pass
+        slicing_plan=[]
+        index=0
+        for ind in range(len(mlp_def["inputs"])):
+            u_slice=slice(index, index+mlp_def["num_u_s"][ind])
+            index+=mlp_def["num_u_s"][ind]
+            v_slice=slice(index, index+mlp_def["num_v_s"][ind])
+            index+=mlp_def["num_v_s"][ind]
+            b_slice=slice(index, index+mlp_def["num_b_s"][ind])
+            index+=mlp_def["num_b_s"][ind]
+
+            slicing_plan.append((u_slice, v_slice, b_slice))
+
+        assert(index==num_amortization_params)
+
+        mlp_def["slicing_plan"]=slicing_plan
+
         return num_amortization_params
 
     def obtain_default_init_tensor(self, fix_final_bias=None, prev_damping_factor=1000.0):
@@ -505,22 +522,62 @@ class AmortizableMLP(nn.Module):
         """
         return ret
 
-    def _apply_amortized_mlp(self, mlp_def, prev_argument, params):
+    def _fused_linear(self, matrices, prev, bias):
+        """
+        Applies a chain of (possibly low-rank factorized) matrices plus bias with as few kernel calls as possible.
+        Shared matrices (first dim 1) use a single matmul/addmm, per-item matrices use bmm/baddbmm.
+
+        Parameters:
+            matrices (list(Tensor)): Matrices of shape (B_p, O, I), applied in the given order.
+            prev (Tensor): Input of shape (B, I), or of arbitrary batch shape (..., I) if B_p=1.
+            bias (Tensor/None): Bias of shape (B_p, O).
+
+        Returns:
+            Tensor
+                Output of shape (B, O).
+        """
+
+        if(matrices[0].shape[0]==1):
+
+            for matrix in matrices[:-1]:
+                prev=torch.matmul(prev, matrix[0].T)
+
+            if(bias is None):
+                return torch.matmul(prev, matrices[-1][0].T)
+
+            if(prev.dim()==2):
+                return torch.addmm(bias, prev, matrices[-1][0].T)
+
+            return torch.matmul(prev, matrices[-1][0].T)+bias[0]
+
+        prev=prev.unsqueeze(-1)
+
+        for matrix in matrices[:-1]:
+            prev=torch.bmm(matrix, prev)
+
+        if(bias is None):
+            return torch.bmm(matrices[-1], prev).squeeze(-1)
+
+        return torch.baddbmm(bias.unsqueeze(-1), matrices[-1], prev).squeeze(-1)
+
+    def _apply_amortized_mlp(self, mlp_def, prev_argument, params, use_fused_kernels=True):
 
-        amortization_params=params
         prev=prev_argument
-        batch_size=prev_argument.shape[0]
-        
         
-        for ind in range(len(mlp_def["outputs"])):
-            #print("MLP ", ind)
+        num_param_rows=params.shape[0]
+
+        ## the fused path handles shared parameters for any input shape, and per-item parameters for 2-d inputs of the same batch size
+        use_fused_path=use_fused_kernels and (num_param_rows==1 or (prev_argument.dim()==2 and prev_argument.shape[0]==num_param_rows))
+
+        for ind, (u_slice, v_slice, b_slice) in enumerate(mlp_def["slicing_plan"]):
+            
             nonlinear=0
 
             this_rank=mlp_def["used_ranks"][ind]
            
-            this_u, amortization_params=amortization_params[:, :mlp_def["num_u_s"][ind]], amortization_params[:, mlp_def["num_u_s"][ind]:]
-            this_v, amortization_params=amortization_params[:, :mlp_def["num_v_s"][ind]], amortization_params[:, mlp_def["num_v_s"][ind]:]
-            this_b, amortization_params=amortization_params[:, :mlp_def["num_b_s"][ind]], amortization_params[:, mlp_def["num_b_s"][ind]:]
+            this_u=params[:, u_slice]
+            this_v=params[:, v_slice]
+            this_b=params[:, b_slice]
 
             if(mlp_def["svd_mode"]=="smart" or mlp_def["svd_mode"]=="naive"):
                 
@@ -528,9 +585,7 @@ class AmortizableMLP(nn.Module):
                 if(mlp_def["full_weight_matrix_flags"][ind]):
                     # no svd decomposition, the whole weight matrix is stored in the "u" vector
                  
-                    A=this_u.view(-1, mlp_def["outputs"][ind], mlp_def["inputs"][ind])
-                        
-                    nonlinear=self._adaptive_matmul(A, prev)
+                    matrices=[this_u.view(-1, mlp_def["outputs"][ind], mlp_def["inputs"][ind])]
 
                 else:
                    
@@ -539,43 +594,34 @@ class AmortizableMLP(nn.Module):
                     this_u=this_u.view(this_u.shape[0],  int(this_u.shape[1]/this_rank), this_rank) # U
                     this_v=this_v.view(this_v.shape[0], this_rank, int(this_v.shape[1]/this_rank)) # V^T
 
-                    res_intermediate=self._adaptive_matmul(this_v, prev)
-                    nonlinear=self._adaptive_matmul(this_u, res_intermediate)
+                    matrices=[this_v, this_u]
 
             elif(self.svd_mode=="explicit_svd"):
                 
                 ## code not working anymore - has to be rewritten eventually
                 raise NotImplementedError()
-                """
-                this_u=this_u.view(batch_size, int(this_u.shape[1]/this_rank), this_rank) # U
-                this_v=this_v.view(batch_size, this_rank,int(this_v.shape[1]/this_rank)) # V^T
-
-                #print(amortization_params)
-                this_sigmas, amortization_params=amortization_params[:, :mlp_def["sigmas"][ind]], amortization_params[:, mlp_def["sigmas"][ind]:]
-                this_sigmas=NONLINEARITIES["softplus"](this_sigmas.view(i.shape[0], this_rank))+torch.ones_like(this_sigmas)*0.1
-                
-                #print("SIGMAS", this_sigmas[0])
-                res=torch.diag_embed(this_sigmas)
-             
-                A=torch.bmm(this_u, res)
-                
-                A=torch.bmm(A, this_v)
-                """
 
-            ## add bias
+            if(use_fused_path):
 
-            if(mlp_def["num_b_s"][ind]>0):
-              
-                bias_broadcast=nonlinear.dim()-this_b.dim()
-                assert (bias_broadcast >= 0)
+                nonlinear=self._fused_linear(matrices, prev, this_b if mlp_def["num_b_s"][ind]>0 else None)
 
-                slices=[slice(None,None)]+[None]*bias_broadcast+[slice(None,None)]
-                nonlinear=nonlinear+this_b[slices]
-            #else:
+            else:
+                nonlinear=prev
+                for matrix in matrices:
+                    nonlinear=self._adaptive_matmul(matrix, nonlinear)
+
+                ## add bias
+                if(mlp_def["num_b_s"][ind]>0):
+                  
+                    bias_broadcast=nonlinear.dim()-this_b.dim()
+                    assert (bias_broadcast >= 0)
+
+                    slices=tuple([slice(None,None)]+[None]*bias_broadcast+[slice(None,None)])
+                    nonlinear=nonlinear+this_b[slices]
                
             prev=mlp_def["activations"][ind](nonlinear)
 
-        return prev, amortization_params
+        return prev, params[:, mlp_def["num_params"]:]
 
 
     def forward(self, i, extra_inputs=None):
@@ -54,6 +54,7 @@ opts_dict["g"]["kwargs"]["add_skewness"]=(0, [0,1])
 
 opts_dict["g"]["kwargs"]["rotation_mode"]=("householder", ["householder", "triangular_combination", "angles", "cayley", "none"])
 opts_dict["g"]["kwargs"]["nonlinear_stretch_type"]=("classic", ["classic", "rq_splines"])
+opts_dict["g"]["kwargs"]["inversion_solver"]=("bisection_n_newton", ["bisection_n_newton", "adaptive"]) # numerical inversion for sampling with the classic non-linear stretch
 
 # Old Gaussianization flow implementation (deprecated)
 opts_dict["h"] = dict()
@@ -167,6 +168,9 @@ opts_dict["c"]["kwargs"]["solver"] = ("dopri5", ["rk4", "dopri5", "dopri8", "bos
 opts_dict["c"]["kwargs"]["rtol"] = (1e-7, lambda x: (x>0) & (x<1)) ## 
 opts_dict["c"]["kwargs"]["atol"] = (1e-7, lambda x: (x>0) & (x<1)) ## 
 opts_dict["c"]["kwargs"]["step_size"] = (1.0/32.0, lambda x: (x>0) )  ## 
+opts_dict["c"]["kwargs"]["num_steps_per_chart"] = (0, lambda x: x>=0) ## 0: use step_size, >0: fixed number of steps per chart for fixed step solvers
+opts_dict["c"]["kwargs"]["trace_estimator"] = ("exact", ["exact", "hutchinson"]) ## hutchinson: stochastic trace in training, exact trace in evaluation
+opts_dict["c"]["kwargs"]["use_adjoint"] = (1, [0,1]) ## 0: backpropagate directly through the solver steps
 
 
 # fisher-von-mises s2 flow
@@ -5,6 +5,8 @@ import matplotlib
 import matplotlib as mpl
 from matplotlib import _api
 
+from .coverage import contour_index
+
 try:
     import meander
 except:
@@ -19,65 +21,88 @@ except:
 
 
 def find_contour_levels(proportions, pdf_evals, areas):
+    """
+    Finds the pdf levels that enclose the given probability *proportions*. The levels are strictly decreasing.
+
+    Parameters:
+        proportions (list/array): Enclosed probabilities, e.g. [0.68, 0.9].
+        pdf_evals (array): 1-d array of pdf evaluations.
+        areas (array/float): Area (volume) associated with each evaluation.
+
+    Returns:
+        array
+            Levels, one for each proportion.
+    """
 
     assert(len(pdf_evals.shape)==1), "pdf evals must be a 1-d array!"
 
+    return find_contour_levels_batched(proportions, pdf_evals[None,:], areas)[0]
+
+def find_contour_levels_batched(proportions, pdf_evals, areas):
+    """
+    Batched version of *find_contour_levels* for many events that share the same number of pdf evaluations.
+    The cumulative sum is calculated once per event and all proportions of all events are looked up at once.
+
+    Parameters:
+        proportions (list/array): Enclosed probabilities, e.g. [0.68, 0.9].
+        pdf_evals (array): 2-d array of pdf evaluations of shape (E,N).
+        areas (array/float): Area (volume) associated with each evaluation, broadcastable to (E,N).
+
+    Returns:
+        array
+            Levels of shape (E,P).
+    """
+
+    assert(len(pdf_evals.shape)==2), "pdf evals must be a 2-d array!"
+
+    proportions=numpy.atleast_1d(numpy.asarray(proportions, dtype=float))
+
+    num_events, num_evals=pdf_evals.shape
+
     pdf_evals_with_area=pdf_evals*areas
+    if(pdf_evals_with_area.shape!=pdf_evals.shape):
+        pdf_evals_with_area=numpy.broadcast_to(pdf_evals_with_area, pdf_evals.shape)
 
-    levels = []
+    inv_sorted=numpy.argsort(pdf_evals, axis=1)[:,::-1]
 
-    inv_sorted=numpy.argsort(pdf_evals)[::-1]
-    
-    sorted_pdf_with_area = pdf_evals_with_area[inv_sorted] #list(reversed(list(sorted(samples))))
-    sorted_pdf=pdf_evals[inv_sorted]
-   
-    for proportion in proportions:
-     
-        larger_mask=numpy.cumsum(sorted_pdf_with_area) > proportion
-        
-        if(larger_mask.sum()>0):
-            level_index = (numpy.cumsum(sorted_pdf_with_area) > proportion).tolist().index(True)
-            
-            level = (sorted_pdf[level_index] + (sorted_pdf[level_index+1] if level_index+1 < len(sorted_pdf_with_area) else 0)) / 2.0
-            levels.append(level)
-        else:
-            ## did we alrady attach it? must have decreasing sequence
-            
-            levels.append(min(sorted_pdf))
+    sorted_pdf_with_area=numpy.take_along_axis(pdf_evals_with_area, inv_sorted, axis=1)
+    sorted_pdf=numpy.take_along_axis(pdf_evals, inv_sorted, axis=1)
 
-    levels=numpy.array(levels)
+    cumulative=numpy.cumsum(sorted_pdf_with_area, axis=1)
 
-    equal_last_levels=levels==min(sorted_pdf)
+    ## first index with a cumulative sum larger than the proportion
+    ## per-row lookup .. equivalent to a right-sided binary search since the cumulative sums are non-decreasing
+    level_indices=(cumulative[:,:,None]<=proportions[None,None,:]).sum(axis=1)
 
-    if(equal_last_levels.sum()>1):
-        # we have to make the last entries decreasing while being larger or equal than min
-        last_ones=[]
-        for ind in range(equal_last_levels.sum()):
-            last_ones.append(min(sorted_pdf)*(1+ind*0.01))
-        last_ones=last_ones[::-1]
+    min_pdf=sorted_pdf[:,-1:]
 
- 
-        levels[equal_last_levels]=numpy.array(last_ones)
+    found=level_indices<num_evals
+    this_index=numpy.minimum(level_indices, num_evals-1)
+    next_index=numpy.minimum(level_indices+1, num_evals-1)
+
+    this_pdf=numpy.take_along_axis(sorted_pdf, this_index, axis=1)
+    next_pdf=numpy.where(level_indices+1<num_evals, numpy.take_along_axis(sorted_pdf, next_index, axis=1), 0.0)
+
+    levels=numpy.where(found, (this_pdf+next_pdf)/2.0, min_pdf)
+
+    ## levels equal to the minimum have to be made decreasing while being larger or equal than the minimum
+    equal_last_levels=levels==min_pdf
+    num_equal_last=equal_last_levels.sum(axis=1, keepdims=True)
+    position_in_last=numpy.cumsum(equal_last_levels, axis=1)-1
 
+    replace_mask=equal_last_levels & (num_equal_last>1)
+    levels=numpy.where(replace_mask, min_pdf*(1+(num_equal_last-1-position_in_last)*0.01), levels)
+
+    ## transform to strictly decreasing elements .. consecutive equal levels are shifted by their position within the run of equal values
     tweak_offset=1e-10
-    # Initialize the transformed array with the first element
-    transformed_levels = [levels[0]]
-    
-    # Transform to a new array that has strictly decreasing elemeents
-    for i in range(1, len(levels)):
-        # If the current element is the same as the previous one
-        if levels[i] == levels[i - 1]:
-            # Calculate the number of times this element has appeared consecutively
-            count = 1
-            while i - count >= 0 and levels[i] == levels[i - count]:
-                count += 1
-            # Add the element with the offset
-            transformed_levels.append(levels[i] - (count - 1) * tweak_offset)
-        else:
-            # If it's not a repeating element, just add it to the transformed array
-            transformed_levels.append(levels[i])
 
-    levels=numpy.array(transformed_levels)
+    positions=numpy.arange(levels.shape[1])[None,:]
+    run_starts=numpy.ones(levels.shape, dtype=bool)
+    run_starts[:,1:]=levels[:,1:]!=levels[:,:-1]
+
+    run_start_positions=numpy.maximum.accumulate(numpy.where(run_starts, positions, 0), axis=1)
+
+    levels=levels-(positions-run_start_positions)*tweak_offset
 
     return levels
 
@@ -161,6 +186,22 @@ def compute_contours(proportions, pdf_evals, areas, sample_points=None, manifold
        
     return combined_list
 
+def find_closest_contour(true_positions, all_contours, contour_probs):
+    """
+    Finds the contour closest to each true position via a KD-tree over the vertices of all contours (see *coverage.contour_index*).
+
+    Parameters:
+        true_positions (array/Tensor): Shape (D,) or (N,D). Must be in the same coordinates as the contours (embedding coordinates for spheres).
+        all_contours (list): Contours of each level, as returned by *compute_contours*.
+        contour_probs (array): Coverage probability of each contour level.
+
+    Returns:
+        float/array
+            Coverage probability of the closest contour for each true position.
+    """
+
+    return contour_index(all_contours, contour_probs).query(true_positions)
+
 def find_1d_contours(proportions, xvals, pdf_evals_with_area, pdf_evals):
     """
     Find 1D contours for a given level of a 1D function.
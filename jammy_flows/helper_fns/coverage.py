@@ -1,29 +1,80 @@
 import numpy
 import torch
 from scipy import stats
+from scipy import spatial
 
-def find_closest(s, all_xyz_contours, contor_probs_all_cov):
+class contour_index(object):
     """
-    Find closest contour, with a given contour coverage probability, of all passed contours to a given point *s*.
-    Returns coverage probability of closest contour to s.
+    Spatial index over the vertices of many contours. All vertices are concatenated into a single array with a contour label,
+    and nearest-vertex queries are answered by a KD-tree. For contours on a sphere given in embedding (xyz) coordinates, the Euclidean chord distance
+    is monotonic in the great-circle distance, so the nearest vertex is also the nearest vertex on the sphere.
     """
-    cur_min_index=-1
-    overall_min=9999999999999999999999
+    def __init__(self, all_contours, contour_probs):
+        """
+        Parameters:
+            all_contours (list): One entry per contour level, either an array of vertices of shape (N,D) or a list of such arrays (e.g. disconnected contour pieces).
+            contour_probs (list/array): Coverage probability of each contour level.
+        """
+        vertices=[]
+        labels=[]
+
+        for ind, contour in enumerate(all_contours):
+
+            if(type(contour)==list):
+                if(len(contour)==0):
+                    continue
+                contour=numpy.concatenate([numpy.asarray(c) for c in contour], axis=0)
+
+            contour=numpy.asarray(contour)
+
+            if(contour.size==0):
+                continue
+
+            contour=contour.reshape(contour.shape[0], -1)
+
+            vertices.append(contour)
+            labels.append(numpy.full(contour.shape[0], ind))
+
+        assert(len(vertices)>0), "No contour vertices given!"
+
+        self.vertices=numpy.concatenate(vertices, axis=0)
+        self.labels=numpy.concatenate(labels)
+        self.contour_probs=numpy.asarray(contour_probs)
 
-    np_s=s
-    if(type(np_s)==torch.Tensor):
-        np_s=s.cpu().detach().numpy()
+        self.tree=spatial.cKDTree(self.vertices)
 
-    for ind in range(len(all_xyz_contours)):
+    def query(self, points):
+        """
+        Finds the closest contour for each point.
 
-        min_dist=min(numpy.sqrt( numpy.sum((np_s-all_xyz_contours[ind])**2, axis=1)))
+        Parameters:
+            points (array/Tensor): Shape (D,) for a single point or (N,D) for many points.
 
-        if(min_dist<overall_min):
-           
-            overall_min=min_dist
-            cur_min_index=ind
+        Returns:
+            float/array
+                Coverage probability of the closest contour, one per point.
+        """
+        if(type(points)==torch.Tensor):
+            points=points.cpu().detach().numpy()
+
+        points=numpy.asarray(points)
+
+        _, nearest=self.tree.query(points.reshape(-1, self.vertices.shape[1]))
+
+        probs=self.contour_probs[self.labels[nearest]]
+
+        if(points.ndim==1):
+            return probs[0]
+
+        return probs
+
+def find_closest(s, all_xyz_contours, contor_probs_all_cov):
+    """
+    Find closest contour, with a given contour coverage probability, of all passed contours to a given point *s*.
+    Returns coverage probability of closest contour to s. If *s* is of shape (N,D), returns one coverage probability for each of the N points.
+    """
 
-    return contor_probs_all_cov[cur_min_index]
+    return contour_index(all_xyz_contours, contor_probs_all_cov).query(s)
 
 def get_real_coverage_value(true_pos, xy_contours_for_coverage, actual_expected_coverage):
     """
@@ -103,7 +103,262 @@ def obtain_bins_and_visualization_regions(samples, model, percentiles=[3.0,97.0]
 
     return visualization_bounds, density_eval_bounds, histogram_edges
 
-def get_pdf_on_grid(mins_maxs, npts, model, conditional_input=None, s2_norm="standard", s2_rotate_to_true_value=False, true_values=None):
+def _mask_and_transform_grid_positions(eval_positions, model, s2_norm="standard", s2_rotate_to_true_value=False, true_values=None):
+    """
+    Transforms lambert grid coordinates of s2 sub-manifolds to spherical coordinates in-place and masks positions outside of
+    the lambert disc or the simplex.
+    """
+    mask_inner = torch.ones(len(eval_positions), dtype=torch.bool, device=eval_positions.device)
+
+    ## check s2 or simplex visualization
+    for ind, pdf_def in enumerate(model.pdf_defs_list):
+       
+        if (pdf_def == "s2" and s2_norm=="lambert"):
+
+            fix_point=None
+
+            if(s2_rotate_to_true_value and true_values is not None):
+              fix_point=true_values[model.target_dim_indices_intrinsic[ind][0]:model.target_dim_indices_intrinsic[ind][1]]
+           
+            mask_inner = mask_inner & (torch.sqrt(
+                (eval_positions[:, model.target_dim_indices_intrinsic[ind][0]:model.
+                                target_dim_indices_intrinsic[ind][1]]**2).sum(axis=1)) <
+                                       2)
+            ## transform s2 subdimensions from equal-area lambert dimension to real spherical dimensiosn the model can use
+
+            eval_positions[:, model.target_dim_indices_intrinsic[ind][0]:model.
+                           target_dim_indices_intrinsic[ind]
+                           [1]] = cartesian_lambert_to_spherical(
+                               eval_positions[:, model.
+                                              target_dim_indices_intrinsic[ind][0]:model.
+                                              target_dim_indices_intrinsic[ind][1]], fix_point=fix_point)
+
+            # need some extra care, it seems sometimes nans can appear in the trafo step (only happened on GPU?)
+            mask_inner=torch.isfinite(eval_positions[:,0]) & mask_inner
+            mask_inner=torch.isfinite(eval_positions[:,1]) & mask_inner
+
+        elif("c" in pdf_def):
+           
+            ## simplex .. mask everything outside allowed region
+            mask_inner=mask_inner & (eval_positions[:, model.target_dim_indices_intrinsic[ind][0]:model.target_dim_indices_intrinsic[ind][1] ].sum(axis=1) < 1.0)
+
+    return eval_positions, mask_inner
+
+def _lambert_log_correction(eval_positions, model, s2_norm="standard"):
+    """
+    Sum of the log(sin(theta)) factors that turn spherical densities of s2 sub-manifolds into densities in equal-area lambert coordinates.
+    """
+    correction=torch.zeros(len(eval_positions), dtype=eval_positions.dtype, device=eval_positions.device)
+
+    for ind, pdf_def in enumerate(model.pdf_defs_list):
+        if (pdf_def == "s2" and s2_norm=="lambert"):
+            ## first coordinate is theta currently
+           
+            upd=torch.log(torch.sin(eval_positions[:,model.target_dim_indices_intrinsic[ind][0]:model.target_dim_indices_intrinsic[ind][0]+1])).sum(axis=-1)
+            
+            ## angle -> cartesian -> subtract
+            correction+=upd
+
+    return correction
+
+def _grid_axis_order(num_dims):
+    """
+    Grid dimensions ordered from the fastest to the slowest varying index of the flattened grids in *get_pdf_on_grid*, 
+    which result from numpy.meshgrid with 'xy' indexing followed by a transpose.
+    """
+    if(num_dims<2):
+        return list(range(num_dims))
+
+    return [1,0]+list(range(2,num_dims))
+
+def iterate_grid_chunks(npts, num_dims, batch_size=1, chunk_size=100000, device=None):
+    """
+    Lazily iterates over all (event, grid point) combinations of a regular grid with *npts* points per dimension in chunks of at most *chunk_size* items.
+    Only the indices of the current chunk are generated, the full grid is never materialized. The event index is the slowest varying index,
+    the grid points follow the ordering of *get_pdf_on_grid*.
+
+    Parameters:
+        npts (int): Number of grid points per dimension.
+        num_dims (int): Number of grid dimensions.
+        batch_size (int): Number of events that are evaluated on the grid.
+        chunk_size (int): Maximum number of items per chunk.
+        device (torch.device/None): Device of the index tensors.
+
+    Returns:
+        Generator that yields
+
+        int
+            Flat start index of the chunk.
+        Tensor
+            Event index of every item in the chunk, shape (n,).
+        Tensor
+            Grid index of every item in the chunk along each dimension, shape (n, D).
+    """
+    assert(chunk_size>0)
+
+    num_grid_points=npts**num_dims
+    axis_order=_grid_axis_order(num_dims)
+
+    for start in range(0, batch_size*num_grid_points, chunk_size):
+
+        end=min(start+chunk_size, batch_size*num_grid_points)
+
+        flat_index=torch.arange(start, end, device=device)
+        event_index=torch.div(flat_index, num_grid_points, rounding_mode="floor")
+        flat_index=flat_index-event_index*num_grid_points
+
+        grid_index=torch.empty((end-start, num_dims), dtype=torch.long, device=device)
+
+        for dim in axis_order:
+            grid_index[:,dim]=flat_index % npts
+            flat_index=torch.div(flat_index, npts, rounding_mode="floor")
+
+        yield start, event_index, grid_index
+
+def _grid_chunk_evaluator(model, conditional_input):
+    """
+    Returns a function that evaluates the log-pdf of grid positions (in intrinsic coordinates) with the conditional input of the given event indices.
+    The flow parameters are predicted once per event via *pdf.condition* unless the PDF is fully amortized.
+    """
+    if(conditional_input is None):
+        return lambda positions, event_index: model(positions, force_intrinsic_coordinates=True)[0]
+
+    if(model.amortize_everything):
+
+        def evaluate(positions, event_index):
+            if(type(conditional_input)==list):
+                cinput=[ci[event_index] for ci in conditional_input]
+            else:
+                cinput=conditional_input[event_index]
+            return model(positions, conditional_input=cinput, force_intrinsic_coordinates=True)[0]
+
+        return evaluate
+
+    conditioned_model=model.condition(conditional_input)
+
+    return lambda positions, event_index: conditioned_model(positions, conditional_input_index=event_index, force_intrinsic_coordinates=True)[0]
+
+def _get_pdf_on_grid_in_chunks(side_vals, model, conditional_input=None, chunk_size=100000, s2_norm="standard", s2_rotate_to_true_value=False, true_values=None, dtype=None, device=None):
+    """
+    Chunked evaluation of *get_pdf_on_grid*. Grid positions are generated lazily as torch tensors on the evaluation device and the results
+    are written into preallocated output arrays.
+    """
+
+    num_dims=len(side_vals)
+    used_npts=len(side_vals[0])
+    num_grid_points=used_npts**num_dims
+
+    batch_size=1
+    if(conditional_input is not None):
+        if(type(conditional_input)==list):
+            batch_size=conditional_input[0].shape[0]
+            ci_dtype, ci_device=conditional_input[0].dtype, conditional_input[0].device
+        else:
+            batch_size=conditional_input.shape[0]
+            ci_dtype, ci_device=conditional_input.dtype, conditional_input.device
+
+        dtype=ci_dtype if dtype is None else dtype
+        device=ci_device if device is None else device
+
+    else:
+        model_dtype, model_device=model.obtain_current_dtype_n_device()
+
+        dtype=model_dtype if dtype is None else dtype
+        device=model_device if device is None else device
+
+    if(dtype is None):
+        dtype=torch.float64
+
+    torch_side_vals=[torch.from_numpy(numpy.asarray(sv)).to(dtype=dtype, device=device) for sv in side_vals]
+
+    evaluate=_grid_chunk_evaluator(model, conditional_input)
+
+    ## preallocated outputs
+    positions=numpy.empty((num_grid_points, num_dims))
+    res=numpy.empty(batch_size*num_grid_points)
+
+    check_flagged=(conditional_input is None and model.pdf_defs_list[0]=="s2")
+    flagged_coords=[]
+
+    with torch.no_grad():
+
+        for start, event_index, grid_index in iterate_grid_chunks(used_npts, num_dims, batch_size=batch_size, chunk_size=chunk_size, device=device):
+
+            eval_positions=torch.cat([torch_side_vals[dim][grid_index[:,dim]][:,None] for dim in range(num_dims)], dim=1)
+
+            ## the grid positions are the same for every event
+            if(start<num_grid_points):
+                num_first=int((event_index==0).sum())
+                positions[start:start+num_first]=eval_positions[:num_first].cpu().numpy()
+
+            eval_positions, mask_inner=_mask_and_transform_grid_positions(eval_positions, model, s2_norm=s2_norm, s2_rotate_to_true_value=s2_rotate_to_true_value, true_values=true_values)
+
+            chunk_res=(-600.0)*torch.ones(len(eval_positions), dtype=dtype, device=device)
+
+            if(mask_inner.sum()>0):
+
+                log_res=evaluate(eval_positions[mask_inner], event_index[mask_inner])
+                log_res-=_lambert_log_correction(eval_positions[mask_inner], model, s2_norm=s2_norm)
+
+                chunk_res[mask_inner]=log_res.to(chunk_res)
+
+                if(check_flagged):
+                    problematic_pars=model.layer_list[0][0].return_problematic_pars_between_hh_and_intrinsic(eval_positions[mask_inner], flag_pole_distance=0.02)
+
+                    if(problematic_pars.shape[0]>0):
+                        if(s2_norm=="lambert"):
+                            fix_point=None
+                            if(s2_rotate_to_true_value and true_values is not None):
+                                fix_point=true_values[model.target_dim_indices_intrinsic[0][0]:model.target_dim_indices_intrinsic[0][1]]
+                            problematic_pars=spherical_to_cartesian_lambert(problematic_pars, fix_point=fix_point)
+                        flagged_coords.append(problematic_pars.cpu().numpy())
+
+            res[start:start+len(chunk_res)]=chunk_res.cpu().numpy()
+
+    if((numpy.isfinite(res)==False).sum()>0):
+        print("Non-finite evaluation during chunked PDF grid eval..")
+        print((numpy.isfinite(res)==False).sum())
+        print(positions[(numpy.isfinite(res.reshape(batch_size, num_grid_points))==False).any(axis=0)])
+        raise Exception()
+
+    flagged_coords=numpy.concatenate(flagged_coords, axis=0) if len(flagged_coords)>0 else numpy.array([])
+
+    res=res.reshape(*([batch_size]+[used_npts] * num_dims))
+
+    ## read-only view, the positions are shared between all events
+    positions=numpy.broadcast_to(positions.reshape(*([1]+[used_npts] * num_dims + [num_dims])), [batch_size]+[used_npts] * num_dims + [num_dims])
+
+    return positions, res, flagged_coords
+
+def get_pdf_on_grid(mins_maxs, npts, model, conditional_input=None, s2_norm="standard", s2_rotate_to_true_value=False, true_values=None, chunk_size=None, dtype=None, device=None):
+    """
+    Evaluates the PDF on a regular grid in intrinsic coordinates (or lambert coordinates for s2 sub-manifolds with *s2_norm* "lambert").
+
+    Parameters:
+        mins_maxs (list): Grid bounds for every dimension.
+        npts (int): Number of grid points per dimension.
+        model (pdf): The PDF.
+        conditional_input (Tensor/list(Tensor)/None): Conditional input of shape (B, A). Every event is evaluated on the same grid.
+        s2_norm (str): "standard" or "lambert".
+        s2_rotate_to_true_value (bool): Rotates lambert grids to the true value.
+        true_values (Tensor/None): True values used for the lambert rotation.
+        chunk_size (int/None): If given, grid positions are generated lazily in torch and evaluated in chunks of at most *chunk_size* (event, grid point) items
+                               with the flow parameters of the first sub-pdf predicted once per event. Otherwise the full grid is built with numpy and evaluated in a single pass.
+        dtype (torch.dtype/None): Dtype of the chunked evaluation. Defaults to the dtype of the conditional input or of the model.
+        device (torch.device/None): Device of the chunked evaluation. Defaults to the device of the conditional input or of the model.
+
+    Returns:
+        numpy.ndarray
+            Grid positions of shape (B, npts, ..., npts, D).
+        numpy.ndarray
+            Log-pdf evaluations of shape (B, npts, ..., npts). Masked regions are set to -600.
+        float
+            Bin volume.
+        list
+            Sin(zenith) mask.
+        numpy.ndarray
+            Flagged coordinates close to numerically problematic regions.
+    """
 
     side_vals = []
 
@@ -160,6 +415,20 @@ def get_pdf_on_grid(mins_maxs, npts, model, conditional_input=None, s2_norm="sta
                 sin_zen_mask.append(0)
 
         glob_ind += this_sub_dim
+
+    if(chunk_size is not None):
+
+        positions, res, flagged_coords=_get_pdf_on_grid_in_chunks(side_vals, 
+                                                                   model, 
+                                                                   conditional_input=conditional_input, 
+                                                                   chunk_size=chunk_size, 
+                                                                   s2_norm=s2_norm, 
+                                                                   s2_rotate_to_true_value=s2_rotate_to_true_value, 
+                                                                   true_values=true_values,
+                                                                   dtype=dtype,
+                                                                   device=device)
+
+        return positions, res, bin_volumes, sin_zen_mask, flagged_coords
    
     eval_positions = numpy.meshgrid(*side_vals)
 
@@ -170,39 +439,7 @@ def get_pdf_on_grid(mins_maxs, npts, model, conditional_input=None, s2_norm="sta
 
     eval_positions = torch_positions.clone()
 
-    mask_inner = torch.ones(len(torch_positions)) == 1
-
-    ## check s2 or simplex visualization
-    for ind, pdf_def in enumerate(model.pdf_defs_list):
-       
-        if (pdf_def == "s2" and s2_norm=="lambert"):
-
-            fix_point=None
-
-            if(s2_rotate_to_true_value and true_values is not None):
-              fix_point=true_values[model.target_dim_indices_intrinsic[ind][0]:model.target_dim_indices_intrinsic[ind][1]]
-           
-            mask_inner = mask_inner & (torch.sqrt(
-                (eval_positions[:, model.target_dim_indices_intrinsic[ind][0]:model.
-                                target_dim_indices_intrinsic[ind][1]]**2).sum(axis=1)) <
-                                       2)
-            ## transform s2 subdimensions from equal-area lambert dimension to real spherical dimensiosn the model can use
-
-            eval_positions[:, model.target_dim_indices_intrinsic[ind][0]:model.
-                           target_dim_indices_intrinsic[ind]
-                           [1]] = cartesian_lambert_to_spherical(
-                               eval_positions[:, model.
-                                              target_dim_indices_intrinsic[ind][0]:model.
-                                              target_dim_indices_intrinsic[ind][1]], fix_point=fix_point)
-
-            # need some extra care, it seems sometimes nans can appear in the trafo step (only happened on GPU?)
-            mask_inner=torch.isfinite(eval_positions[:,0]) & mask_inner
-            mask_inner=torch.isfinite(eval_positions[:,1]) & mask_inner
-
-        elif("c" in pdf_def):
-           
-            ## simplex .. mask everything outside allowed region
-            mask_inner=mask_inner & (eval_positions[:, model.target_dim_indices_intrinsic[ind][0]:model.target_dim_indices_intrinsic[ind][1] ].sum(axis=1) < 1.0)
+    eval_positions, mask_inner=_mask_and_transform_grid_positions(eval_positions, model, s2_norm=s2_norm, s2_rotate_to_true_value=s2_rotate_to_true_value, true_values=true_values)
 
     batch_size=1
     if (conditional_input is not None):
@@ -227,15 +464,7 @@ def get_pdf_on_grid(mins_maxs, npts, model, conditional_input=None, s2_norm="sta
     log_res, _, _ = model(eval_positions[mask_inner], conditional_input=cinput, force_intrinsic_coordinates=True)
 
     ## update s2+lambert visualizations by adding sin(theta) factors to get proper normalization
-    for ind, pdf_def in enumerate(model.pdf_defs_list):
-        if (pdf_def == "s2" and s2_norm=="lambert"):
-            ## first coordinate is theta currently
-           
-            upd=torch.log(torch.sin(eval_positions[mask_inner][:,model.target_dim_indices_intrinsic[ind][0]:model.target_dim_indices_intrinsic[ind][0]+1])).sum(axis=-1)
-            
-            ## angle -> cartesian -> subtract
-            log_res-=upd
-
+    log_res-=_lambert_log_correction(eval_positions[mask_inner], model, s2_norm=s2_norm)
         
     ## no conditional input and only s2 pdf .. mask bad regions
     flagged_coords=numpy.array([])
@@ -281,6 +510,302 @@ def get_pdf_on_grid(mins_maxs, npts, model, conditional_input=None, s2_norm="sta
     
     return resized_torch_positions, res, bin_volumes, sin_zen_mask, flagged_coords
 
+def obtain_density_eval_bounds_batched(samples, percentiles=[3.0,97.0], relative_buffer=0.1):
+    """
+    Batched version of the density evaluation bounds from *obtain_bins_and_visualization_regions* for purely Euclidean PDFs.
+
+    Parameters:
+        samples (Tensor/numpy.ndarray): Samples of shape (B, S, D), S samples for each of the B events.
+        percentiles (list(float)): Lower and upper percentile that define the region before adding the buffer.
+        relative_buffer (float): Relative extra space that is added on both sides.
+
+    Returns:
+        numpy.ndarray
+            Bounds of shape (B, D, 2).
+    """
+
+    if(type(samples)==torch.Tensor):
+        samples=samples.cpu().numpy()
+
+    assert(samples.ndim==3)
+
+    ## shape (2, B, D)
+    boundaries=numpy.percentile(samples, percentiles, axis=1)
+
+    relative_extra=relative_buffer*(boundaries[1]-boundaries[0])
+
+    return numpy.stack([boundaries[0]-relative_extra, boundaries[1]+relative_extra], axis=-1)
+
+def get_pdf_on_grid_batched(batched_mins_maxs, npts, model, conditional_input=None, dtype=None, device=None, chunk_size=None):
+    """
+    Evaluates a purely Euclidean PDF on a separate regular grid for each event in a single model pass.
+    The grid ordering follows *get_pdf_on_grid*.
+
+    Parameters:
+        batched_mins_maxs (numpy.ndarray): Grid bounds of shape (B, D, 2).
+        npts (int): Number of grid points per dimension.
+        model (pdf): The PDF.
+        conditional_input (Tensor/list(Tensor)/None): Conditional input of shape (B, A), one row per event.
+        dtype (torch.dtype/None): Dtype of evaluation positions. Defaults to float64.
+        device (torch.device/None): Device of evaluation positions.
+        chunk_size (int/None): If given, evaluation positions are generated lazily and evaluated in chunks of at most *chunk_size* (event, grid point) items.
+
+    Returns:
+        numpy.ndarray
+            Grid positions of shape (B, npts, ..., npts, D).
+        numpy.ndarray
+            Log-pdf evaluations of shape (B, npts, ..., npts).
+        numpy.ndarray
+            Bin volumes of shape (B,).
+    """
+
+    for pdf_def in model.pdf_defs_list:
+        assert(pdf_def[0]=="e"), ("Batched grid evaluation only supports Euclidean sub-manifolds, got ", model.pdf_defs_list)
+
+    batched_mins_maxs=numpy.asarray(batched_mins_maxs, dtype=numpy.float64)
+    batch_size, num_dims, _=batched_mins_maxs.shape
+
+    used_npts=npts
+    if(npts<2):
+        used_npts=2
+
+    num_grid_points=used_npts**num_dims
+
+    ## index grid with the same ordering as the meshgrid/resize combination in *get_pdf_on_grid*
+    index_grid=numpy.meshgrid(*([numpy.arange(used_npts)]*num_dims))
+    index_grid=numpy.resize(numpy.array(index_grid).T, (num_grid_points, num_dims))
+
+    lows=batched_mins_maxs[:,:,0]
+    steps=(batched_mins_maxs[:,:,1]-lows)/float(used_npts-1)
+
+    ## (B, N, D)
+    positions=lows[:,None,:]+index_grid[None,:,:]*steps[:,None,:]
+    bin_volumes=numpy.prod(steps, axis=1)
+
+    if(conditional_input is not None):
+        if(type(conditional_input)==list):
+            assert(conditional_input[0].shape[0]==batch_size)
+        else:
+            assert(conditional_input.shape[0]==batch_size)
+    else:
+        assert(batch_size==1), "Batched grid evaluation without conditional input requires a single set of bounds."
+
+    if(chunk_size is not None):
+
+        used_dtype=torch.float64 if dtype is None else dtype
+
+        torch_lows=torch.from_numpy(lows).to(dtype=used_dtype, device=device)
+        torch_steps=torch.from_numpy(steps).to(dtype=used_dtype, device=device)
+
+        evaluate=_grid_chunk_evaluator(model, conditional_input)
+
+        res=numpy.empty(batch_size*num_grid_points)
+
+        with torch.no_grad():
+            for start, event_index, grid_index in iterate_grid_chunks(used_npts, num_dims, batch_size=batch_size, chunk_size=chunk_size, device=device):
+
+                chunk_positions=torch_lows[event_index]+grid_index.to(used_dtype)*torch_steps[event_index]
+
+                res[start:start+len(event_index)]=evaluate(chunk_positions, event_index).cpu().numpy()
+
+    else:
+        torch_positions=torch.from_numpy(positions.reshape(-1, num_dims))
+        torch_positions=torch_positions.to(dtype=torch.float64 if dtype is None else dtype, device=device)
+
+        cinput=None
+        if(conditional_input is not None):
+            if(type(conditional_input)==list):
+                cinput=[ci.repeat_interleave(num_grid_points, dim=0) for ci in conditional_input]
+            else:
+                cinput=conditional_input.repeat_interleave(num_grid_points, dim=0)
+
+        log_res, _, _ = model(torch_positions, conditional_input=cinput, force_intrinsic_coordinates=True)
+
+        res=log_res.cpu().numpy()
+
+    if((numpy.isfinite(res)==False).sum()>0):
+        print("Non-finite evaluation during batched PDF grid eval..")
+        print((numpy.isfinite(res)==False).sum())
+        print(positions.reshape(-1, num_dims)[(numpy.isfinite(res)==False)])
+        raise Exception()
+
+    res=res.reshape(*([batch_size]+[used_npts] * num_dims))
+    positions=positions.reshape(*([batch_size]+[used_npts] * num_dims + [num_dims]))
+
+    return positions, res, bin_volumes
+
+def get_adaptive_positions_and_volumes(samples, mins_maxs, max_entries_per_cell=5, max_depth=None):
+    """
+    Sample-driven k-d tree mesh of a box, the Euclidean analogue of the multiresolution healpix mesh in *get_meshed_positions_and_areas*.
+    Cells are halved along their widest dimension (relative to the box) as long as more than *max_entries_per_cell* samples fall into them.
+    The mesh is therefore fine where the density is high and coarse elsewhere.
+
+    Parameters:
+        samples (numpy.ndarray/Tensor): Samples of shape (S, D).
+        mins_maxs (numpy.ndarray): Box bounds of shape (D, 2). Samples outside of the box are ignored.
+        max_entries_per_cell (int): Cells with more samples are split.
+        max_depth (int/None): Maximum number of splits of a cell. Defaults to 10*D.
+
+    Returns:
+        numpy.ndarray
+            Cell centers of shape (N, D). Sorted for 1-d boxes.
+        numpy.ndarray
+            Cell volumes of shape (N,).
+    """
+
+    if(type(samples)==torch.Tensor):
+        samples=samples.detach().cpu().numpy()
+
+    mins_maxs=numpy.asarray(mins_maxs, dtype=numpy.float64)
+    num_dims=mins_maxs.shape[0]
+
+    assert(samples.ndim==2 and samples.shape[1]==num_dims)
+    assert(max_entries_per_cell>0)
+
+    if(max_depth is None):
+        max_depth=10*num_dims
+
+    box_widths=mins_maxs[:,1]-mins_maxs[:,0]
+
+    inside=((samples>=mins_maxs[None,:,0]) & (samples<=mins_maxs[None,:,1])).all(axis=1)
+    samples=samples[inside]
+
+    lows=mins_maxs[None,:,0].copy()
+    highs=mins_maxs[None,:,1].copy()
+    sample_cell=numpy.zeros(len(samples), dtype=numpy.int64)
+
+    leaf_lows=[]
+    leaf_highs=[]
+
+    for depth in range(max_depth+1):
+
+        split=numpy.bincount(sample_cell, minlength=len(lows))>max_entries_per_cell
+        if(depth==max_depth):
+            split[:]=False
+
+        leaf_lows.append(lows[~split])
+        leaf_highs.append(highs[~split])
+
+        if(split.sum()==0):
+            break
+
+        ## only keep samples of cells that are split and renumber those cells
+        new_cell_index=numpy.cumsum(split)-1
+        keep_samples=split[sample_cell]
+
+        samples=samples[keep_samples]
+        sample_cell=new_cell_index[sample_cell[keep_samples]]
+
+        lows=lows[split]
+        highs=highs[split]
+
+        cell_range=numpy.arange(len(lows))
+        split_dims=numpy.argmax((highs-lows)/box_widths[None,:], axis=1)
+        mids=(lows[cell_range, split_dims]+highs[cell_range, split_dims])/2.0
+
+        lower_highs=highs.copy()
+        lower_highs[cell_range, split_dims]=mids
+        upper_lows=lows.copy()
+        upper_lows[cell_range, split_dims]=mids
+
+        ## children 2c and 2c+1 are the lower and upper half of cell c
+        lows=numpy.stack([lows, upper_lows], axis=1).reshape(-1, num_dims)
+        highs=numpy.stack([lower_highs, highs], axis=1).reshape(-1, num_dims)
+
+        sample_cell=2*sample_cell+(samples[numpy.arange(len(samples)), split_dims[sample_cell]]>=mids[sample_cell])
+
+    leaf_lows=numpy.concatenate(leaf_lows)
+    leaf_highs=numpy.concatenate(leaf_highs)
+
+    centers=(leaf_lows+leaf_highs)/2.0
+    volumes=numpy.prod(leaf_highs-leaf_lows, axis=1)
+
+    if(num_dims==1):
+        order=numpy.argsort(centers[:,0])
+        centers=centers[order]
+        volumes=volumes[order]
+
+    return centers, volumes
+
+def get_adaptive_pdf_scan_batched(samples, model, conditional_input=None, mins_maxs=None, max_entries_per_cell=5, max_depth=None, dtype=None, device=None):
+    """
+    Adaptive pdf scan for PDFs with Euclidean and interval sub-manifolds. Every event gets its own k-d tree mesh (see *get_adaptive_positions_and_volumes*)
+    based on its samples, and the PDF is evaluated at the cell centers of all events in a single model pass.
+
+    Parameters:
+        samples (Tensor/numpy.ndarray): Samples of shape (B, S, D) in intrinsic coordinates.
+        model (pdf): The PDF.
+        conditional_input (Tensor/list(Tensor)/None): Conditional input of shape (B, A), one row per event.
+        mins_maxs (numpy.ndarray/None): Mesh bounds of shape (B, D, 2). Defaults to the 0.5/99.5 percentiles of the samples. Interval dimensions are clipped to the interval.
+        max_entries_per_cell (int): Cells with more samples are split.
+        max_depth (int/None): Maximum number of splits of a cell.
+        dtype (torch.dtype/None): Dtype of evaluation positions. Defaults to float64.
+        device (torch.device/None): Device of evaluation positions.
+
+    Returns:
+        list(tuple)
+            One tuple (positions (N,D), log-pdf evaluations (N,), cell volumes (N,)) per event.
+    """
+
+    for pdf_def in model.pdf_defs_list:
+        assert(pdf_def[0]=="e" or pdf_def[0]=="i"), ("Adaptive pdf scan only supports Euclidean and interval sub-manifolds, got ", model.pdf_defs_list)
+
+    if(type(samples)==torch.Tensor):
+        samples=samples.detach().cpu().numpy()
+
+    assert(samples.ndim==3)
+
+    batch_size=samples.shape[0]
+
+    if(conditional_input is not None):
+        if(type(conditional_input)==list):
+            assert(conditional_input[0].shape[0]==batch_size)
+        else:
+            assert(conditional_input.shape[0]==batch_size)
+    else:
+        assert(batch_size==1), "Adaptive pdf scan without conditional input requires a single event."
+
+    if(mins_maxs is None):
+        mins_maxs=obtain_density_eval_bounds_batched(samples, percentiles=[0.5,99.5])
+
+    mins_maxs=numpy.array(mins_maxs, dtype=numpy.float64)
+
+    for pdf_index, pdf_def in enumerate(model.pdf_defs_list):
+        if(pdf_def[0]=="i"):
+            dim_index=model.target_dim_indices_intrinsic[pdf_index][0]
+
+            mins_maxs[:,dim_index,0]=numpy.maximum(mins_maxs[:,dim_index,0], model.layer_list[pdf_index][-1].low_boundary+1e-5)
+            mins_maxs[:,dim_index,1]=numpy.minimum(mins_maxs[:,dim_index,1], model.layer_list[pdf_index][-1].high_boundary-1e-5)
+
+    all_positions=[]
+    all_volumes=[]
+
+    for ind in range(batch_size):
+        positions, volumes=get_adaptive_positions_and_volumes(samples[ind], mins_maxs[ind], max_entries_per_cell=max_entries_per_cell, max_depth=max_depth)
+
+        all_positions.append(positions)
+        all_volumes.append(volumes)
+
+    num_positions=torch.LongTensor([len(p) for p in all_positions])
+
+    torch_positions=torch.from_numpy(numpy.concatenate(all_positions)).to(dtype=torch.float64 if dtype is None else dtype, device=device)
+    event_index=torch.arange(batch_size).repeat_interleave(num_positions).to(torch_positions.device)
+
+    evaluate=_grid_chunk_evaluator(model, conditional_input)
+
+    with torch.no_grad():
+        log_res=evaluate(torch_positions, event_index).cpu().numpy()
+
+    if((numpy.isfinite(log_res)==False).sum()>0):
+        print("Non-finite evaluation during adaptive PDF scan..")
+        print((numpy.isfinite(log_res)==False).sum())
+        print(torch_positions.cpu().numpy()[(numpy.isfinite(log_res)==False)])
+        raise Exception()
+
+    split_indices=numpy.cumsum(num_positions.numpy())[:-1]
+
+    return [(all_positions[ind], cur_log_res, all_volumes[ind]) for ind, cur_log_res in enumerate(numpy.split(log_res, split_indices))]
+
 def rotate_coords_to(theta, phi, target, reverse=False):
 
   target_theta=target[0].cpu().numpy()
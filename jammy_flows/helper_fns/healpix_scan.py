@@ -0,0 +1,242 @@
+import torch
+import numpy
+
+try:
+    import healpy
+except:
+    print("Cannot use healpy functionality. Install healpy, if you need to do entropy scanning!")
+
+"""
+Batched HEALPix scans of pure s2 PDFs. All events share the same precomputed pixel-center embedding tensor, and high-density
+pixels can be refined adaptively (multi-order coverage map, MOC) until the scan normalizes to a target accuracy.
+"""
+
+## full-sky pixel centers in embedding coordinates (nested ordering), keyed by (nside, dtype, device)
+_pixel_center_cache=dict()
+
+def obtain_pixel_centers(nside, dtype=torch.float64, device=torch.device("cpu")):
+    """
+    Embedding coordinates of all HEALPix pixel centers for a given *nside* in nested ordering. The result is cached, so repeated scans reuse the same tensor.
+
+    Parameters:
+        nside (int): HEALPix nside.
+        dtype (torch.dtype): Dtype of the returned tensor.
+        device (torch.device): Device of the returned tensor.
+
+    Returns:
+        Tensor
+            Pixel centers of shape (12*nside**2, 3).
+    """
+    key=(nside, dtype, device)
+
+    if(key not in _pixel_center_cache):
+        _pixel_center_cache[key]=_pixel_vectors(nside, numpy.arange(healpy.nside2npix(nside)), dtype, device)
+
+    return _pixel_center_cache[key]
+
+def _pixel_vectors(nsides, ipix, dtype, device):
+    """
+    Embedding coordinates of nested pixel centers, where *nsides* can be a single nside or one nside per pixel.
+    """
+    nsides=numpy.broadcast_to(nsides, ipix.shape)
+
+    xyz=numpy.zeros((len(ipix), 3))
+
+    for cur_nside in numpy.unique(nsides):
+        mask=nsides==cur_nside
+        xyz[mask]=numpy.stack(healpy.pix2vec(int(cur_nside), ipix[mask], nest=True), axis=1)
+
+    return torch.from_numpy(xyz).to(dtype=dtype, device=device)
+
+def _scan_chunk_evaluator(pdf, conditional_input, event_start, num_events):
+    """
+    Returns a function that evaluates the log-pdf at embedding positions with the conditional input of the given event indices (relative to *event_start*).
+    The flow parameters are predicted once per event via *pdf.condition* unless the PDF is fully amortized.
+    """
+    if(conditional_input is None):
+        return lambda positions, local_event_index: pdf(positions, force_embedding_coordinates=True)[0]
+
+    if(type(conditional_input)==list):
+        chunk_input=[ci[event_start:event_start+num_events] for ci in conditional_input]
+    else:
+        chunk_input=conditional_input[event_start:event_start+num_events]
+
+    if(pdf.amortize_everything):
+
+        def evaluate(positions, local_event_index):
+            if(type(chunk_input)==list):
+                cinput=[ci[local_event_index] for ci in chunk_input]
+            else:
+                cinput=chunk_input[local_event_index]
+            return pdf(positions, conditional_input=cinput, force_embedding_coordinates=True)[0]
+
+        return evaluate
+
+    conditioned_pdf=pdf.condition(chunk_input)
+
+    return lambda positions, local_event_index: conditioned_pdf(positions, conditional_input_index=local_event_index, force_embedding_coordinates=True)[0]
+
+def _iterate_position_chunks(position_bank, position_indices, local_event_indices, chunk_size):
+    """
+    Yields (slice, positions, local event indices) for chunks of at most *chunk_size* items. Positions are gathered from the shared *position_bank* only for the current chunk.
+    """
+    for chunk_start in range(0, position_indices.shape[0], chunk_size):
+        chunk_slice=slice(chunk_start, chunk_start+chunk_size)
+
+        yield chunk_slice, position_bank[position_indices[chunk_slice]], local_event_indices[chunk_slice]
+
+def healpix_scan_s2(pdf,
+                    conditional_input=None,
+                    nside=32,
+                    chunk_size=100000,
+                    target_accuracy=None,
+                    moc_pixel_mass=1e-3,
+                    max_nside=4096,
+                    reference_log_pdf_fn=None,
+                    samplesize=0,
+                    dtype=None,
+                    device=None):
+    """
+    Scans a pure s2 PDF on a HEALPix grid for many events at once and reduces the scan to the entropy, the first moment and, if a reference
+    density is given, the cross entropy and KL divergence. Pixel masses are normalized to one per event before the reduction.
+    Events are processed in chunks such that a forward pass sees at most *chunk_size* positions. The flow parameters are predicted once per event via *pdf.condition*,
+    and positions are gathered from the shared pixel-center tensor per forward chunk.
+
+    Parameters:
+        pdf (jammy_flows.pdf): A PDF with *pdf_defs_list* equal to ["s2"].
+        conditional_input (Tensor/list(Tensor)/None): Conditional input of shape (B, A), one row per event.
+        nside (int): Base HEALPix nside, shared by all events.
+        chunk_size (int): Maximum number of positions per forward pass.
+        target_accuracy (float/None): If given, pixels of events whose summed pixel mass deviates from one by more than this are refined (MOC) until the accuracy is met or *max_nside* is reached.
+        moc_pixel_mass (float): Pixels above this mass are always refined. If an unconverged event has no such pixel, its pixels with at least half of its maximum pixel mass are refined.
+        max_nside (int): Maximum nside of refined pixels.
+        reference_log_pdf_fn (function/None): Function that takes positions of shape (M, 3) and event indices of shape (M,) and returns reference log densities of shape (M,).
+        samplesize (int): If larger than zero, also returns this many pixel-center samples per event, drawn proportional to pixel mass.
+        dtype (torch dtype): If given, uses this dtype. Otherwise uses dtype from parameters.
+        device (torch.device): If given, uses this device. Otherwise uses device from parameters.
+
+    Returns:
+        dict
+            "entropy", "normalization" and "num_evals" of shape (B,), "mean" of shape (B, 3), "cross_entropy" and "kl_diff" of shape (B,) if a reference is given,
+            and "samples" of shape (B, samplesize, 3) if *samplesize* is larger than zero.
+    """
+    assert(pdf.pdf_defs_list==["s2"]), "HEALPix scans require a pure s2 PDF."
+
+    used_dtype, used_device=pdf.obtain_current_dtype_n_device()
+
+    if(device is not None):
+        used_device=device
+    if(dtype is not None):
+        used_dtype=dtype
+
+    batch_size=1
+    if(conditional_input is not None):
+        batch_size=conditional_input[0].shape[0] if type(conditional_input)==list else conditional_input.shape[0]
+
+    pixel_centers=obtain_pixel_centers(nside, dtype=used_dtype, device=used_device)
+    num_pix=pixel_centers.shape[0]
+
+    events_per_chunk=max(1, chunk_size//num_pix)
+
+    results=dict()
+    for key in ["entropy", "normalization", "num_evals", "mean", "cross_entropy", "kl_diff", "samples"]:
+        results[key]=[]
+
+    with torch.no_grad():
+
+        for event_start in range(0, batch_size, events_per_chunk):
+
+            num_events=min(events_per_chunk, batch_size-event_start)
+
+            evaluate=_scan_chunk_evaluator(pdf, conditional_input, event_start, num_events)
+
+            ## flat pixel lists of all events in this chunk .. positions are indices into a bank that starts with the shared pixel centers
+            position_bank=pixel_centers
+            local_indices=torch.arange(num_events, device=used_device).repeat_interleave(num_pix)
+            position_indices=torch.arange(num_pix, device=used_device).repeat(num_events)
+            nsides=numpy.full(num_events*num_pix, nside, dtype=numpy.int64)
+            ipix=numpy.tile(numpy.arange(num_pix, dtype=numpy.int64), num_events)
+
+            log_pdf=torch.cat([evaluate(positions, index) for _, positions, index in _iterate_position_chunks(position_bank, position_indices, local_indices, chunk_size)])
+
+            while(True):
+
+                log_mass=log_pdf+torch.from_numpy(numpy.log(4*numpy.pi/(12.0*nsides**2))).to(log_pdf)
+                mass=log_mass.exp()
+
+                normalization=torch.zeros(num_events, dtype=used_dtype, device=used_device).index_add_(0, local_indices, mass)
+
+                if(target_accuracy is None):
+                    break
+
+                unconverged=(normalization-1.0).abs()>target_accuracy
+
+                refinable=unconverged[local_indices] & torch.from_numpy(nsides<max_nside).to(used_device)
+
+                ## events without pixels above *moc_pixel_mass* refine their highest-mass pixels instead
+                max_refinable_mass=torch.zeros(num_events, dtype=used_dtype, device=used_device).scatter_reduce_(0, local_indices, torch.where(refinable, mass, torch.zeros_like(mass)), reduce="amax")
+                pixel_mass_threshold=torch.clamp(0.5*max_refinable_mass, max=moc_pixel_mass)[local_indices]
+
+                refine=refinable & (mass>0) & (mass>=pixel_mass_threshold)
+
+                if(refine.sum()==0):
+                    if(unconverged.sum()>0):
+                        print("HEALPix scan: %d events did not reach the target accuracy %.2e at max nside %d" % (int(unconverged.sum()), target_accuracy, max_nside))
+                    break
+
+                ## nested children of refined pixels
+                refine_np=refine.cpu().numpy()
+
+                child_nsides=numpy.repeat(2*nsides[refine_np], 4)
+                child_ipix=(4*ipix[refine_np][:,None]+numpy.arange(4)[None,:]).flatten()
+                child_local_indices=local_indices[refine].repeat_interleave(4)
+                child_position_indices=position_bank.shape[0]+torch.arange(len(child_ipix), device=used_device)
+
+                position_bank=torch.cat([position_bank, _pixel_vectors(child_nsides, child_ipix, used_dtype, used_device)])
+
+                child_log_pdf=torch.cat([evaluate(positions, index) for _, positions, index in _iterate_position_chunks(position_bank, child_position_indices, child_local_indices, chunk_size)])
+
+                local_indices=torch.cat([local_indices[~refine], child_local_indices])
+                position_indices=torch.cat([position_indices[~refine], child_position_indices])
+                nsides=numpy.concatenate([nsides[~refine_np], child_nsides])
+                ipix=numpy.concatenate([ipix[~refine_np], child_ipix])
+                log_pdf=torch.cat([log_pdf[~refine], child_log_pdf])
+
+            weights=mass/normalization[local_indices]
+
+            results["normalization"].append(normalization)
+            num_evals=torch.bincount(local_indices, minlength=num_events)
+
+            results["num_evals"].append(num_evals)
+            results["entropy"].append(torch.zeros_like(normalization).index_add_(0, local_indices, -weights*log_pdf))
+
+            mean=torch.zeros(num_events, 3, dtype=used_dtype, device=used_device)
+            cross_entropy=torch.zeros_like(normalization)
+
+            for chunk_slice, positions, index in _iterate_position_chunks(position_bank, position_indices, local_indices, chunk_size):
+                mean.index_add_(0, index, weights[chunk_slice,None]*positions)
+
+                if(reference_log_pdf_fn is not None):
+                    cross_entropy.index_add_(0, index, -weights[chunk_slice]*reference_log_pdf_fn(positions, index+event_start))
+
+            results["mean"].append(mean)
+
+            if(reference_log_pdf_fn is not None):
+                results["cross_entropy"].append(cross_entropy)
+                results["kl_diff"].append(cross_entropy-results["entropy"][-1])
+
+            if(samplesize>0):
+                ## inverse CDF sampling within each event's segment of the sorted flat pixel list
+                sorted_order=torch.argsort(local_indices, stable=True)
+                cumulative=weights[sorted_order].cumsum(dim=0)
+
+                segment_starts=torch.arange(num_events, dtype=used_dtype, device=used_device)
+                uniforms=segment_starts[:,None]+torch.rand(num_events, samplesize, dtype=used_dtype, device=used_device)
+
+                ## guard against round-off at segment boundaries
+                segment_ends=num_evals.cumsum(dim=0)
+                sample_positions=torch.searchsorted(cumulative, uniforms).clamp(min=(segment_ends-num_evals)[:,None], max=(segment_ends-1)[:,None]).flatten()
+
+                results["samples"].append(position_bank[position_indices[sorted_order][sample_positions]].reshape(num_events, samplesize, 3))
+
+    return dict((key, torch.cat(value, dim=0)) for key, value in results.items() if len(value)>0)
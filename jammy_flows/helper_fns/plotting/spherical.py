@@ -538,6 +538,64 @@ def get_multiresolution_evals(pdf,
 
     return eval_positions, log_pdf, pdf_evals, eval_areas, moc_map
 
+def get_multiresolution_evals_batched(pdf,
+                                      conditional_input,
+                                      samplesize=10000,
+                                      max_entries_per_pixel=5):
+    """
+    Batched version of *get_multiresolution_evals* for a pure s2 PDF. Samples all events in one pass, meshes the sky per event, and evaluates
+    the PDF at all mesh positions of all events in a second pass.
+
+    Parameters:
+        conditional_input (Tensor/list(Tensor)): Conditional input of shape (B, A), one row per event.
+
+    Returns:
+        list(tuple)
+            One tuple (eval_positions, log_pdf, pdf_evals, eval_areas, moc_map) per event.
+    """
+    assert(pdf.pdf_defs_list==["s2"]), "Batched multiresolution evaluation requires a pure s2 PDF."
+
+    if(type(conditional_input)==list):
+        batch_size=conditional_input[0].shape[0]
+        data_summary_repeated=[ci.repeat_interleave(samplesize, dim=0) for ci in conditional_input]
+    else:
+        batch_size=conditional_input.shape[0]
+        data_summary_repeated=conditional_input.repeat_interleave(samplesize, dim=0)
+
+    samples,_,_,_=pdf.sample(samplesize=batch_size*samplesize, conditional_input=data_summary_repeated)
+    samples=samples.reshape(batch_size, samplesize, -1)
+
+    all_positions=[]
+    all_areas=[]
+    all_moc_maps=[]
+
+    for ind in range(batch_size):
+        eval_positions, eval_areas, moc_map=get_meshed_positions_and_areas(samples[ind],max_entries_per_pixel=max_entries_per_pixel)
+
+        all_positions.append(eval_positions)
+        all_areas.append(eval_areas)
+        all_moc_maps.append(moc_map)
+
+    num_positions=torch.LongTensor([len(p) for p in all_positions]).to(samples.device)
+
+    xyz_positions=pdf.transform_target_into_returnable_params(torch.from_numpy(numpy.concatenate(all_positions)).to(samples))
+
+    if(type(conditional_input)==list):
+        eval_input=[ci.repeat_interleave(num_positions, dim=0) for ci in conditional_input]
+    else:
+        eval_input=conditional_input.repeat_interleave(num_positions, dim=0)
+
+    log_pdf,_,_=pdf(xyz_positions, force_embedding_coordinates=True, conditional_input=eval_input)
+    log_pdf=log_pdf.cpu().detach().numpy()
+
+    results=[]
+    split_indices=numpy.cumsum(num_positions.cpu().numpy())[:-1]
+
+    for ind, cur_log_pdf in enumerate(numpy.split(log_pdf, split_indices)):
+        results.append((all_positions[ind], cur_log_pdf, numpy.exp(cur_log_pdf), all_areas[ind], all_moc_maps[ind]))
+
+    return results
+
 
 def plot_multiresolution_healpy(pdf,
                                 fig=None, 
@@ -0,0 +1,225 @@
+import torch
+import collections
+import time
+
+## iteration bookkeeping of the inversion solvers and continuous flows (filled by *record_iterations* / *record_ode_evals*) .. None if disabled
+iteration_record=None
+
+def record_iterations(num_bisection_iter, num_newton_iter):
+    """
+    Records one solver call with the given numbers of bisection and Newton iterations, if a profiler is active.
+    """
+    if(iteration_record is not None):
+        iteration_record["num_solver_calls"]+=1
+        iteration_record["num_bisection_iter"]+=num_bisection_iter
+        iteration_record["num_newton_iter"]+=num_newton_iter
+
+def record_ode_evals(num_evals):
+    """
+    Records the number of ODE function evaluations of a continuous flow, if a profiler is active.
+    """
+    if(iteration_record is not None):
+        iteration_record["num_ode_evals"]=iteration_record.get("num_ode_evals", 0)+num_evals
+
+def _new_entry():
+
+    return dict(num_calls=0,
+                total_time=0.0,
+                num_solver_calls=0,
+                num_bisection_iter=0,
+                num_newton_iter=0,
+                num_ode_evals=0,
+                peak_memory=None)
+
+class layer_profiler(object):
+    """
+    Opt-in instrumentation of a *pdf*. While active, it records wall time, bisection/Newton iteration counts, ODE function evaluations and (on CUDA) peak allocated memory of
+    every *flow_mapping* / *inv_flow_mapping* call of each layer, every MLP predictor call and every *transform_target_space* call.
+    Usually created via the *pdf.profile()* context manager.
+    """
+    def __init__(self, pdf, synchronize_cuda=True):
+        """
+        Parameters:
+            pdf (jammy_flows.pdf): The PDF to instrument.
+            synchronize_cuda (bool): Synchronize CUDA before and after each timed call, so wall times are attributed correctly.
+        """
+        self.pdf=pdf
+        self.synchronize_cuda=synchronize_cuda
+
+        self.records=collections.OrderedDict()
+
+        ## (object, attribute name) of all wrapped callables
+        self._wrapped=[]
+        self._active=False
+
+        ## nesting depth of instrumented calls
+        self._depth=0
+
+    def _sub_pdf_key(self, pdf_index):
+
+        return "%.2d_%s" % (pdf_index, self.pdf.pdf_defs_list[pdf_index])
+
+    def _wrap(self, obj, attr_name, keys):
+
+        original=getattr(obj, attr_name)
+
+        def timed_call(*args, **kwargs):
+            return self._timed_call(keys, original, *args, **kwargs)
+
+        ## instance attribute shadows the class method until it is deleted again in *stop*
+        object.__setattr__(obj, attr_name, timed_call)
+
+        self._wrapped.append((obj, attr_name))
+
+    def _timed_call(self, keys, fn, *args, **kwargs):
+
+        use_cuda=torch.cuda.is_available() and torch.cuda.is_initialized()
+
+        if(use_cuda):
+            if(self.synchronize_cuda):
+                torch.cuda.synchronize()
+
+            ## peak statistics are only reset when entering the outermost instrumented call, so nested calls do not wipe the peak of the enclosing call
+            if(self._depth==0):
+                torch.cuda.reset_peak_memory_stats()
+
+            mem_before=torch.cuda.memory_allocated()
+
+        self._depth+=1
+
+        ## iteration counts of nested calls are attributed to the innermost instrumented call
+        global iteration_record
+
+        previous_record=iteration_record
+        iteration_record=dict(num_solver_calls=0, num_bisection_iter=0, num_newton_iter=0, num_ode_evals=0)
+
+        tbef=time.perf_counter()
+
+        try:
+            result=fn(*args, **kwargs)
+        finally:
+
+            if(use_cuda and self.synchronize_cuda):
+                torch.cuda.synchronize()
+
+            elapsed=time.perf_counter()-tbef
+
+            iterations=iteration_record
+            iteration_record=previous_record
+
+            self._depth-=1
+
+        entry=self.records
+        for key_index, k in enumerate(keys):
+            if(k not in entry):
+                entry[k]=_new_entry() if key_index==(len(keys)-1) else collections.OrderedDict()
+            entry=entry[k]
+
+        entry["num_calls"]+=1
+        entry["total_time"]+=elapsed
+
+        for k in iterations.keys():
+            entry[k]+=iterations[k]
+
+        if(use_cuda):
+            ## peak above the allocation on entry .. for nested calls an upper bound, since earlier peaks of the enclosing call are included
+            peak=max(torch.cuda.max_memory_allocated()-mem_before, 0)
+            entry["peak_memory"]=peak if entry["peak_memory"] is None else max(entry["peak_memory"], peak)
+
+        return result
+
+    def start(self):
+        """
+        Installs the instrumentation.
+        """
+        assert(self._active==False), "Profiler is already active!"
+
+        for pdf_index, pdf_layers in enumerate(self.pdf.layer_list):
+
+            sub_pdf_key=self._sub_pdf_key(pdf_index)
+
+            for layer_index, layer in enumerate(pdf_layers):
+
+                layer_key="%.2d_%s" % (layer_index, self.pdf.flow_defs_list[pdf_index][layer_index])
+
+                self._wrap(layer, "flow_mapping", [sub_pdf_key, layer_key, "flow_mapping"])
+                self._wrap(layer, "inv_flow_mapping", [sub_pdf_key, layer_key, "inv_flow_mapping"])
+
+            if(self.pdf.mlp_predictors[pdf_index] is not None):
+                self._wrap(self.pdf.mlp_predictors[pdf_index], "forward", [sub_pdf_key, "mlp_predictor"])
+
+        self._wrap(self.pdf, "transform_target_space", ["transform_target_space"])
+
+        self._active=True
+
+        return self
+
+    def stop(self):
+        """
+        Removes the instrumentation. Recorded results are kept.
+        """
+        for obj, attr_name in self._wrapped:
+            object.__delattr__(obj, attr_name)
+
+        self._wrapped=[]
+        self._active=False
+
+    def reset(self):
+        """
+        Deletes all recorded results.
+        """
+        self.records=collections.OrderedDict()
+
+    def report(self):
+        """
+        Returns the recorded results.
+
+        Returns:
+            dict
+                Nested dictionary keyed by sub-pdf ("00_e2", ..) and layer ("00_g", ..), followed by the mapping direction ("flow_mapping" / "inv_flow_mapping"),
+                with the MLP predictor under "mlp_predictor" of each sub-pdf and the target-space transformations under the top-level key "transform_target_space".
+                Each leaf holds *num_calls*, *total_time* (s), *num_solver_calls*, *num_bisection_iter*, *num_newton_iter*, *num_ode_evals* (vector-field evaluations of 
+                continuous flows) and *peak_memory* (bytes, None if not on CUDA).
+        """
+        def copy_dict(d):
+            return dict([(k, copy_dict(v) if isinstance(v, collections.OrderedDict) else dict(v)) for k, v in d.items()])
+
+        return copy_dict(self.records)
+
+    def summary(self, sort_by_time=True):
+        """
+        Returns a human-readable table of all recorded calls.
+
+        Parameters:
+            sort_by_time (bool): Sort the rows by total time, descending.
+
+        Returns:
+            str
+        """
+        rows=[]
+
+        def collect(prefix, d):
+            for k, v in d.items():
+                if("num_calls" in v):
+                    rows.append(("/".join(prefix+[k]), v))
+                else:
+                    collect(prefix+[k], v)
+
+        collect([], self.records)
+
+        if(sort_by_time):
+            rows=sorted(rows, key=lambda r: -r[1]["total_time"])
+
+        lines=["%-45s %8s %12s %10s %10s %10s %12s" % ("call", "calls", "time [s]", "bisection", "newton", "ode evals", "peak [MB]")]
+
+        for name, v in rows:
+            peak="-" if v["peak_memory"] is None else "%.2f" % (v["peak_memory"]/1e6)
+            lines.append("%-45s %8d %12.5f %10d %10d %10d %12s" % (name, v["num_calls"], v["total_time"], v["num_bisection_iter"], v["num_newton_iter"], v["num_ode_evals"], peak))
+
+        return "\n".join(lines)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
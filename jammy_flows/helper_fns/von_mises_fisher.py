@@ -0,0 +1,159 @@
+import torch
+import numpy
+
+"""
+Batched torch functions for von Mises-Fisher distributions on the circle (p=2) and the 2-sphere (p=3), where p is the embedding dimension.
+Used for the Fisher-von Mises approximations in *pdf.marginal_moments*.
+"""
+
+def mean_resultant_length(kappa, p):
+    """
+    Mean resultant length A_p(kappa) = I_{p/2}(kappa)/I_{p/2-1}(kappa), i.e. the length of the expected unit vector.
+
+    Parameters:
+        kappa (Tensor): Concentration parameters.
+        p (int): Embedding dimension, 2 (circle) or 3 (2-sphere).
+
+    Returns:
+        Tensor
+            A_p(kappa) of the same shape as *kappa*.
+    """
+    if(p==2):
+        ## exponentially scaled Bessel functions avoid overflow for large kappa
+        return torch.special.i1e(kappa)/torch.special.i0e(kappa)
+    elif(p==3):
+        ## closed form from abramovitz & stegun (p.443)
+        return 1.0/torch.tanh(kappa)-1.0/kappa
+    else:
+        raise Exception("Von Mises-Fisher functions are only implemented for p=2 and p=3, got p=%d" % p)
+
+def log_normalization(kappa, p):
+    """
+    Log of the normalization constant C_p(kappa) of the density C_p(kappa) exp(kappa mu^T x).
+
+    Parameters:
+        kappa (Tensor): Concentration parameters.
+        p (int): Embedding dimension, 2 (circle) or 3 (2-sphere).
+
+    Returns:
+        Tensor
+            log C_p(kappa) of the same shape as *kappa*.
+    """
+    if(p==2):
+        ## C = 1/(2 pi I_0(kappa))
+        return -numpy.log(2*numpy.pi)-(torch.log(torch.special.i0e(kappa))+kappa)
+    elif(p==3):
+        ## C = kappa/(2 pi (e^kappa - e^-kappa))
+        return torch.log(kappa)-numpy.log(2*numpy.pi)-kappa-torch.log1p(-torch.exp(-2.0*kappa))
+    else:
+        raise Exception("Von Mises-Fisher functions are only implemented for p=2 and p=3, got p=%d" % p)
+
+def solve_kappa(normalized_length_R, p, abs_precision=1e-7, max_iter=20):
+    """
+    Maximum likelihood concentration parameter, i.e. the solution of A_p(kappa) = R, with batched Newton iterations.
+    Starts from the approximation of Banerjee et al. (2005), and items whose update is smaller than *abs_precision* are frozen.
+
+    Parameters:
+        normalized_length_R (Tensor): Mean resultant lengths R of arbitrary shape. Values are clamped to the open interval (0,1).
+        p (int): Embedding dimension, 2 (circle) or 3 (2-sphere).
+        abs_precision (float): Absolute precision of kappa.
+        max_iter (int): Maximum number of Newton iterations.
+
+    Returns:
+        Tensor
+            Concentration parameters of the same shape as *normalized_length_R*.
+    """
+    ## R=1 (e.g. a single sample or identical samples) or round-off above 1 would give infinite or negative kappa
+    eps=torch.finfo(normalized_length_R.dtype).eps
+    normalized_length_R=normalized_length_R.clamp(min=eps, max=1.0-eps)
+
+    kappa=normalized_length_R*(p-normalized_length_R**2)/(1-normalized_length_R**2)
+
+    active=torch.ones_like(kappa, dtype=torch.bool)
+
+    for i in range(max_iter):
+
+        a_p_k=mean_resultant_length(kappa, p)
+
+        ## A'(kappa) = 1 - A^2 - (p-1)/kappa A
+        new_kappa=kappa-(a_p_k-normalized_length_R)/(1.0-a_p_k**2-((p-1.0)/kappa)*a_p_k)
+
+        new_kappa=torch.where(active, new_kappa, kappa)
+
+        active=active & (torch.abs(new_kappa-kappa)>=abs_precision)
+
+        kappa=new_kappa
+
+        if(active.sum()==0):
+            break
+
+    return kappa
+
+def sample_von_mises_fisher(mu, kappa, samplesize, max_rejection_rounds=1000):
+    """
+    Draws samples from von Mises-Fisher distributions for a whole batch of mean directions and concentrations. The component along the mean is drawn with
+    Wood's rejection sampler (https://doi.org/10.1080/03610919408813161), where only rejected items are redrawn, and with the exact inverse CDF for p=3.
+    The orthogonal component is a uniformly distributed direction in the tangent space of the mean.
+
+    Parameters:
+        mu (Tensor): Unit mean directions of shape (B, p).
+        kappa (Tensor): Concentration parameters of shape (B,) or (B,1).
+        samplesize (int): Number of samples per batch item.
+        max_rejection_rounds (int): Maximum number of rejection sampling rounds before an exception is raised.
+
+    Returns:
+        Tensor
+            Samples of shape (B, samplesize, p).
+    """
+    batch_size, p=mu.shape
+
+    assert(torch.isfinite(kappa).all() and (kappa>0).all()), "Concentration parameters must be finite and positive."
+
+    kappa=kappa.reshape(batch_size, 1).expand(batch_size, samplesize)
+
+    if(p==3):
+
+        uniforms=torch.rand(size=(batch_size, samplesize), dtype=mu.dtype, device=mu.device)
+
+        w=1.0+torch.log(uniforms+(1.0-uniforms)*torch.exp(-2.0*kappa))/kappa
+
+    else:
+
+        b=(p-1.0)/(2.0*kappa+torch.sqrt(4.0*kappa**2+(p-1.0)**2))
+        x0=(1.0-b)/(1.0+b)
+        c=kappa*x0+(p-1.0)*torch.log(1.0-x0**2)
+
+        beta=torch.distributions.Beta(torch.tensor((p-1.0)/2.0, dtype=mu.dtype, device=mu.device), torch.tensor((p-1.0)/2.0, dtype=mu.dtype, device=mu.device))
+
+        w=torch.zeros_like(kappa)
+        pending=torch.ones_like(kappa, dtype=torch.bool)
+
+        num_rounds=0
+
+        while(pending.sum()>0):
+
+            if(num_rounds>=max_rejection_rounds):
+                raise Exception("Von Mises-Fisher rejection sampling did not finish after %d rounds (%d samples pending)" % (max_rejection_rounds, int(pending.sum())))
+
+            num_rounds+=1
+
+            num_pending=int(pending.sum())
+
+            z=beta.sample((num_pending,))
+            proposals=(1.0-(1.0+b[pending])*z)/(1.0-(1.0-b[pending])*z)
+
+            log_uniforms=torch.log(torch.rand(size=(num_pending,), dtype=mu.dtype, device=mu.device))
+            accepted=(kappa[pending]*proposals+(p-1.0)*torch.log(1.0-x0[pending]*proposals)-c[pending])>=log_uniforms
+
+            pending_indices=pending.nonzero(as_tuple=True)
+            accepted_indices=(pending_indices[0][accepted], pending_indices[1][accepted])
+
+            w[accepted_indices]=proposals[accepted]
+            pending[accepted_indices]=False
+
+    ## uniform direction orthogonal to the mean
+    directions=torch.randn(size=(batch_size, samplesize, p), dtype=mu.dtype, device=mu.device)
+    directions=directions-(directions*mu.unsqueeze(1)).sum(dim=2, keepdim=True)*mu.unsqueeze(1)
+    directions=directions/directions.norm(dim=2, keepdim=True)
+
+    return w.unsqueeze(2)*mu.unsqueeze(1)+torch.sqrt((1.0-w**2).clamp(min=0.0)).unsqueeze(2)*directions
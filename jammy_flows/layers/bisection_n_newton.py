@@ -3,6 +3,8 @@ import numpy
 import pylab
 import time
 
+from ..helper_fns import profiling
+
 def close(a, b, rtol=1e-5, atol=1e-4):
     equal = torch.abs(a - b) <= atol + rtol * torch.abs(b)
     return equal
@@ -42,6 +44,7 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
     new_lower = torch.tensor(min_boundary).type(target_arg.dtype).repeat(*target_arg.shape).to(target_arg.device)
  
     mid=0
+    num_bisection_steps=0
     for i in range(num_bisection_iter):
         mid = (new_upper + new_lower) / 2.
         #print("mid: ", mid)
@@ -56,6 +59,12 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
 
         new_lower = (1. - correct_part) * (right_part * mid + left_part * new_lower) + correct_part * mid
         new_upper = (1. - correct_part) * (right_part * new_upper + left_part * mid) + correct_part * mid
+
+        num_bisection_steps+=1
+
+        ## all brackets collapsed .. further steps would not change anything
+        if(bool((new_upper==new_lower).all())):
+            break
       
         
     prev=mid
@@ -108,6 +117,8 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
                 print("------ done")
             break
 
+    profiling.record_iterations(num_bisection_steps, i+1 if num_newton_iter>0 else 0)
+
     if(target_arg.dtype==torch.float64):
 
         target_prec=1e-7
@@ -123,6 +134,224 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
     
     return prev
 
+def _mask_broadcast_args(args, mask, broadcasting_bool_args):
+    """
+    Selects the rows given by *mask* in all extra arguments that carry a batch dimension.
+    """
+    return [a[mask] if(broadcasting_bool_args[arg_index] == True) else a for arg_index, a in enumerate(args)]
+
+def inverse_bisection_n_newton_joint_func_and_grad_adaptive(func, 
+                                                            joint_func, 
+                                                            target_arg, 
+                                                            *args, 
+                                                            lower_bracket=None,
+                                                            upper_bracket=None,
+                                                            initial_guess=None,
+                                                            min_boundary=-100000.0, 
+                                                            max_boundary=100000.0, 
+                                                            num_bisection_iter=25, 
+                                                            num_newton_iter=30, 
+                                                            bisection_tolerance=1e-2,
+                                                            newton_tolerance=1e-14, 
+                                                            return_stats=False,
+                                                            verbose=0):
+    """
+    Adaptive version of *inverse_bisection_n_newton_joint_func_and_grad* for monotonically increasing functions. 
+    Bisection starts from per-item brackets if given, and items whose bracket is already narrower than *bisection_tolerance* 
+    drop out of the bisection phase. The following Newton iterations are safeguarded by the bracket, i.e. a Newton step that leaves the 
+    bracket is replaced by a bisection step. Converged items are dropped from all further function evaluations. Iterations run without
+    gradients, and a final Newton step at the solution makes the result differentiable.
+
+    Parameters:
+
+        func (function): The function to find the inverse of.
+        joint_func (function): A function that calculates the function value and its derivative simultaneously.
+        target_arg (float Tensor): The argument at which the inverse functon should be evaluated. Tensor of size (B,D) where B is the batchsize, and D the dimension.
+        *args (list): Any extra arguments passed to *func*.
+        lower_bracket (float Tensor/None): Lower bracket of size (B,D). Brackets that turn out invalid fall back to *min_boundary*.
+        upper_bracket (float Tensor/None): Upper bracket of size (B,D). Brackets that turn out invalid fall back to *max_boundary*.
+        initial_guess (float Tensor/None): Warm start of size (B,D). If given, the bisection phase is skipped and Newton iterations start from here.
+        min_boundary (float): Minimum boundary for Bisection.
+        max_boundary (float): Maximum boundary for bisection.
+        num_bisection_iter (int): Maximum number of bisection iterations.
+        num_newton_iter (int): Maximum number of Newton iterations.
+        bisection_tolerance (float): Bracket width below which an item leaves the bisection phase.
+        newton_tolerance (float): Summed absolute Newton update below which an item is converged.
+        return_stats (bool): If set, also returns a dictionary with iteration statistics.
+
+    Returns:
+
+        Tensor
+            The inverse of the function *func* in each sub-dimension in each batch item.
+        dict (optional)
+            Iteration statistics, only returned if *return_stats* is set.
+
+    """
+
+    batch_size=target_arg.shape[0]
+
+    stats=dict()
+    stats["num_items"]=batch_size
+    stats["num_bisection_iter"]=0
+    stats["num_newton_iter"]=0
+    stats["num_function_evals"]=0
+    stats["num_bracket_fallbacks"]=0
+
+    broadcasting_bool_args=[True if (batch_size>1 and arg.shape[0]>1) else False for arg in args ]
+
+    min_bound_tensor = torch.tensor(min_boundary).type(target_arg.dtype).repeat(*target_arg.shape).to(target_arg.device)
+    max_bound_tensor = torch.tensor(max_boundary).type(target_arg.dtype).repeat(*target_arg.shape).to(target_arg.device)
+
+    with torch.no_grad():
+
+        ## set up brackets and check if they actually contain the solution
+        if(lower_bracket is None):
+            new_lower=min_bound_tensor
+        else:
+            new_lower=lower_bracket.detach().to(target_arg)
+
+            invalid=func(new_lower, *args)>target_arg
+            stats["num_function_evals"]+=batch_size
+            stats["num_bracket_fallbacks"]+=int(invalid.sum())
+
+            new_lower=torch.where(invalid, min_bound_tensor, new_lower)
+
+        if(upper_bracket is None):
+            new_upper=max_bound_tensor
+        else:
+            new_upper=upper_bracket.detach().to(target_arg)
+
+            invalid=func(new_upper, *args)<target_arg
+            stats["num_function_evals"]+=batch_size
+            stats["num_bracket_fallbacks"]+=int(invalid.sum())
+
+            new_upper=torch.where(invalid, max_bound_tensor, new_upper)
+
+        if(initial_guess is None):
+
+            ## bisection only for items whose bracket is still wide
+            active_mask=(new_upper-new_lower).max(dim=1)[0]>bisection_tolerance
+
+            for i in range(num_bisection_iter):
+                
+                num_active=int(active_mask.sum())
+                if(num_active==0):
+                    break
+
+                lower_active=new_lower[active_mask]
+                upper_active=new_upper[active_mask]
+
+                mid = (upper_active + lower_active) / 2.
+                
+                inverse_mid = func(mid, *_mask_broadcast_args(args, active_mask, broadcasting_bool_args))
+                target_active=target_arg[active_mask]
+
+                stats["num_function_evals"]+=num_active
+                stats["num_bisection_iter"]+=1
+
+                ## no collapsing of brackets for "close" values here, since the bracket is kept as a safeguard for Newton
+                right_part = inverse_mid < target_active
+
+                lower_active=torch.where(right_part, mid, lower_active)
+                upper_active=torch.where(right_part, upper_active, mid)
+
+                new_lower=torch.masked_scatter(input=new_lower, mask=active_mask[:,None], source=lower_active)
+                new_upper=torch.masked_scatter(input=new_upper, mask=active_mask[:,None], source=upper_active)
+
+                still_active=(upper_active-lower_active).max(dim=1)[0]>bisection_tolerance
+                active_mask=torch.masked_scatter(input=active_mask, mask=active_mask, source=still_active)
+
+            prev=(new_upper+new_lower)/2.
+
+        else:
+
+            ## warm start inside the bracket
+            prev=torch.minimum(torch.maximum(initial_guess.detach().to(target_arg), new_lower), new_upper)
+
+    ## safeguarded Newton iterations without gradients
+    above_tolerance_mask=torch.ones(batch_size, dtype=torch.bool, device=target_arg.device)
+    residuals=torch.zeros_like(target_arg)
+
+    with torch.no_grad():
+
+        for i in range(num_newton_iter):
+
+            num_active=int(above_tolerance_mask.sum())
+
+            masked_args=_mask_broadcast_args(args, above_tolerance_mask, broadcasting_bool_args)
+
+            prev_active=prev[above_tolerance_mask,:]
+            fn_result, f_prime_eval = joint_func(prev_active, *masked_args)
+
+            stats["num_function_evals"]+=num_active
+            stats["num_newton_iter"]+=1
+
+            f_eval=fn_result-target_arg[above_tolerance_mask,:]
+
+            residuals=torch.masked_scatter(input=residuals, mask=above_tolerance_mask[:,None], source=f_eval)
+
+            ## shrink the bracket with the current iterate
+            lower_active=torch.where(f_eval<0, prev_active, new_lower[above_tolerance_mask])
+            upper_active=torch.where(f_eval<0, new_upper[above_tolerance_mask], prev_active)
+
+            new_lower=torch.masked_scatter(input=new_lower, mask=above_tolerance_mask[:,None], source=lower_active)
+            new_upper=torch.masked_scatter(input=new_upper, mask=above_tolerance_mask[:,None], source=upper_active)
+
+            newton_candidate=prev_active-f_eval/f_prime_eval
+            
+            ## fall back to bisection if the Newton step leaves the bracket
+            outside_bracket=(newton_candidate<lower_active) | (newton_candidate>upper_active) | (torch.isfinite(newton_candidate)==False)
+            outside_bracket=outside_bracket & (f_eval!=0)
+
+            newsource=torch.where(outside_bracket, (lower_active+upper_active)/2., newton_candidate)
+            update=newsource-prev_active
+
+            prev=torch.masked_scatter(input=prev, mask=above_tolerance_mask[:,None], source=newsource)
+
+            new_tolerance_mask=(torch.abs(update).sum(axis=1))>=newton_tolerance
+        
+            above_tolerance_mask=torch.masked_scatter(input=above_tolerance_mask, mask=above_tolerance_mask, source=new_tolerance_mask)
+
+            above_tol=above_tolerance_mask.sum()
+
+            if(verbose):
+                print("-- newton iter %d .. %d / %d dims completed" % (i, batch_size-above_tol, batch_size))
+            if(above_tol==0):
+                if(verbose):
+                    print("------ done")
+                break
+
+    ## a single differentiable Newton step at the solution yields the gradient of the inverse (implicit function theorem), so the
+    ## result stays differentiable without keeping the graph of all iterations
+    requires_grad=torch.is_grad_enabled() and (target_arg.requires_grad or sum([a.requires_grad for a in args if type(a)==torch.Tensor])>0)
+
+    if(requires_grad):
+        fn_result, f_prime_eval = joint_func(prev, *args)
+        stats["num_function_evals"]+=batch_size
+
+        prev=prev-(fn_result-target_arg)/f_prime_eval
+
+    if(target_arg.dtype==torch.float64):
+
+        target_prec=1e-7
+    else:
+
+        target_prec=1e-4
+
+    num_non_converged=int((torch.abs(residuals)>target_prec).sum())
+    stats["num_non_converged"]=num_non_converged
+
+    if( num_non_converged>0):
+        print(num_non_converged, " items did not converge in Newton iterations")
+        print("feval (diff) ",residuals[torch.abs(residuals)>target_prec])
+    
+    profiling.record_iterations(stats["num_bisection_iter"], stats["num_newton_iter"])
+
+    if(return_stats):
+        return prev, stats
+
+    return prev
+
 def inverse_bisection_n_newton(func, 
                                grad_func, 
                                target_arg, 
@@ -157,6 +386,7 @@ def inverse_bisection_n_newton(func,
     new_lower = torch.tensor(min_boundary).type(target_arg.dtype).repeat(*target_arg.shape).to(target_arg.device)
     
     mid=0
+    num_bisection_steps=0
     for i in range(num_bisection_iter):
         mid = (new_upper + new_lower) / 2.
       
@@ -170,6 +400,12 @@ def inverse_bisection_n_newton(func,
         new_lower = (1. - correct_part) * (right_part * mid + left_part * new_lower) + correct_part * mid
         new_upper = (1. - correct_part) * (right_part * new_upper + left_part * mid) + correct_part * mid
 
+        num_bisection_steps+=1
+
+        ## all brackets collapsed .. further steps would not change anything
+        if(bool((new_upper==new_lower).all())):
+            break
+
         
     prev=mid
 
@@ -229,6 +465,8 @@ def inverse_bisection_n_newton(func,
 
     num_non_converged=(torch.abs(f_eval)>1e-7).sum()
 
+    profiling.record_iterations(num_bisection_steps, i+1 if num_newton_iter>0 else 0)
+
     if(target_arg.dtype==torch.float64):
 
         target_prec=1e-7
@@ -252,6 +490,7 @@ def inverse_bisection_n_newton_slow(func, grad_func, target_arg, *args, min_boun
     #print("input z ... ", z)
     #print("INVESRE BISECTION ", "target shape ", target_arg.shape)
     mid=0
+    num_bisection_steps=0
     for i in range(num_bisection_iter):
         mid = (new_upper + new_lower) / 2.
         #print("mid: ", mid)
@@ -271,6 +510,12 @@ def inverse_bisection_n_newton_slow(func, grad_func, target_arg, *args, min_boun
         new_lower = (1. - correct_part) * (right_part * mid + left_part * new_lower) + correct_part * mid
         new_upper = (1. - correct_part) * (right_part * new_upper + left_part * mid) + correct_part * mid
 
+        num_bisection_steps+=1
+
+        ## all brackets collapsed .. further steps would not change anything
+        if(bool((new_upper==new_lower).all())):
+            break
+
 
     prev=mid
 
@@ -314,6 +559,8 @@ def inverse_bisection_n_newton_slow(func, grad_func, target_arg, *args, min_boun
                 print("feval (diff) ",f_eval[torch.abs(f_eval)>1e-7])
                 print("PREV VALUE:", prev[torch.abs(f_eval)>1e-7])
     
+    profiling.record_iterations(num_bisection_steps, num_newton_iter)
+
     return prev
 
 def inverse_bisection_n_newton_sphere(combined_func, 
@@ -377,29 +624,68 @@ def inverse_bisection_n_newton_sphere(combined_func,
         #print("proj 2 ", projection_2[19])
         prev=basic_exponential_map_func(prev, new_vs, 0.1*projection_2)
        
+    profiling.record_iterations(0, i+1 if num_newton_iter>0 else 0)
+
     return prev
 
 
+def _sphere_residual(mapped, target):
+    """
+    Logarithmic map of *target* at *mapped*, i.e. the tangent vector at *mapped* pointing to *target* with the geodesic distance as length.
+    Uses atan2 instead of arccos, so tiny distances stay accurate.
+    """
+    cos_dist=(mapped*target).sum(dim=1, keepdim=True)
+    tangent=target-cos_dist*mapped
+
+    sin_dist=tangent.norm(dim=1, keepdim=True)
+    dist=torch.atan2(sin_dist, cos_dist)
+
+    scale=torch.where(sin_dist>0, dist/sin_dist.clamp(min=1e-300), torch.ones_like(sin_dist))
+
+    return tangent*scale, dist[:,0]
+
+def _sphere_tangent_basis(x):
+    """
+    Orthonormal basis of the tangent plane at *x* (B X 3), returned as B X 3 X 2 matrix.
+    """
+    ## use the embedding axis that is least aligned with x
+    axis=torch.zeros_like(x)
+    axis.scatter_(1, x.abs().argmin(dim=1, keepdim=True), 1.0)
+
+    first=axis-(axis*x).sum(dim=1, keepdim=True)*x
+    first=first/first.norm(dim=1, keepdim=True)
+
+    second=torch.cross(x, first, dim=1)
+
+    return torch.cat([first.unsqueeze(2), second.unsqueeze(2)], dim=2)
+
 def inverse_bisection_n_newton_sphere_fast(combined_func, 
                                       find_tangent_func, 
                                       basic_exponential_map_func, 
                                       target_arg, 
                                       *args, 
-                                      num_newton_iter=25):
+                                      num_newton_iter=25,
+                                      tolerance=1e-12,
+                                      max_num_backtracking=20):
     """
-    Performs Newton iterations on the sphere over 1-dimensional potential functions via Exponential maps to find the inverse of a given exponential map on the sphere.
-    In initial tests it was found that a very precise application requires at least 40-50 ierations, even though one is already pretty close after 10 iterations.
-    Distributing the points randomly on the sphere doesn't really help, so every point is initialized just at (0,0,1).
+    Inverts an exponential map on the sphere with Gauss-Newton iterations and a backtracking line search.
+    Every point starts from the best of three candidates: (0,0,-1), the target itself, and the linearized inverse exp_y(-log_y(T(y))), i.e. the target moved backwards 
+    along the displacement that the map applies at the target. Each step solves the 2-d linear system of the Jacobian projected onto the tangent plane, 
+    is at most pi/2 long (trust region) and is halved until the geodesic distance to the target decreases. Close to the solution the iterations converge 
+    quadratically, so a handful of iterations replaces the 40-50 damped gradient steps of *inverse_bisection_n_newton_sphere*.
     In order for this to work properly, the function *has* to be globally diffeomorphic, so the exponential map has to follow the conditions outlined in 
     https://arxiv.org/abs/0906.0874 (Sei 2009).
 
     Parameters:
     
         combined_func (function): A function that returns the (x,y,z) unit vector and its jacobian.
-        find_tangent_func (function): A funtion to calculate the tangent at a given point along a certain direction.
+        find_tangent_func (function): Logarithmic map, returns the unit tangent vector and geodesic distance from a base point to a target point.
+        basic_exponential_map_func (function): Exponential map with base point, unit tangent vector and length.
         target_arg (float Tensor): The argument at which the inverse functon should be evaluated. Tensor of size (B,D) where B is the batchsize, and D the dimension.
         *args (list): Any extra arguments passed to *func*.
-        num_newton_iter (int): Number of Newton iterations.
+        num_newton_iter (int): Maximum number of Newton iterations.
+        tolerance (float): Geodesic distance to the target below which a point counts as converged.
+        max_num_backtracking (int): Maximum number of step halvings in the line search.
 
     Returns:
 
@@ -408,47 +694,121 @@ def inverse_bisection_n_newton_sphere_fast(combined_func,
 
     """
     
-    prev=torch.zeros_like(target_arg)
-    prev[:,2]=-1.0
+    broadcasting_bool_args=[True if (target_arg.shape[0]>1 and arg.shape[0]>1) else False for arg in args ]
 
-    above_tolerance_mask=torch.ones( target_arg.shape[0], dtype=torch.bool, device=target_arg.device)
-        
-    broadcasting_bool_args=[True if (prev.shape[0]>1 and arg.shape[0]>1) else False for arg in args ]
+    def evaluate(x, mask):
+        mapped, _, jac, _=combined_func(x, *[a[mask] if(broadcasting_bool_args[arg_index] == True) else a for arg_index, a in enumerate(args)])
 
-    for i in range(num_newton_iter):
-    
-        phi_res, _, jac_phi,_=combined_func(prev[above_tolerance_mask], *[a[above_tolerance_mask] if(broadcasting_bool_args[arg_index] == True) else a for arg_index, a in enumerate(args)])
+        return mapped, jac
 
-        
-        fn_eval=-(phi_res*target_arg[above_tolerance_mask]).sum(axis=-1, keepdims=True)+1.0
+    all_mask=torch.ones(target_arg.shape[0], dtype=torch.bool, device=target_arg.device)
 
-        res_vec=-torch.bmm(jac_phi.permute(0,2,1), target_arg[above_tolerance_mask].unsqueeze(2)).squeeze(-1)#*basic_pot_func.unsqueeze(1).unsqueeze(2)
+    ## initialization
+    south_pole=torch.zeros_like(target_arg)
+    south_pole[:,2]=-1.0
 
-        grad_norm=(res_vec**2).sum(axis=1, keepdims=True).sqrt()
+    mapped, jac=evaluate(south_pole, all_mask)
+    _, dist=_sphere_residual(mapped, target_arg)
+    prev=south_pole
 
-        new_vs,alpha=find_tangent_func(prev[above_tolerance_mask], -(res_vec/grad_norm).squeeze(-1))
-       
-        gpnew=(new_vs*res_vec).sum(axis=1,keepdims=True)
-        
-        projection_2=fn_eval/gpnew
+    mapped_target, jac_target=evaluate(target_arg, all_mask)
+    tangent_unit, tangent_len=find_tangent_func(target_arg, mapped_target)
+    linearized=basic_exponential_map_func(target_arg, tangent_unit, -tangent_len)
+    linearized=linearized/linearized.norm(dim=1, keepdim=True)
 
-        projection_2=-projection_2
+    mapped_linearized, jac_linearized=evaluate(linearized, all_mask)
 
-        ## set to 0 once we reach 0
-        projection_2=torch.where(alpha==0, 0.0, projection_2)
+    for candidate, candidate_mapped, candidate_jac in [(target_arg, mapped_target, jac_target), (linearized, mapped_linearized, jac_linearized)]:
 
+        _, candidate_dist=_sphere_residual(candidate_mapped, target_arg)
 
-        prev[above_tolerance_mask]=basic_exponential_map_func(prev[above_tolerance_mask], new_vs, 0.4*projection_2)
+        ## non-finite candidates are never better
+        better=candidate_dist<dist
 
+        prev=torch.where(better[:,None], candidate, prev)
+        mapped=torch.where(better[:,None], candidate_mapped, mapped)
+        jac=torch.where(better[:,None,None], candidate_jac, jac)
+        dist=torch.where(better, candidate_dist, dist)
 
-        # check if any of the projections are below tolerance so we can switch them off for next iteration
-        new_tolerance_mask=(torch.abs(projection_2[:,0]))>=1e-12
-    
-        above_tolerance_mask=torch.masked_scatter(input=above_tolerance_mask, mask=above_tolerance_mask, source=new_tolerance_mask)
+    prev=prev.clone()
+    mapped=mapped.clone()
+    jac=jac.clone()
 
-     
-        if(above_tolerance_mask.sum()==0):
-            
+    active=dist>=tolerance
+    num_iter=0
+
+    for i in range(num_newton_iter):
+
+        if(active.sum()==0):
             break
-       
+
+        num_iter=i+1
+
+        x=prev[active]
+        y=target_arg[active]
+        old_dist=dist[active]
+
+        residual,_=_sphere_residual(mapped[active], y)
+
+        ## Gauss-Newton step in the tangent plane of x
+        basis=_sphere_tangent_basis(x)
+        projected_jac=torch.bmm(jac[active], basis)
+        projected_jac_t=projected_jac.permute(0,2,1)
+
+        coefficients=torch.linalg.solve(torch.bmm(projected_jac_t, projected_jac), torch.bmm(projected_jac_t, residual.unsqueeze(2)))
+        step=torch.bmm(basis, coefficients).squeeze(-1)
+
+        step_len=step.norm(dim=1, keepdim=True)
+        step_unit=step/step_len.clamp(min=1e-300)
+        step_len=step_len.clamp(max=numpy.pi/2.0)
+
+        new_x=x.clone()
+        new_mapped=mapped[active].clone()
+        new_jac=jac[active].clone()
+        new_dist=old_dist.clone()
+
+        pending=torch.ones(x.shape[0], dtype=torch.bool, device=x.device)
+
+        ## backtracking line search
+        for j in range(max_num_backtracking):
+
+            pending_indices=pending.nonzero()[:,0]
+
+            sub_mask=active.clone()
+            sub_mask[active]=pending
+
+            trial=basic_exponential_map_func(x[pending], step_unit[pending], step_len[pending])
+            trial=trial/trial.norm(dim=1, keepdim=True)
+
+            trial_mapped, trial_jac=evaluate(trial, sub_mask)
+            _, trial_dist=_sphere_residual(trial_mapped, y[pending])
+
+            accepted=trial_dist<old_dist[pending]
+            accepted_indices=pending_indices[accepted]
+
+            new_x[accepted_indices]=trial[accepted]
+            new_mapped[accepted_indices]=trial_mapped[accepted]
+            new_jac[accepted_indices]=trial_jac[accepted]
+            new_dist[accepted_indices]=trial_dist[accepted]
+
+            pending[accepted_indices]=False
+
+            if(pending.sum()==0):
+                break
+
+            step_len=step_len*0.5
+
+        prev[active]=new_x
+        mapped[active]=new_mapped
+        jac[active]=new_jac
+        dist[active]=new_dist
+
+        ## points without any decrease sit at the numerical precision limit
+        still_active=(pending==False) & (new_dist>=tolerance)
+
+        active_indices=active.nonzero()[:,0]
+        active[active_indices[still_active==False]]=False
+
+    profiling.record_iterations(0, num_iter)
+
     return prev
\ No newline at end of file
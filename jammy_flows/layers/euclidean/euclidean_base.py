@@ -50,7 +50,12 @@ class euclidean_base(layer_base.layer_base):
 
             return self._inv_flow_mapping(inputs, extra_inputs=extra_inputs)
 
-    def flow_mapping(self, inputs, extra_inputs=None, force_embedding_coordinates=False, force_intrinsic_coordinates=False):
+    def flow_mapping(self, inputs, extra_inputs=None, force_embedding_coordinates=False, force_intrinsic_coordinates=False, initial_guess=None):
+        """
+        Forward mapping (sampling direction). *initial_guess* (Tensor/None) is an optional warm start for the output of shape (B,D), only supported by layers whose mapping requires a numerical inversion.
+        """
+        ## only layers with numerical inversions accept a warm start
+        guess_kwargs=dict()
 
         if(self.model_offset):
 
@@ -62,18 +67,26 @@ class euclidean_base(layer_base.layer_base):
 
                 this_offset=this_offset+extra_inputs[:,:self.dimension]
 
-               
-                x, logdet=self._flow_mapping([x, logdet], extra_inputs=extra_inputs[:,self.dimension:])
+                if(initial_guess is not None):
+                    guess_kwargs["initial_guess"]=initial_guess-this_offset
+
+                x, logdet=self._flow_mapping([x, logdet], extra_inputs=extra_inputs[:,self.dimension:], **guess_kwargs)
 
                 return [x+this_offset, logdet]
 
             else:
-                x, logdet=self._flow_mapping([x, logdet], extra_inputs=None)
+                if(initial_guess is not None):
+                    guess_kwargs["initial_guess"]=initial_guess-this_offset
+
+                x, logdet=self._flow_mapping([x, logdet], extra_inputs=None, **guess_kwargs)
 
                 return [x+this_offset, logdet]
         else:
 
-            return self._flow_mapping(inputs, extra_inputs=extra_inputs)
+            if(initial_guess is not None):
+                guess_kwargs["initial_guess"]=initial_guess
+
+            return self._flow_mapping(inputs, extra_inputs=extra_inputs, **guess_kwargs)
 
     def get_desired_init_parameters(self):
 
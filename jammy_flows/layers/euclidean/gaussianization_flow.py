@@ -67,7 +67,8 @@ class gf_block(euclidean_base.euclidean_base):
                  clamp_widths=0,
                  regulate_normalization=0,
                  add_skewness=0,
-                 rotation_mode="householder"):
+                 rotation_mode="householder",
+                 inversion_solver="bisection_n_newton"):
         """
         Gaussianization flow: Symbol "g"
 
@@ -99,12 +100,20 @@ class gf_block(euclidean_base.euclidean_base):
                     | - **triangular_combination**: Parametrization of an upper and lower triangular matrix.
                     | - **cayley**: "Cayley representation" of rotations.
 
+            inversion_solver (str): One of ["bisection_n_newton", "adaptive"]. Numerical inversion used for sampling with the "classic" non-linear mapping. 
+                                    "adaptive" brackets the solution using the kernel means and widths, and drops converged items early. Iteration statistics of the last call 
+                                    are stored in *last_inversion_stats*.
+
         """
         super().__init__(dimension=dimension, use_permanent_parameters=use_permanent_parameters, model_offset=model_offset)
         self.init = False
 
         self.nonlinear_stretch_type=nonlinear_stretch_type
 
+        assert(inversion_solver=="bisection_n_newton" or inversion_solver=="adaptive"), ("Unknown inversion solver ", inversion_solver)
+        self.inversion_solver=inversion_solver
+        self.last_inversion_stats=None
+
         # norms
         self.lower_bound_for_norms=lower_bound_for_norms
         self.upper_bound_for_norms=upper_bound_for_norms
@@ -455,19 +464,7 @@ class gf_block(euclidean_base.euclidean_base):
 
     def compute_householder_matrix(self, vs):
 
-        Q = torch.eye(self.dimension, device=vs.device).type(vs.dtype).unsqueeze(0).repeat(vs.shape[0], 1,1)
-       
-        for i in range(self.householder_iter):
-        
-            v = vs[:,i].reshape(-1,self.dimension, 1).to(vs.device)
-            
-            v = v / v.norm(dim=1).unsqueeze(-1)
-
-            Qi = torch.eye(self.dimension, device=vs.device).type(vs.dtype).unsqueeze(0) - 2 * torch.bmm(v, v.permute(0, 2, 1))
-
-            Q = torch.bmm(Q, Qi)
-
-        return Q
+        return matrix_fns.obtain_householder_matrix(vs.reshape(-1, self.householder_iter, self.dimension))
 
    
     def sigmoid_inv_error_pass_w_params(self, x, datapoints, log_widths, log_norms, skew_exponents, skew_signs):
@@ -907,32 +904,98 @@ class gf_block(euclidean_base.euclidean_base):
 
             return (log_widths, log_heights, log_derivatives, new_left,new_right,new_bottom,new_top), rotation_params
 
-    def _flow_mapping(self, inputs, extra_inputs=None, verbose=False, lower=-1e5, upper=1e5): 
-        
+    def _obtain_rq_spline_knots(self, x, extra_inputs=None):
+        """
+        Returns the rq-spline knots (see *spline_fns.obtain_rq_spline_knots*) and rotation parameters. For non-conditional PDFs evaluated 
+        without gradients, the result is cached and only recomputed if a parameter changes (e.g. after an optimizer step), or dtype/device change.
+        """
+
+        return self._cached_parameter_function("rq_spline_knots",
+                                               lambda: self._obtain_rq_spline_knots_uncached(x, extra_inputs=extra_inputs),
+                                               extra_inputs=extra_inputs,
+                                               key_extras=(x.dtype, x.device))
+
+    def _obtain_rq_spline_knots_uncached(self, x, extra_inputs=None):
+
+        flow_params, rotation_params=self._obtain_usable_flow_params(x, extra_inputs=extra_inputs)
+
+        knots=spline_fns.obtain_rq_spline_knots(flow_params[0],
+                                                flow_params[1],
+                                                flow_params[2],
+                                                left=flow_params[3],
+                                                right=flow_params[4],
+                                                bottom=flow_params[5],
+                                                top=flow_params[6])
+
+        return knots, rotation_params
+
+    def _obtain_inversion_brackets(self, z, flow_params):
+        """
+        Brackets the inverse of the "classic" non-linear mapping. The mixture CDF at the solution lies between the smallest and largest 
+        kernel CDF, so the solution lies between the smallest and largest kernel quantile at the same CDF value. Only exact for logistic 
+        kernels without skewness, but invalid brackets are caught in the solver.
+        """
+
+        if(self.add_skewness):
+            return None, None
+
+        with torch.no_grad():
+
+            if(self.inverse_function_type=="isigmoid"):
+                ## inverse function is the logit of the CDF
+                logit_cdf=z
+            else:
+                ## approximately the inverse normal CDF
+                logit_cdf=torch.special.log_ndtr(z)-torch.special.log_ndtr(-z)
+
+            kde_means, kde_log_widths=flow_params[0], flow_params[1]
+
+            ## shape B X KDE index dim X dimension
+            kernel_quantiles=kde_means+torch.exp(kde_log_widths)*logit_cdf.unsqueeze(1)
+
+            ## pad a little to account for approximate inverse normal CDFs
+            padding=1e-3*(1.0+torch.abs(kernel_quantiles))
+
+            lower_bracket=(kernel_quantiles-padding).min(dim=1)[0]
+            upper_bracket=(kernel_quantiles+padding).max(dim=1)[0]
+
+        return lower_bracket, upper_bracket
+
+    def _flow_mapping(self, inputs, extra_inputs=None, verbose=False, lower=-1e5, upper=1e5, initial_guess=None): 
+        """
+        *initial_guess* is an optional warm start for the layer output (without offset), e.g. from a previous inversion with slightly changed parameters.
+        It is only used by the adaptive solver of the classic stretch, which then skips the bisection phase.
+        """
         [z, log_det]=inputs
 
         device=z.device
 
-        flow_params, rotation_params=self._obtain_usable_flow_params(z, extra_inputs=extra_inputs)
+        if(self.nonlinear_stretch_type=="rq_splines"):
+            flow_params, rotation_params=self._obtain_rq_spline_knots(z, extra_inputs=extra_inputs)
+        else:
+            flow_params, rotation_params=self._obtain_usable_flow_params(z, extra_inputs=extra_inputs)
        
         if(self.nonlinear_stretch_type=="classic"):
            
-            res=bn.inverse_bisection_n_newton_joint_func_and_grad(self.sigmoid_inv_error_pass_w_params, self.sigmoid_inv_error_pass_combined_val_n_normal_derivative, z, flow_params[0], flow_params[1],flow_params[2],flow_params[3],flow_params[4], min_boundary=lower, max_boundary=upper, num_bisection_iter=25, num_newton_iter=20)
+            if(self.inversion_solver=="adaptive"):
+
+                lower_bracket, upper_bracket=self._obtain_inversion_brackets(z, flow_params)
+
+                ## the solver works before the rotation, so the guess is rotated back
+                if(initial_guess is not None):
+                    with torch.no_grad():
+                        initial_guess=self._apply_inverse_rotation(initial_guess.to(z), rotation_params)
+               
+                res, self.last_inversion_stats=bn.inverse_bisection_n_newton_joint_func_and_grad_adaptive(self.sigmoid_inv_error_pass_w_params, self.sigmoid_inv_error_pass_combined_val_n_normal_derivative, z, flow_params[0], flow_params[1],flow_params[2],flow_params[3],flow_params[4], lower_bracket=lower_bracket, upper_bracket=upper_bracket, initial_guess=initial_guess, min_boundary=lower, max_boundary=upper, num_bisection_iter=25, num_newton_iter=20, return_stats=True)
+            else:
+                res=bn.inverse_bisection_n_newton_joint_func_and_grad(self.sigmoid_inv_error_pass_w_params, self.sigmoid_inv_error_pass_combined_val_n_normal_derivative, z, flow_params[0], flow_params[1],flow_params[2],flow_params[3],flow_params[4], min_boundary=lower, max_boundary=upper, num_bisection_iter=25, num_newton_iter=20)
             log_deriv=self.sigmoid_inv_error_pass_log_derivative_w_params(res, flow_params[0], flow_params[1], flow_params[2], flow_params[3], flow_params[4])
 
             log_det=log_det-log_deriv.sum(axis=-1)
            
         elif(self.nonlinear_stretch_type=="rq_splines"):
            
-            res, log_deriv=spline_fns.rational_quadratic_spline_with_linear_extension(z.unsqueeze(-1), 
-                                                                       flow_params[0],
-                                                                        flow_params[1],
-                                                                        flow_params[2],
-                                                                        left=flow_params[3],
-                                                                        right=flow_params[4],
-                                                                        bottom=flow_params[5],
-                                                                        top=flow_params[6],
-                                                                        inverse=True)
+            res, log_deriv=spline_fns.rational_quadratic_spline_with_linear_extension_from_knots(z.unsqueeze(-1), flow_params, inverse=True)
 
             res=res.squeeze(-1)
           
@@ -949,41 +1012,22 @@ class gf_block(euclidean_base.euclidean_base):
                 trafo_matrix_left, _=matrix_fns.obtain_lower_triangular_matrix_and_logdet(self.dimension, log_diagonal_entries=zero_entries, lower_triangular_entries=left)
                 diag=torch.cat([middle, -middle.sum(axis=1, keepdims=True)], dim=1)
 
-                if(trafo_matrix_right.shape[0]<z.shape[0]):
-                    if(trafo_matrix_right.shape[0]==1):
-                        trafo_matrix_right=trafo_matrix_right.repeat(z.shape[0], 1,1)
-                        trafo_matrix_left=trafo_matrix_left.repeat(z.shape[0], 1,1)
-                    else:
-                        raise Exception("something went wrong with first dim of rot matrix!")
-                
-                res = torch.bmm(trafo_matrix_right, res.unsqueeze(-1)).squeeze(-1)
+                ## shared matrices (first dim 1) are applied via a single matmul, amortized ones via bmm
+                res = matrix_fns.apply_matrix(trafo_matrix_right, res)
                 
                 res=res*torch.exp(diag)
                
-                res = torch.bmm(trafo_matrix_left, res.unsqueeze(-1)).squeeze(-1)
+                res = matrix_fns.apply_matrix(trafo_matrix_left, res)
                
         elif(self.rotation_mode=="householder"):
             if self.use_householder:
 
-                if(rotation_params.shape[0]<z.shape[0]):
-                    if(rotation_params.shape[0]==1):
-                        rotation_params=rotation_params.repeat(z.shape[0], 1,1)
-                    else:
-                        raise Exception("something went wrong with first dim of rot matrix!")
-
-                res = torch.bmm(rotation_params, res.unsqueeze(-1)).squeeze(-1)
+                res = matrix_fns.apply_matrix(rotation_params, res)
         
         elif(self.rotation_mode=="angles" or self.rotation_mode=="cayley"):
 
             if(self.dimension>1):
-                if(rotation_params is not None):
-                    if(rotation_params.shape[0]<z.shape[0]):
-                        if(rotation_params.shape[0]==1):
-                            rotation_params=rotation_params.repeat(z.shape[0], 1,1)
-                        else:
-                            raise Exception("something went wrong with first dim of rot matrix!")
-
-                res = torch.bmm(rotation_params, res.unsqueeze(-1)).squeeze(-1)
+                res = matrix_fns.apply_matrix(rotation_params, res)
 
         return res, log_det
 
@@ -991,15 +1035,10 @@ class gf_block(euclidean_base.euclidean_base):
 
 
 
-    def _inv_flow_mapping(self, inputs, extra_inputs=None):
-
-        [x, log_det] = inputs
-
-        #############################################################################################
-        # Compute inverse CDF
-        #############################################################################################
-        flow_params, rotation_params=self._obtain_usable_flow_params(x, extra_inputs=extra_inputs)
-
+    def _apply_inverse_rotation(self, x, rotation_params):
+        """
+        Applies the inverse of the linear transformation that follows the nonlinear stretch in *_flow_mapping*.
+        """
         if(self.rotation_mode=="triangular_combination"):
 
             if(self.dimension>1):
@@ -1011,41 +1050,38 @@ class gf_block(euclidean_base.euclidean_base):
                 inverse_trafo_matrix_left, _=matrix_fns.obtain_inverse_lower_triangular_matrix_and_logdet(self.dimension, log_diagonal_entries=zero_entries, lower_triangular_entries=left)
                 diag=torch.cat([middle, -middle.sum(axis=1, keepdims=True)], dim=1)
 
-                if(inverse_trafo_matrix_right.shape[0]<x.shape[0]):
-                    if(inverse_trafo_matrix_right.shape[0]==1):
-                        inverse_trafo_matrix_right=inverse_trafo_matrix_right.repeat(x.shape[0], 1,1)
-                        inverse_trafo_matrix_left=inverse_trafo_matrix_left.repeat(x.shape[0], 1,1)
-                    else:
-                        raise Exception("something went wrong with first dim of rot matrix!")
-
-               
-                x = torch.bmm(inverse_trafo_matrix_left, x.unsqueeze(-1)).squeeze(-1)
+                ## shared matrices (first dim 1) are applied via a single matmul, amortized ones via bmm
+                x = matrix_fns.apply_matrix(inverse_trafo_matrix_left, x)
               
                 x=x/torch.exp(diag)
 
-                x = torch.bmm(inverse_trafo_matrix_right, x.unsqueeze(-1)).squeeze(-1)
+                x = matrix_fns.apply_matrix(inverse_trafo_matrix_right, x)
             
         elif(self.rotation_mode=="householder"):
             if self.use_householder:
 
-                if(rotation_params.shape[0]<x.shape[0]):
-                    if(rotation_params.shape[0]==1):
-                        rotation_params=rotation_params.repeat(x.shape[0], 1,1)
-                    else:
-                        raise Exception("something went wrong with first dim of rot matrix!")
-
-                x = torch.bmm(rotation_params.permute(0,2,1), x.unsqueeze(-1)).squeeze(-1)
+                x = matrix_fns.apply_matrix(rotation_params, x, transpose=True)
 
         elif(self.rotation_mode=="angles" or self.rotation_mode=="cayley"):
 
             if(self.dimension>1):
-                if(rotation_params.shape[0]<x.shape[0]):
-                    if(rotation_params.shape[0]==1):
-                        rotation_params=rotation_params.repeat(x.shape[0], 1,1)
-                    else:
-                        raise Exception("something went wrong with first dim of rot matrix!")
+                x = matrix_fns.apply_matrix(rotation_params, x, transpose=True)
+
+        return x
+
+    def _inv_flow_mapping(self, inputs, extra_inputs=None):
+
+        [x, log_det] = inputs
+
+        #############################################################################################
+        # Compute inverse CDF
+        #############################################################################################
+        if(self.nonlinear_stretch_type=="rq_splines"):
+            flow_params, rotation_params=self._obtain_rq_spline_knots(x, extra_inputs=extra_inputs)
+        else:
+            flow_params, rotation_params=self._obtain_usable_flow_params(x, extra_inputs=extra_inputs)
 
-                x = torch.bmm(rotation_params.permute(0,2,1), x.unsqueeze(-1)).squeeze(-1)
+        x=self._apply_inverse_rotation(x, rotation_params)
 
         ###############################
 
@@ -1056,15 +1092,7 @@ class gf_block(euclidean_base.euclidean_base):
             log_det=log_det+log_deriv.sum(axis=-1)
 
         elif(self.nonlinear_stretch_type=="rq_splines"):
-            x, log_deriv=spline_fns.rational_quadratic_spline_with_linear_extension(x.unsqueeze(-1), 
-                                                                       flow_params[0],
-                                                                        flow_params[1],
-                                                                        flow_params[2],
-                                                                        left=flow_params[3],
-                                                                        right=flow_params[4],
-                                                                        bottom=flow_params[5],
-                                                                        top=flow_params[6],
-                                                                        inverse=False)
+            x, log_deriv=spline_fns.rational_quadratic_spline_with_linear_extension_from_knots(x.unsqueeze(-1), flow_params, inverse=False)
 
             """
             testz=torch.linspace(-2.5, 2.1, 1000).unsqueeze(-1).unsqueeze(-1)
@@ -1188,7 +1216,8 @@ class gf_block(euclidean_base.euclidean_base):
 
         elif(self.rotation_mode=="cayley"):
             if(self.dimension>1):
-                self.cayley_pars.data=torch.reshape(params[:, self.num_cayley_pars], [1, self.num_cayley_pars])
+                self.cayley_pars.data=torch.reshape(params[:self.num_cayley_pars], [1, self.num_cayley_pars])
+                counter+=self.num_cayley_pars
         
         if(self.nonlinear_stretch_type=="classic"):
             # classic gaussianization flow
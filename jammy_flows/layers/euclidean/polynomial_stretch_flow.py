@@ -3,6 +3,7 @@ from torch import nn
 import numpy
 from .. import bisection_n_newton as bn
 from .. import layer_base
+from .. import matrix_fns
 from . import euclidean_base
 
 import math
@@ -145,19 +146,7 @@ class psf_block(euclidean_base.euclidean_base):
 
     def compute_householder_matrix(self, vs, device=torch.device("cpu")):
 
-        Q = torch.eye(self.dimension, device=device).type(vs.dtype).unsqueeze(0).repeat(vs.shape[0], 1,1)
-       
-        for i in range(self.householder_iter):
-        
-            v = vs[:,i].reshape(-1,self.dimension, 1).to(device)
-            
-            v = v / v.norm(dim=1).unsqueeze(-1)
-
-            Qi = torch.eye(self.dimension, device=device).type(vs.dtype).unsqueeze(0) - 2 * torch.bmm(v, v.permute(0, 2, 1))
-
-            Q = torch.bmm(Q, Qi)
-
-        return Q
+        return matrix_fns.obtain_householder_matrix(vs.reshape(-1, self.householder_iter, self.dimension).to(device))
 
  
 
@@ -180,13 +169,6 @@ class psf_block(euclidean_base.euclidean_base):
 
             rotation_matrix = self.compute_householder_matrix(this_vs, device=x.device)
 
-            if(rotation_matrix.shape[0]!=x.shape[0]):
-                if(rotation_matrix.shape[0]<x.shape[0]):
-                    rotation_matrix=rotation_matrix.repeat(x.shape[0], 1,1)
-                else:
-                    raise Exception("rotation matrix first dim is larger than data first dim (batch dim) .. taht should never happen!")
-
-
         if(extra_inputs is not None):
           
             log_widths1=torch.reshape(extra_inputs[:,extra_input_counter:extra_input_counter+self.num_params_per_item], [x.shape[0] , self.num_transforms,  self.dimension])
@@ -246,7 +228,7 @@ class psf_block(euclidean_base.euclidean_base):
        
         if self.use_householder:
          
-            x = torch.bmm(rotation_matrix, x.unsqueeze(-1)).squeeze(-1)
+            x = matrix_fns.apply_matrix(rotation_matrix, x)
         
         return x, log_det
 
@@ -272,13 +254,7 @@ class psf_block(euclidean_base.euclidean_base):
 
             rotation_matrix = self.compute_householder_matrix(this_vs, device=x.device)
 
-            if(rotation_matrix.shape[0]!=x.shape[0]):
-                if(rotation_matrix.shape[0]<x.shape[0]):
-                    rotation_matrix=rotation_matrix.repeat(x.shape[0], 1,1)
-                else:
-                    raise Exception("rotation matrix first dim is larger than data first dim (batch dim) .. taht should never happen!")
-                
-            x = torch.bmm(rotation_matrix.permute(0,2,1), x.unsqueeze(-1)).squeeze(-1)  # uncomment
+            x = matrix_fns.apply_matrix(rotation_matrix, x, transpose=True)
 
         
         if(extra_inputs is not None):
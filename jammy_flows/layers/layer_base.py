@@ -22,6 +22,42 @@ class layer_base(nn.Module):
 
         self.always_parametrize_in_embedding_space=always_parametrize_in_embedding_space
 
+        ## caches of quantities that only depend on permanent parameters .. name -> (cache key, value)
+        self._parameter_caches=dict()
+
+    def _cached_parameter_function(self, cache_name, fn, extra_inputs=None, key_extras=()):
+        """
+        Returns *fn()*, cached under *cache_name* for non-conditional layers with permanent parameters evaluated without gradients.
+        The value is only recomputed if a parameter changes (e.g. after an optimizer step), or if *key_extras* (e.g. dtype/device) change.
+
+        Parameters:
+            cache_name (str): Name of the cached quantity.
+            fn (function): Function without arguments that computes the quantity.
+            extra_inputs (Tensor/None): Conditional flow parameters. Caching is disabled if given.
+            key_extras (tuple): Further hashable items that determine the value.
+
+        Returns:
+            The (possibly cached) result of *fn*.
+        """
+        use_cache=(extra_inputs is None) and getattr(self, "use_permanent_parameters", False) and (torch.is_grad_enabled()==False)
+
+        if(not use_cache):
+            self._parameter_caches.pop(cache_name, None)
+            return fn()
+
+        ## in-place updates (optimizer steps) increase the version counter, re-assignments of .data change the data pointer
+        cache_key=tuple([(p.data_ptr(), p._version) for p in self.parameters()])+tuple(key_extras)
+
+        cached=self._parameter_caches.get(cache_name)
+
+        if(cached is not None and cached[0]==cache_key):
+            return cached[1]
+
+        value=fn()
+        self._parameter_caches[cache_name]=(cache_key, value)
+
+        return value
+
     def get_total_param_num(self):
         return self.total_param_num
 
@@ -143,4 +143,99 @@ def obtain_inverse_lower_triangular_matrix_and_logdet(dimension, single_log_diag
         return tot_output, -log_diagonal_entries.sum(axis=-1)
 
     else:
-        raise Exception("Unknown cov type", cov_type)
\ No newline at end of file
+        raise Exception("Unknown cov type", cov_type)
+
+def apply_matrix(matrix, x, transpose=False):
+    """
+    Applies a batch of matrices to a batch of vectors without materializing batch-repeated copies of shared matrices.
+
+    Parameters:
+        matrix (Tensor): Matrices of shape (1, D, D) (shared across the batch) or (B, D, D) (amortized).
+        x (Tensor): Vectors of shape (B, D).
+        transpose (bool): If True, applies the transposed matrices.
+
+    Returns:
+        Tensor
+            Transformed vectors of shape (B, D).
+    """
+
+    if(matrix.shape[0]==1):
+        ## single matmul with the shared matrix .. (x M^T)^T = M x
+        if(transpose):
+            return torch.matmul(x, matrix[0])
+        else:
+            return torch.matmul(x, matrix[0].T)
+
+    if(matrix.shape[0]!=x.shape[0]):
+        raise Exception("first dim of rotation matrix (%d) does not match batch dim (%d)" % (matrix.shape[0], x.shape[0]))
+
+    if(transpose):
+        matrix=matrix.permute(0,2,1)
+
+    return torch.bmm(matrix, x.unsqueeze(-1)).squeeze(-1)
+
+def obtain_householder_matrix(vs):
+    """
+    Computes the product of Householder reflections Q = H_1 H_2 ... H_K, H_i = I - 2 v_i v_i^T / (v_i^T v_i), in compact WY form Q = I - V T^{-1} V^T.
+    T is upper triangular with the strictly upper part of V^T V and half its diagonal, so no sequential loop over reflections is required.
+
+    Parameters:
+        vs (Tensor): Reflection vectors of shape (B, K, D). They do not have to be normalized.
+
+    Returns:
+        Tensor
+            Orthogonal matrices of shape (B, D, D).
+    """
+
+    gram=torch.bmm(vs, vs.permute(0,2,1))
+
+    t_matrix=torch.triu(gram, diagonal=1)+torch.diag_embed(0.5*torch.diagonal(gram, dim1=-2, dim2=-1))
+
+    ## T^{-1} V^T
+    w=torch.linalg.solve_triangular(t_matrix, vs, upper=True)
+
+    return torch.eye(vs.shape[2], dtype=vs.dtype, device=vs.device).unsqueeze(0)-torch.bmm(vs.permute(0,2,1), w)
+
+def obtain_givens_rotation_matrix(angles, dim):
+    """
+    Computes the product of Givens rotations G_K ... G_2 G_1 for all axis pairs (a,b), a<b, in the order of *itertools.combinations*, where G_i rotates 
+    the (a,b) plane by angle i. All rotations are written with a constant number of indexing operations and multiplied in a balanced binary tree, 
+    which requires log2(K) batched matrix products instead of K sequential ones.
+
+    Parameters:
+        angles (Tensor): Rotation angles of shape (B, K) with K = dim*(dim-1)/2.
+        dim (int): Dimension of the rotation matrices.
+
+    Returns:
+        Tensor
+            Rotation matrices of shape (B, dim, dim).
+    """
+
+    pairs=torch.triu_indices(dim, dim, offset=1, device=angles.device)
+    first_axes=pairs[0]
+    second_axes=pairs[1]
+
+    num_rotations=first_axes.shape[0]
+    assert(angles.shape[1]==num_rotations), (angles.shape, num_rotations)
+
+    rotation_index=torch.arange(num_rotations, device=angles.device)
+
+    cos_angles=torch.cos(angles)
+    sin_angles=torch.sin(angles)
+
+    matrices=torch.eye(dim, dtype=angles.dtype, device=angles.device).repeat(angles.shape[0], num_rotations, 1, 1)
+
+    matrices[:, rotation_index, first_axes, first_axes]=cos_angles
+    matrices[:, rotation_index, second_axes, second_axes]=cos_angles
+    matrices[:, rotation_index, first_axes, second_axes]=sin_angles
+    matrices[:, rotation_index, second_axes, first_axes]=-sin_angles
+
+    ## later rotations act from the left .. pair neighbours as M_{2j+1} M_{2j}
+    while(matrices.shape[1]>1):
+
+        if(matrices.shape[1]%2==1):
+            matrices=torch.cat([matrices, torch.eye(dim, dtype=angles.dtype, device=angles.device).repeat(angles.shape[0], 1, 1, 1)], dim=1)
+
+        matrices=torch.matmul(matrices[:, 1::2], matrices[:, 0::2])
+
+    return matrices[:, 0]
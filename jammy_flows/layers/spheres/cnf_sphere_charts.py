@@ -3,6 +3,7 @@ from torch import nn
 import numpy
 
 from torchdiffeq import odeint_adjoint as odeint
+from torchdiffeq import odeint as odeint_no_adjoint
 
 from . import sphere_base
 from . import moebius_1d
@@ -11,6 +12,7 @@ from ...amortizable_mlp import AmortizableMLP
 from ...extra_functions import  list_from_str
 from .cnf_specific.cnf_sphere_manifold import Sphere
 from .cnf_specific.utils import MultiInputSequential
+from ...helper_fns import profiling
 import sys
 import os
 import copy
@@ -43,6 +45,13 @@ def divergence_bf(dx, y, **unused_kwargs):
         sum_diag += torch.autograd.grad(dx[:, i].sum(), y, create_graph=True)[0].contiguous()[:, i].contiguous()
     return sum_diag.contiguous()
 
+def divergence_approx(dx, y, e=None):
+    """
+    Hutchinson trace estimator e^T (d dx/dy) e with a single vector-Jacobian product. *e* is a Rademacher noise vector of the shape of *y*.
+    """
+    e_dzdx = torch.autograd.grad(dx, y, e, create_graph=True)[0]
+    return (e_dzdx*e).sum(dim=1)
+
 
 def create_network(input_size, output_size, hidden_size, n_hidden):
     print("creating network with hidden size ", hidden_size, " and num hidden ", n_hidden)
@@ -70,14 +79,21 @@ class TimeNetwork(nn.Module):
 
 class ODEfunc(nn.Module):
 
-    def __init__(self, diffeq):
+    def __init__(self, diffeq, divergence_fn="brute_force"):
         super(ODEfunc, self).__init__()
 
+        assert(divergence_fn in ["brute_force", "approximate"])
+
         self.diffeq = diffeq
+        self.divergence_fn = divergence_fn
+
+        ## the noise of the trace estimator is fixed for a whole solve
+        self._e = None
         
         self.register_buffer("_num_evals", torch.tensor(0.))
 
     def before_odeint(self, e=None):
+        self._e = e
         self._num_evals.fill_(0)
 
     def num_evals(self):
@@ -99,8 +115,14 @@ class ODEfunc(nn.Module):
             t.requires_grad_(True)
          
             dy = self.diffeq(t, y)
-          
-            divergence = divergence_bf(dy, y).unsqueeze(-1)
+
+            if(self.divergence_fn=="approximate"):
+                if(self._e is None):
+                    self._e = torch.randint(low=0, high=2, size=y.shape, device=y.device).to(y)*2.0-1.0
+
+                divergence = divergence_approx(dy, y, e=self._e).unsqueeze(-1)
+            else:
+                divergence = divergence_bf(dy, y).unsqueeze(-1)
 
         return tuple([dy, -divergence])
 
@@ -144,6 +166,9 @@ class AmbientProjNN(nn.Module):
 
 class cnf_sphere_charts(sphere_base.sphere_base):
 
+    ## the adaptive torchdiffeq solver can not be traced by torch.compile
+    supports_compilation=False
+
     def __init__(self, 
         dimension, 
         euclidean_to_sphere_as_first=False, 
@@ -155,7 +180,10 @@ class cnf_sphere_charts(sphere_base.sphere_base):
         solver="rk4", 
         atol=1e-7,
         rtol=1e-7,
-        step_size=1.0/32.0):
+        step_size=1.0/32.0,
+        num_steps_per_chart=0,
+        trace_estimator="exact",
+        use_adjoint=1):
 
         """
         Continuous manifold normalizing flow - Symbol: "c"
@@ -173,7 +201,13 @@ class cnf_sphere_charts(sphere_base.sphere_base):
             atol (float): Absolute tolerance. (Used for adaptive solvers like dopri)
             rtol (float): Relative tolerance. (Used for adaptive solvers like dopri)
             step_size (float): Step size for fixed step solvers (like rk4, euler).
+            num_steps_per_chart (int): If larger than 0, fixed step solvers ("rk4", "midpoint", "euler") take this many steps per chart instead of using *step_size*.
+            trace_estimator (str): "exact" calculates the divergence with one backward pass per dimension. "hutchinson" uses a stochastic Hutchinson estimate with 
+                                   a single backward pass while training with gradients, and the exact divergence otherwise (evaluation, sampling).
+            use_adjoint (int): If 1, gradients are calculated with the adjoint method (constant memory). If 0, backpropagates directly through the solver steps, which 
+                               is faster for a few fixed steps but stores all intermediate states.
 
+        The number of vector-field evaluations of the last call is stored in *last_num_evals* and reported as *num_ode_evals* by the profiler (see *pdf.profile*).
         """
 
         
@@ -208,6 +242,16 @@ class cnf_sphere_charts(sphere_base.sphere_base):
         self.solver_options = {'step_size': step_size}
         self.man = sphere
         self.num_charts=num_charts
+
+        assert(trace_estimator in ["exact", "hutchinson"]), trace_estimator
+        self.trace_estimator=trace_estimator
+        self.use_adjoint=use_adjoint
+
+        self.num_steps_per_chart=num_steps_per_chart
+        if(self.num_steps_per_chart>0):
+            assert(self.solver in ["rk4", "midpoint", "euler"]), "A fixed number of steps requires a fixed step solver (rk4, midpoint or euler)."
+
+        self.last_num_evals=0
             
         ## a function
         self.func = AmbientProjNN(TimeNetwork(self.cnf_network))
@@ -238,23 +282,48 @@ class cnf_sphere_charts(sphere_base.sphere_base):
         #scale = -1 if reverse else 1
         scale=1
 
+        ## stochastic trace only for training .. evaluation and sampling use the exact divergence
+        divergence_fn="brute_force"
+        if(self.trace_estimator=="hutchinson" and self.training and torch.is_grad_enabled()):
+            divergence_fn="approximate"
+
+        solver_options=self.solver_options
+        if(self.num_steps_per_chart>0):
+            solver_options={'step_size': 1.0/(charts*self.num_steps_per_chart)}
+
+        num_evals=0
+
         for time in integration_times:
             chartproj = SphereProj(self.func, loc, extra_inputs=extra_inputs)
-            chartfunc = ODEfunc(chartproj)
+            chartfunc = ODEfunc(chartproj, divergence_fn=divergence_fn)
+            chartfunc.before_odeint()
 
             logpz_t -= scale * self.man.logdetexp(loc, tangval)
 
             # integrate as a tangent space operation
-            state_t = odeint(
-                    chartfunc,
-                    (tangval, torch.zeros(tangval.shape[0], 1).to(tangval)),
-                    time.to(z),
-                    atol=self.atol,
-                    rtol=self.rtol,
-                    method=self.solver,
-                    options=self.solver_options,
-                    adjoint_params=self.variables
-                )
+            if(self.use_adjoint):
+                state_t = odeint(
+                        chartfunc,
+                        (tangval, torch.zeros(tangval.shape[0], 1).to(tangval)),
+                        time.to(z),
+                        atol=self.atol,
+                        rtol=self.rtol,
+                        method=self.solver,
+                        options=solver_options,
+                        adjoint_params=self.variables
+                    )
+            else:
+                state_t = odeint_no_adjoint(
+                        chartfunc,
+                        (tangval, torch.zeros(tangval.shape[0], 1).to(tangval)),
+                        time.to(z),
+                        atol=self.atol,
+                        rtol=self.rtol,
+                        method=self.solver,
+                        options=solver_options
+                    )
+
+            num_evals+=chartfunc.num_evals()
 
             # extract information
             state_t = tuple(s[1] for s in state_t)
@@ -271,6 +340,9 @@ class cnf_sphere_charts(sphere_base.sphere_base):
             loc = z_n
             tangval = self.man.log(loc, z_n)
 
+        self.last_num_evals=int(num_evals)
+        profiling.record_ode_evals(self.last_num_evals)
+
         return z_n, logpz_t
 
     """
@@ -3,7 +3,7 @@ from torch import nn
 import numpy
 import collections
 from .. import layer_base
-import itertools
+from .. import matrix_fns
 
 def return_safe_angle_within_pi(x, safety_margin=1e-7):
     """
@@ -109,6 +109,17 @@ class sphere_base(layer_base.layer_base):
     
 
     def compute_rotation_matrix(self, x, extra_inputs=None, mode="householder", device=torch.device("cpu")):
+        """
+        Rotation matrix in embedding space. For permanent parameters evaluated without gradients, the matrix is cached and only recomputed 
+        if a parameter changes (e.g. after an optimizer step), or dtype/device change.
+        """
+
+        return self._cached_parameter_function("rotation_matrix",
+                                               lambda: self._compute_rotation_matrix_uncached(x, extra_inputs=extra_inputs, mode=mode, device=device),
+                                               extra_inputs=extra_inputs,
+                                               key_extras=(mode, x.dtype, device))
+
+    def _compute_rotation_matrix_uncached(self, x, extra_inputs=None, mode="householder", device=torch.device("cpu")):
 
         if(mode=="householder"):
 
@@ -123,57 +134,29 @@ class sphere_base(layer_base.layer_base):
                 mat_pars=torch.reshape(self.householder_params, [-1, hh_dim, hh_dim]).to(x)
                 #mat_pars=mat_pars.repeat(x.shape[0],1,1)
 
-            return self.compute_householder_matrix(mat_pars, hh_dim, device=device)
+            mat=self.compute_householder_matrix(mat_pars, hh_dim, device=device)
 
         elif(mode=="angles"):
 
             if(extra_inputs is None):
-                rotation_params=self.householder_params.repeat(x.shape[0], 1)
+                ## a single shared matrix (first dim 1) is broadcast when applied
+                rotation_params=self.householder_params.to(x)
 
             else:
                 
                 rotation_params=extra_inputs[:,:self.num_householder_params]
 
             ## rotation is in embedding space with dim: self.dimension+1
-            combi_list=[]
-
-            for a, b in itertools.combinations(numpy.arange(self.dimension+1), 2):
-                combi_list.append( (a,b) )
-
-            base_matrix=torch.eye(self.dimension+1).to(rotation_params).unsqueeze(0).repeat(rotation_params.shape[0],1,1)
-
-            prev_matrix=base_matrix
-                
-            for ind, combi in enumerate(combi_list):
-
-                new_matrix=base_matrix.clone()
-
-                new_matrix[:, combi[0], combi[0]]=torch.cos(rotation_params[:, ind])
-                new_matrix[:, combi[1], combi[1]]=new_matrix[:, combi[0], combi[0]]
-                new_matrix[:, combi[0], combi[1]]=torch.sin(rotation_params[:, ind])
-                new_matrix[:, combi[1], combi[0]]=-new_matrix[:, combi[0], combi[1]]
+            mat=matrix_fns.obtain_givens_rotation_matrix(rotation_params, self.dimension+1)
 
-                prev_matrix=torch.bmm(new_matrix, prev_matrix)
-           
-            return prev_matrix
         else:
             raise Exception("Unknown rotation mode for spheres: ", mode)
 
-    def compute_householder_matrix(self, vs, dim,device=torch.device("cpu")):
+        return mat
 
-        Q = torch.eye(dim, device=device).type(vs.dtype).unsqueeze(0).repeat(vs.shape[0], 1,1)
-       
-        for i in range(dim):
-        
-            v = vs[:,i].reshape(-1,dim, 1).to(device)
-            
-            v = v / v.norm(dim=1).unsqueeze(-1)
-
-            Qi = torch.eye(dim, device=device).type(vs.dtype).unsqueeze(0) - 2 * torch.bmm(v, v.permute(0, 2, 1))
-
-            Q = torch.bmm(Q, Qi)
+    def compute_householder_matrix(self, vs, dim,device=torch.device("cpu")):
 
-        return Q
+        return matrix_fns.obtain_householder_matrix(vs.reshape(-1, dim, dim).to(device))
 
     def eucl_to_spherical_embedding(self, x, log_det):
         
@@ -535,8 +518,7 @@ class sphere_base(layer_base.layer_base):
 
             
             ## permute because we do inverse rotation
-            #x = torch.bmm(mat.permute(0,2,1), x.unsqueeze(-1)).squeeze(-1)
-            x = torch.einsum("...ij, ...j -> ...i", mat.permute(0,2,1), x)
+            x = matrix_fns.apply_matrix(mat, x, transpose=True)
 
             if(self.always_parametrize_in_embedding_space==False):
                 x, log_det=self.eucl_to_spherical_embedding(x, log_det)
@@ -595,10 +577,8 @@ class sphere_base(layer_base.layer_base):
             
             mat=self.compute_rotation_matrix(x,extra_inputs=extra_inputs, mode=self.rotation_mode, device=x.device)
 
-            #x = torch.bmm(mat, x.unsqueeze(-1)).squeeze(-1)  # uncomment
-
-            ## use broadcasting
-            x = torch.einsum("...ij, ...j -> ...i", mat, x)
+            ## use broadcasting for shared matrices
+            x = matrix_fns.apply_matrix(mat, x)
             if(self.always_parametrize_in_embedding_space==False):
               
                 x, log_det=self.eucl_to_spherical_embedding(x, log_det)
@@ -647,7 +627,7 @@ class sphere_base(layer_base.layer_base):
 
         ## permute because we do inverse rotation
         
-        eucl = torch.einsum("...ij, ...j -> ...i", mat.permute(0,2,1), eucl)
+        eucl = matrix_fns.apply_matrix(mat, eucl, transpose=True)
         
         new_pts,_=self.eucl_to_spherical_embedding(eucl,0.0)
 
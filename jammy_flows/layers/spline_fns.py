@@ -164,19 +164,21 @@ def rational_quadratic_spline(inputs,
            
             return outputs, logabsdet
 
-def rational_quadratic_spline_with_linear_extension(inputs,
-                              unnormalized_widths,
-                              unnormalized_heights,
-                              unnormalized_derivatives,
-                              inverse=False,
-                              left=torch.DoubleTensor([[[0.0]]]), right=torch.DoubleTensor([[[1.0]]]), bottom=torch.DoubleTensor([[[0.0]]]), top=torch.DoubleTensor([[[1.0]]]),
-                              rel_min_bin_width=1e-3,
-                              rel_min_bin_height=1e-3,
-                              min_derivative=1e-3):
-
-        
-        assert(len(inputs.shape)==3)
-        assert(inputs.shape[2]==1)
+def obtain_rq_spline_knots(unnormalized_widths,
+                           unnormalized_heights,
+                           unnormalized_derivatives,
+                           left=torch.DoubleTensor([[[0.0]]]), right=torch.DoubleTensor([[[1.0]]]), bottom=torch.DoubleTensor([[[0.0]]]), top=torch.DoubleTensor([[[1.0]]]),
+                           rel_min_bin_width=1e-3,
+                           rel_min_bin_height=1e-3,
+                           min_derivative=1e-3):
+        """
+        Transforms unnormalized spline parameters into the knots used by *rational_quadratic_spline_with_linear_extension_from_knots*. 
+        The knots only depend on the parameters, so they can be computed once and reused for many evaluations.
+
+        Returns:
+            tuple
+                (cumwidths, widths, cumheights, heights, derivatives, left, right, bottom, top)
+        """
 
         # all parameters must come in 1 X dim X num_bins or batchsize X dim X num_bins/num_splines (3-tensor)
         assert(len(unnormalized_widths.shape)==3)
@@ -227,6 +229,44 @@ def rational_quadratic_spline_with_linear_extension(inputs,
         #cumheights[..., -2:-1] = top
         heights = cumheights[..., 1:] - cumheights[..., :-1]
 
+        return cumwidths, widths, cumheights, heights, derivatives, left, right, bottom, top
+
+def rational_quadratic_spline_with_linear_extension(inputs,
+                              unnormalized_widths,
+                              unnormalized_heights,
+                              unnormalized_derivatives,
+                              inverse=False,
+                              left=torch.DoubleTensor([[[0.0]]]), right=torch.DoubleTensor([[[1.0]]]), bottom=torch.DoubleTensor([[[0.0]]]), top=torch.DoubleTensor([[[1.0]]]),
+                              rel_min_bin_width=1e-3,
+                              rel_min_bin_height=1e-3,
+                              min_derivative=1e-3):
+
+        
+        assert(len(inputs.shape)==3)
+        assert(inputs.shape[2]==1)
+
+        knots=obtain_rq_spline_knots(unnormalized_widths,
+                                     unnormalized_heights,
+                                     unnormalized_derivatives,
+                                     left=left,
+                                     right=right,
+                                     bottom=bottom,
+                                     top=top,
+                                     rel_min_bin_width=rel_min_bin_width,
+                                     rel_min_bin_height=rel_min_bin_height,
+                                     min_derivative=min_derivative)
+
+        return rational_quadratic_spline_with_linear_extension_from_knots(inputs, knots, inverse=inverse)
+
+def rational_quadratic_spline_with_linear_extension_from_knots(inputs, knots, inverse=False):
+        """
+        Evaluates the rational-quadratic spline with linear extension given precomputed knots from *obtain_rq_spline_knots*.
+        """
+        assert(len(inputs.shape)==3)
+        assert(inputs.shape[2]==1)
+
+        cumwidths, widths, cumheights, heights, derivatives, left, right, bottom, top=knots
+
         if inverse:
             bin_idx = searchsorted(cumheights, inputs,eps=0.0)#[..., None]
         else:
@@ -236,22 +276,19 @@ def rational_quadratic_spline_with_linear_extension(inputs,
         bin_idx=torch.where(bin_idx<0, 0, bin_idx)
         bin_idx=torch.where(bin_idx>=heights.shape[-1], heights.shape[-1]-1, bin_idx)
 
+        delta = heights / widths
+
         if(cumwidths.shape[0]==1 and bin_idx.shape[0]>1):
 
-          repeats=[bin_idx.shape[0]]+(len(cumwidths.shape)-1)*[1]
+          ## expand instead of repeat .. no copies required for gather
+          expanded_shape=[bin_idx.shape[0]]+(len(cumwidths.shape)-1)*[-1]
           
-          cumwidths=cumwidths.repeat(repeats)
-          widths=widths.repeat(repeats)
-          heights=heights.repeat(repeats)
-          cumheights=cumheights.repeat(repeats)
-          derivatives=derivatives.repeat(repeats)
-
-          repeats=[bin_idx.shape[0]]+(len(left.shape)-1)*[1]
-
-          left=left.repeat(repeats)
-          right=right.repeat(repeats)
-          top=top.repeat(repeats)
-          bottom=bottom.repeat(repeats)
+          cumwidths=cumwidths.expand(expanded_shape)
+          widths=widths.expand(expanded_shape)
+          heights=heights.expand(expanded_shape)
+          cumheights=cumheights.expand(expanded_shape)
+          derivatives=derivatives.expand(expanded_shape)
+          delta=delta.expand(expanded_shape)
 
         
         input_cumwidths = cumwidths.gather(-1, bin_idx)#[..., 0]
@@ -259,7 +296,6 @@ def rational_quadratic_spline_with_linear_extension(inputs,
         input_bin_widths = widths.gather(-1, bin_idx)#[..., 0]
 
         input_cumheights = cumheights.gather(-1, bin_idx)#[..., 0]
-        delta = heights / widths
         input_delta = delta.gather(-1, bin_idx)#[..., 0]
 
         input_derivatives = derivatives.gather(-1, bin_idx)#[..., 0]
@@ -0,0 +1,325 @@
+import torch
+from torch import nn
+import numpy
+
+class frozen_inference_flow(nn.Module):
+    """
+    Inference-only view of a *pdf*. The autoregressive branch structure (conditional vs. non-conditional, list-type conditional input,
+    stripping of the Poisson normalization output, parameter slices of each layer) is resolved once at construction time,
+    so the resulting mapping contains no data-dependent Python branching and can be passed to *torch.compile*.
+    """
+    def __init__(self,
+                 pdf,
+                 force_embedding_coordinates=False,
+                 force_intrinsic_coordinates=False):
+        """
+        Parameters:
+            pdf (jammy_flows.pdf): The PDF to freeze. Fully amortized PDFs are not supported.
+            force_embedding_coordinates (bool): Enforces embedding coordinates in the inputs of *log_prob* and the outputs of *sample_mapping*.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates in the inputs of *log_prob* and the outputs of *sample_mapping*.
+        """
+        super().__init__()
+
+        if(pdf.amortize_everything):
+            raise Exception("Compiled inference does not support fully amortized PDFs (amortize_everything=True).")
+
+        assert( (force_embedding_coordinates and force_intrinsic_coordinates)==False), "Can only force embedding OR intrinsic coordinates!"
+
+        self.pdf=pdf
+        self.force_embedding_coordinates=force_embedding_coordinates
+        self.force_intrinsic_coordinates=force_intrinsic_coordinates
+
+        self.list_conditional_input=(type(pdf.conditional_input_dim)==list)
+
+        ## per sub-pdf: (target slice, base slice, has encoder, strip log-normalization output, [(layer, forward param slice, inverse param slice)])
+        self.plan=[]
+
+        for pdf_index, pdf_layers in enumerate(pdf.layer_list):
+
+            strip_log_norm=pdf.predict_log_normalization and pdf.join_poisson_and_pdf_description and (pdf_index==0)
+
+            has_predictor=pdf.mlp_predictors[pdf_index] is not None
+
+            if(has_predictor and pdf_index==0 and pdf.conditional_input_dim is None):
+                raise Exception("First sub-pdf has an encoder but the PDF is not conditional .. this should never happen!")
+
+            layer_plan=[]
+
+            forward_counter=0
+            for layer in pdf_layers:
+                forward_slice=slice(forward_counter, forward_counter+layer.total_param_num)
+                forward_counter+=layer.total_param_num
+
+                layer_plan.append([layer, forward_slice, None])
+
+            ## the inverse pass slices from the end, mirroring *all_layer_inverse*
+            inverse_counter=0
+            for layer_entry in reversed(layer_plan):
+                num_params=layer_entry[0].total_param_num
+                if(inverse_counter==0):
+                    layer_entry[2]=slice(-num_params, None)
+                else:
+                    layer_entry[2]=slice(-inverse_counter-num_params, -inverse_counter)
+
+                inverse_counter+=num_params
+
+            self.plan.append((slice(pdf.target_dim_indices[pdf_index][0], pdf.target_dim_indices[pdf_index][1]),
+                              slice(pdf.base_dim_indices[pdf_index][0], pdf.base_dim_indices[pdf_index][1]),
+                              has_predictor,
+                              strip_log_norm,
+                              [tuple(l) for l in layer_plan]))
+
+    def _predict_params(self, pdf_index, has_predictor, strip_log_norm, data_summary, extra_conditional_input):
+
+        if(has_predictor==False):
+            return None
+
+        if(data_summary is not None):
+            this_data_summary=data_summary[pdf_index] if self.list_conditional_input else data_summary
+
+            if(len(extra_conditional_input)>0):
+                this_data_summary=torch.cat([this_data_summary]+extra_conditional_input, dim=1)
+        else:
+            this_data_summary=torch.cat(extra_conditional_input, dim=1)
+
+        extra_params=self.pdf.mlp_predictors[pdf_index](this_data_summary)
+
+        if(strip_log_norm):
+            extra_params=extra_params[:,:-1]
+
+        return extra_params
+
+    def log_prob(self, x, data_summary=None):
+        """
+        Frozen equivalent of *pdf.forward*.
+
+        Parameters:
+            x (Tensor): Target positions of shape (B,D).
+            data_summary (Tensor/list(Tensor)/None): Conditional input.
+
+        Returns:
+            Tensor
+                Log-probability, shape = (B,)
+            Tensor
+                Log-probability at base distribution, shape = (B,)
+            Tensor
+                Position at base distribution, shape = (B,D)
+        """
+
+        log_det=torch.zeros(x.shape[0], dtype=x.dtype, device=x.device)
+
+        if(self.force_embedding_coordinates):
+            x, log_det=self.pdf.transform_target_space(x, log_det, transform_from="embedding", transform_to="default")
+        elif(self.force_intrinsic_coordinates):
+            x, log_det=self.pdf.transform_target_space(x, log_det, transform_from="intrinsic", transform_to="default")
+
+        extra_conditional_input=[]
+        base_targets=[]
+
+        for pdf_index, (target_slice, _, has_predictor, strip_log_norm, layer_plan) in enumerate(self.plan):
+
+            extra_params=self._predict_params(pdf_index, has_predictor, strip_log_norm, data_summary, extra_conditional_input)
+
+            this_target=x[:,target_slice]
+
+            for layer, _, inverse_slice in reversed(layer_plan):
+                this_extra_params=None if extra_params is None else extra_params[:, inverse_slice]
+
+                this_target, log_det=layer.inv_flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
+
+            base_targets.append(this_target)
+
+            extra_conditional_input.append(layer_plan[-1][0]._embedding_conditional_return(x[:,target_slice]))
+
+        base_pos=torch.cat(base_targets, dim=1)
+
+        log_pdf_base=(-0.5*base_pos**2-0.5*numpy.log(2*numpy.pi)).sum(dim=-1)
+
+        return log_pdf_base+log_det, log_pdf_base, base_pos
+
+    def sample_mapping(self, base_x, data_summary=None):
+        """
+        Frozen equivalent of *pdf.all_layer_forward* including the base log-pdf evaluation.
+
+        Parameters:
+            base_x (Tensor): Positions in the base space of shape (B,D_base).
+            data_summary (Tensor/list(Tensor)/None): Conditional input.
+
+        Returns:
+            Tensor
+                Sample in target space.
+            Tensor
+                Log-pdf evaluation in target space.
+            Tensor
+                Log-pdf evaluation in base space.
+        """
+        log_det=torch.zeros(base_x.shape[0], dtype=base_x.dtype, device=base_x.device)
+
+        extra_conditional_input=[]
+        new_targets=[]
+
+        for pdf_index, (_, base_slice, has_predictor, strip_log_norm, layer_plan) in enumerate(self.plan):
+
+            extra_params=self._predict_params(pdf_index, has_predictor, strip_log_norm, data_summary, extra_conditional_input)
+
+            this_target=base_x[:,base_slice]
+
+            for layer, forward_slice, _ in layer_plan:
+                this_extra_params=None if extra_params is None else extra_params[:, forward_slice]
+
+                this_target, log_det=layer.flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
+
+            new_targets.append(this_target)
+
+            extra_conditional_input.append(layer_plan[-1][0]._embedding_conditional_return(this_target))
+
+        x=torch.cat(new_targets, dim=1)
+
+        if(self.force_embedding_coordinates):
+            x, log_det=self.pdf.transform_target_space(x, log_det, transform_from="default", transform_to="embedding")
+        elif(self.force_intrinsic_coordinates):
+            x, log_det=self.pdf.transform_target_space(x, log_det, transform_from="default", transform_to="intrinsic")
+
+        log_pdf_base=(-0.5*base_x**2-0.5*numpy.log(2*numpy.pi)).sum(dim=-1)
+
+        return x, -log_det+log_pdf_base, log_pdf_base
+
+class compiled_inference(object):
+    """
+    Compiled *log_prob* and *sample* callables of a *pdf* for a fixed configuration. Created via *pdf.compile_for_inference*.
+    Falls back to the frozen (uncompiled) mapping if any layer does not support compilation, or if compilation fails at the first call.
+    """
+    def __init__(self,
+                 pdf,
+                 force_embedding_coordinates=False,
+                 force_intrinsic_coordinates=False,
+                 backend="inductor",
+                 mode=None,
+                 dynamic=True,
+                 verbose=False):
+
+        self.pdf=pdf
+        self.frozen_flow=frozen_inference_flow(pdf, force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
+        self.verbose=verbose
+
+        self.non_compilable_layers=[]
+        for pdf_layers in pdf.layer_list:
+            for layer in pdf_layers:
+                if(getattr(layer, "supports_compilation", True)==False):
+                    self.non_compilable_layers.append(type(layer).__name__)
+
+        self.fallback_reasons=dict()
+
+        self._log_prob_fn=self.frozen_flow.log_prob
+        self._sample_fn=self.frozen_flow.sample_mapping
+
+        if(len(self.non_compilable_layers)>0):
+            self.fallback_reasons["log_prob"]=self.fallback_reasons["sample"]="layers %s do not support compilation" % (", ".join(self.non_compilable_layers))
+
+        elif(hasattr(torch, "compile")==False):
+            self.fallback_reasons["log_prob"]=self.fallback_reasons["sample"]="torch.compile is not available"
+
+        else:
+            try:
+                self._log_prob_fn=torch.compile(self.frozen_flow.log_prob, backend=backend, mode=mode, dynamic=dynamic)
+                self._sample_fn=torch.compile(self.frozen_flow.sample_mapping, backend=backend, mode=mode, dynamic=dynamic)
+            except Exception as e:
+                self._log_prob_fn=self.frozen_flow.log_prob
+                self._sample_fn=self.frozen_flow.sample_mapping
+
+                self.fallback_reasons["log_prob"]=self.fallback_reasons["sample"]=repr(e)
+
+        if(self.verbose and len(self.fallback_reasons)>0):
+            print("Compiled inference: ", self.fallback_reasons["log_prob"], " .. using the frozen uncompiled mapping")
+
+    @property
+    def is_compiled(self):
+        """
+        True if neither *log_prob* nor *sample* had to fall back to the uncompiled mapping.
+        """
+        return len(self.fallback_reasons)==0
+
+    def _call_with_fallback(self, name, args):
+
+        try:
+            return getattr(self, "_%s_fn" % name)(*args)
+        except Exception as e:
+
+            if(name in self.fallback_reasons):
+                raise
+
+            ## compilation happens lazily at the first call - fall back to the frozen mapping if it fails
+            self.fallback_reasons[name]=repr(e)
+
+            if(self.verbose):
+                print("Compiled inference: compilation of %s failed with %s .. using the frozen uncompiled mapping" % (name, repr(e)))
+
+            if(name=="log_prob"):
+                self._log_prob_fn=self.frozen_flow.log_prob
+            else:
+                self._sample_fn=self.frozen_flow.sample_mapping
+
+            return getattr(self, "_%s_fn" % name)(*args)
+
+    def log_prob(self, x, conditional_input=None):
+        """
+        Calculates the log-probability like *pdf.forward* (inference only, no gradients).
+
+        Parameters:
+            x (Tensor): Target position of shape (B,D).
+            conditional_input (Tensor/list(Tensor)/None): Conditional input.
+
+        Returns:
+            Tensor
+                Log-probability, shape = (B,)
+            Tensor
+                Log-probability at base distribution, shape = (B,)
+            Tensor
+                Position at base distribution, shape = (B,D)
+        """
+        with torch.no_grad():
+            return self._call_with_fallback("log_prob", (x, conditional_input))
+
+    def sample(self, samplesize=1, conditional_input=None, seed=None, dtype=None, device=None):
+        """
+        Samples like *pdf.sample* (inference only, no gradients). With the same seed, the base samples are identical to *pdf.sample*.
+
+        Parameters:
+            samplesize (int): Number of samples. Ignored if *conditional_input* is given.
+            conditional_input (Tensor/list(Tensor)/None): Conditional input.
+            seed (int/None): Numpy seed for the base samples.
+            dtype (torch dtype): If given, uses this dtype. Otherwise uses dtype from parameters.
+            device (torch.device): If given, uses this device. Otherwise uses device from parameters.
+
+        Returns:
+            Tensor
+                Sample in target space.
+            Tensor
+                Sample in base space.
+            Tensor
+                Log-pdf evaluation in target space
+            Tensor
+                Log-pdf evaluation in base space
+        """
+        data_type, used_device=self.pdf.obtain_current_dtype_n_device()
+
+        if(dtype is not None):
+            data_type=dtype
+        if(device is not None):
+            used_device=device
+
+        if(conditional_input is not None):
+            first_input=conditional_input[0] if self.frozen_flow.list_conditional_input else conditional_input
+            samplesize=first_input.shape[0]
+            data_type=first_input.dtype
+            used_device=first_input.device
+
+        if(seed is not None):
+            numpy.random.seed(seed)
+
+        base_samples=torch.from_numpy(numpy.random.normal(size=(samplesize, self.pdf.total_base_dim))).type(data_type).to(used_device)
+
+        with torch.no_grad():
+            samples, log_pdf, log_pdf_base=self._call_with_fallback("sample", (base_samples, conditional_input))
+
+        return samples, base_samples, log_pdf, log_pdf_base
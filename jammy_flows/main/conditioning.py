@@ -0,0 +1,163 @@
+import torch
+
+class conditioned_pdf(object):
+    """
+    A *pdf* with fixed conditional input. Created via *pdf.condition*. The flow parameters of the first sub-pdf only depend on the conditional input,
+    so they are predicted once per conditional row and gathered for every sample of that row. Later sub-pdfs also depend on the previous
+    sub-manifold targets and are evaluated per item, but their conditional input is gathered lazily via an index instead of being repeated.
+    """
+    def __init__(self, pdf, conditional_input):
+        """
+        Parameters:
+            pdf (jammy_flows.pdf): The conditional PDF. Fully amortized PDFs are not supported.
+            conditional_input (Tensor/list(Tensor)): Conditional input of shape (B,A), or list of such tensors.
+        """
+        if(pdf.amortize_everything):
+            raise Exception("Conditioning handles do not support fully amortized PDFs (amortize_everything=True).")
+
+        assert(pdf.conditional_input_dim is not None), "Conditioning handles require a conditional PDF."
+        assert(conditional_input is not None)
+
+        if(type(conditional_input)==list):
+
+            assert(len(pdf.conditional_input_dim)==len(conditional_input))
+            for ci_ind in range(len(pdf.conditional_input_dim)):
+                assert(pdf.conditional_input_dim[ci_ind]==conditional_input[ci_ind].shape[1]), "Inputs of conditional input vector do not match with pre-defined input_dims!"
+                assert(conditional_input[ci_ind].shape[0]==conditional_input[0].shape[0]), "Conditional input batch sizes do not agree!"
+
+            first_input=conditional_input[0]
+        else:
+            assert(pdf.conditional_input_dim==conditional_input.shape[1]), "Inputs of conditional input vector do not match with pre-defined input_dims!"
+            first_input=conditional_input
+
+        self.pdf=pdf
+        self.conditional_input=conditional_input
+
+        self.batch_size=first_input.shape[0]
+        self.dtype=first_input.dtype
+        self.device=first_input.device
+
+        self.cached_flow_params=pdf.obtain_cached_flow_params(conditional_input)
+
+    def _repeated_index(self, num_per_row):
+
+        if(type(num_per_row)!=int):
+            num_per_row=torch.as_tensor(num_per_row, dtype=torch.long, device=self.device)
+
+            if(num_per_row.dim()==0):
+                num_per_row=int(num_per_row)
+            else:
+                assert(num_per_row.dim()==1 and num_per_row.shape[0]==self.batch_size), "Per-row sample counts must be given for every conditional row."
+                assert((num_per_row>=0).all()), "Per-row sample counts must not be negative."
+
+        return torch.arange(self.batch_size, device=self.device).repeat_interleave(num_per_row)
+
+    def segment_offsets(self, num_per_row):
+        """
+        CSR-like offsets of the items of each conditional row, i.e. the items of row b are stored at [offsets[b], offsets[b+1]).
+
+        Parameters:
+            num_per_row (int/Tensor/list(int)): Number of items per conditional row.
+
+        Returns:
+            Tensor
+                Offsets of shape (B+1,).
+        """
+        num_per_row=torch.as_tensor(num_per_row, dtype=torch.long, device=self.device)
+
+        if(num_per_row.dim()==0):
+            num_per_row=num_per_row.repeat(self.batch_size)
+
+        return torch.cat([torch.zeros(1, dtype=torch.long, device=self.device), num_per_row.cumsum(dim=0)])
+
+    def sample(self,
+               samplesize=1,
+               seed=None,
+               allow_gradients=False,
+               force_embedding_coordinates=False,
+               force_intrinsic_coordinates=False,
+               failsafe_crosscheck_tolerance=None,
+               base_sampling="mc"):
+        """
+        Draws *samplesize* samples for every conditional row. The result is identical to *pdf.sample* with the conditional input repeated via *repeat_interleave(samplesize, dim=0)*.
+        The samples of each row are stored consecutively, see *segment_offsets*.
+
+        Parameters:
+            samplesize (int/Tensor/list(int)): Number of samples per conditional row. Either one number for all rows, or one number for each row (ragged sampling).
+            seed (None/int): Numpy seed for the base samples.
+            allow_gradients (bool): If False, does not build the graph.
+            force_embedding_coordinates (bool): Enforces embedding coordinates for the sample.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates for the sample.
+            failsafe_crosscheck_tolerance (float/None): See *pdf.sample*.
+            base_sampling (str): See *pdf.sample*. Antithetic pairs and Sobol blocks are formed within each conditional row for even (power of two) *samplesize*.
+
+        Returns:
+
+            Tensor
+                Sample in target space, shape (N, D), with N=B*samplesize or N=sum(samplesize) for per-row sample counts.
+            Tensor
+                Sample in base space.
+            Tensor
+                Log-pdf evaluation in target space
+            Tensor
+                Log-pdf evaluation in base space
+        """
+
+        with torch.set_grad_enabled(allow_gradients):
+            return self.pdf._obtain_sample(conditional_input=self.conditional_input,
+                                           seed=seed,
+                                           force_embedding_coordinates=force_embedding_coordinates,
+                                           force_intrinsic_coordinates=force_intrinsic_coordinates,
+                                           failsafe_crosscheck_tolerance=failsafe_crosscheck_tolerance,
+                                           conditional_input_index=self._repeated_index(samplesize),
+                                           cached_flow_params=self.cached_flow_params,
+                                           base_sampling=base_sampling)
+
+    def forward(self,
+                x,
+                conditional_input_index=None,
+                force_embedding_coordinates=False,
+                force_intrinsic_coordinates=False):
+        """
+        Calculates the log-probability like *pdf.forward*.
+
+        Parameters:
+            x (Tensor): Target positions of shape (N,D). Without *conditional_input_index*, N must be a multiple of B and the rows are assumed to be ordered
+                        like the output of *sample*, i.e. N/B consecutive rows per conditional row.
+            conditional_input_index (Tensor/None): Conditional row of each item in *x*, shape (N,).
+            force_embedding_coordinates (bool): Enforces embedding coordinates in the input *x*.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates in the input *x*.
+
+        Returns:
+
+            Tensor
+                Log-probability, shape = (N,)
+            Tensor
+                Log-probability at base distribution, shape = (N,)
+            Tensor
+                Position at base distribution, shape = (N,D)
+        """
+
+        if(conditional_input_index is None):
+            assert(x.shape[0] % self.batch_size == 0), ("Number of items (%d) must be a multiple of the number of conditional rows (%d) if no index is given." % (x.shape[0], self.batch_size))
+            conditional_input_index=self._repeated_index(x.shape[0]//self.batch_size)
+        else:
+            assert(conditional_input_index.shape[0]==x.shape[0])
+
+        tot_log_det=torch.zeros(x.shape[0]).type_as(x)
+
+        base_pos, tot_log_det=self.pdf.all_layer_inverse(x,
+                                                         tot_log_det,
+                                                         self.conditional_input,
+                                                         force_embedding_coordinates=force_embedding_coordinates,
+                                                         force_intrinsic_coordinates=force_intrinsic_coordinates,
+                                                         conditional_input_index=conditional_input_index,
+                                                         cached_flow_params=self.cached_flow_params)
+
+        log_pdf=torch.distributions.Normal(0.0, 1.0).log_prob(base_pos).sum(dim=-1)
+
+        return log_pdf+tot_log_det, log_pdf, base_pos
+
+    def __call__(self, *args, **kwargs):
+
+        return self.forward(*args, **kwargs)
@@ -4,9 +4,12 @@ from torch import nn
 from ..flow_options import check_flow_option, obtain_default_options, obtain_overall_flow_info
 from ..extra_functions import list_from_str, NONLINEARITIES, recheck_sampling, find_init_pars_of_chained_blocks
 from ..amortizable_mlp import AmortizableMLP
-from ..helper_fns import contours, grid_functions
+from ..helper_fns import contours, grid_functions, von_mises_fisher, healpix_scan
 from ..helper_fns.coverage import calculate_approximate_coverage
-from ..helper_fns.plotting.spherical import get_multiresolution_evals
+from ..helper_fns.profiling import layer_profiler
+from ..helper_fns.plotting.spherical import get_multiresolution_evals, get_multiresolution_evals_batched
+from .compiled_inference import compiled_inference
+from .conditioning import conditioned_pdf
 import collections
 import numpy
 import copy
@@ -15,12 +18,6 @@ import scipy
 import math
 import time
 
-try:
-    import healpy
-except:
-    print("Cannot use healpy functionality. Install healpy, if you need to do entropy scanning!")
-
-from scipy.special import iv, i0, i1
 import scipy.linalg
 
 from typing import Union
@@ -33,6 +30,146 @@ def peek(iterable):
         return None
     return first
 
+def _write_chunk_to_output(out, start_index, chunk_results):
+    """
+    Writes chunk results into preallocated outputs. *out* is a dict with torch tensors or numpy arrays (e.g. numpy.memmap) as values.
+    Only keys that are present in *out* are written.
+    """
+    if(out is None):
+        return
+
+    for key, val in chunk_results.items():
+        if(key not in out.keys()):
+            continue
+
+        end_index=start_index+val.shape[0]
+
+        if(type(out[key])==torch.Tensor):
+            out[key][start_index:end_index]=val.detach().to(out[key])
+        else:
+            out[key][start_index:end_index]=val.detach().cpu().numpy()
+
+def _slice_conditional_input(conditional_input, start_index, end_index):
+
+    if(conditional_input is None):
+        return None
+
+    if(type(conditional_input)==list):
+        return [ci[start_index:end_index] for ci in conditional_input]
+
+    return conditional_input[start_index:end_index]
+
+def _gather_conditional_input(conditional_input, conditional_input_index):
+
+    if(conditional_input is None or conditional_input_index is None):
+        return conditional_input
+
+    if(type(conditional_input)==list):
+        return [ci[conditional_input_index] for ci in conditional_input]
+
+    return conditional_input[conditional_input_index]
+
+def _draw_base_samples(samplesize, dim, base_sampling="mc", dtype=torch.float64, device=torch.device("cpu")):
+    """
+    Draws standard normal base samples of shape (samplesize, dim). All random numbers come from the global numpy RNG, so *numpy.random.seed* makes them reproducible.
+
+    Parameters:
+        samplesize (int): Number of samples.
+        dim (int): Base dimension.
+        base_sampling (str): "mc" for pseudo-random samples, "antithetic" for antithetic pairs (z,-z) that are stored next to each other, 
+                             or "sobol" for a scrambled Sobol sequence mapped through the inverse normal CDF. Consecutive blocks of 2^k Sobol points are well stratified.
+        dtype (torch dtype): Dtype of the result.
+        device (torch.device): Device of the result.
+
+    Returns:
+        Tensor
+            Base samples of shape (samplesize, dim).
+    """
+    if(base_sampling=="mc"):
+        std_normal=numpy.random.normal(size=(samplesize, dim))
+
+    elif(base_sampling=="antithetic"):
+        half=numpy.random.normal(size=((samplesize+1)//2, dim))
+        std_normal=numpy.stack([half, -half], axis=1).reshape(-1, dim)[:samplesize]
+
+    elif(base_sampling=="sobol"):
+        engine=torch.quasirandom.SobolEngine(dimension=dim, scramble=True, seed=int(numpy.random.randint(2**31-1)))
+        uniforms=engine.draw(samplesize, dtype=torch.float64).clamp(1e-12, 1.0-1e-12)
+
+        std_normal=(numpy.sqrt(2.0)*torch.erfinv(2.0*uniforms-1.0)).numpy()
+
+    else:
+        raise Exception("Unknown base sampling ", base_sampling, " - use 'mc', 'antithetic' or 'sobol'.")
+
+    return torch.from_numpy(std_normal).type(dtype).to(device)
+
+def _sequential_monte_carlo_estimate(draw_round, base_sampling="mc", target_standard_error=None, max_rounds=10, round_units=[]):
+    """
+    Averages per-sample values over rounds of samples and stops once the standard error of every estimate is below *target_standard_error*, or after *max_rounds*.
+    Standard errors are calculated from independent units: single samples for "mc", antithetic pair means for "antithetic", and round means for 
+    "sobol" (randomized quasi-Monte Carlo) and for all keys in *round_units*. Round units require at least two rounds.
+
+    Parameters:
+        draw_round (function): Returns a dict of per-sample values of shape (B, S) for a new round of samples.
+        base_sampling (str): Base sampling used by *draw_round*.
+        target_standard_error (float/None): Target standard error. If None, stops as soon as every standard error can be calculated.
+        max_rounds (int): Maximum number of rounds.
+        round_units (list): Keys whose samples within a round are correlated.
+
+    Returns:
+        dict
+            Estimates of shape (B,) for every key.
+        dict
+            Standard errors of shape (B,) for every key.
+    """
+    assert(base_sampling in ["mc", "antithetic", "sobol"])
+
+    unit_sums=dict()
+    unit_square_sums=dict()
+    unit_counts=dict()
+
+    estimates=dict()
+    standard_errors=dict()
+
+    for round_index in range(max_rounds):
+
+        values=draw_round()
+
+        for k in values.keys():
+
+            if(base_sampling=="sobol" or k in round_units):
+                units=values[k].mean(dim=1, keepdim=True)
+            elif(base_sampling=="antithetic"):
+                assert(values[k].shape[1]%2==0), "Antithetic sampling requires an even samplesize."
+                units=values[k].reshape(values[k].shape[0], -1, 2).mean(dim=2)
+            else:
+                units=values[k]
+
+            if(k not in unit_sums.keys()):
+                unit_sums[k]=0.0
+                unit_square_sums[k]=0.0
+                unit_counts[k]=0
+
+            unit_sums[k]=unit_sums[k]+units.sum(dim=1)
+            unit_square_sums[k]=unit_square_sums[k]+(units**2).sum(dim=1)
+            unit_counts[k]+=units.shape[1]
+
+            estimates[k]=unit_sums[k]/unit_counts[k]
+
+            if(unit_counts[k]>1):
+                variances=(unit_square_sums[k]-unit_counts[k]*estimates[k]**2)/(unit_counts[k]-1)
+                standard_errors[k]=(variances.clamp(min=0.0)/unit_counts[k]).sqrt()
+            else:
+                standard_errors[k]=torch.ones_like(estimates[k])*float("inf")
+
+        if(target_standard_error is None):
+            if(all([unit_counts[k]>1 for k in unit_counts.keys()])):
+                break
+        elif(all([(standard_errors[k]<=target_standard_error).all() for k in standard_errors.keys()])):
+            break
+
+    return estimates, standard_errors
+
 class pdf(nn.Module):
 
     def __init__(
@@ -866,7 +1003,9 @@ class pdf(nn.Module):
                           data_summary, 
                           amortization_parameters=None, 
                           force_embedding_coordinates=False, 
-                          force_intrinsic_coordinates=False):
+                          force_intrinsic_coordinates=False,
+                          conditional_input_index=None,
+                          cached_flow_params=None):
         """
         Performs the autoregressive (IAF) backward normalizing-flow mapping of all sub-manifold flows.
 
@@ -877,6 +1016,8 @@ class pdf(nn.Module):
             amortization_parameters (Tensor/None): Used to amortize the whole PDF. Otherwise None.
             force_embedding_coordinates (bool): Enforces embedding coordinates in the input x for this inverse mapping.
             force_intrinsic_coordinates (bool): Enforces intrinsic coordinates in the input x for this inverse mapping.
+            conditional_input_index (Tensor/None): If given, *data_summary* holds one row per conditioning and row b of *x* uses the conditional row *conditional_input_index[b]*.
+            cached_flow_params (dict/None): Predictor outputs per conditional row, keyed by sub-pdf index (see *obtain_cached_flow_params*).
 
         Returns: 
             Tensor
@@ -919,13 +1060,23 @@ class pdf(nn.Module):
             if(self.mlp_predictors[pdf_index] is not None):
 
                 ## mlp preditors can be None for unresponsive layers like x/y
-                if(data_summary is not None):
+                if(cached_flow_params is not None and pdf_index in cached_flow_params):
+                    ## predictor output was calculated once per conditional row .. only gather it
+                    extra_params=cached_flow_params[pdf_index]
+
+                    if(conditional_input_index is not None):
+                        extra_params=extra_params[conditional_input_index]
+
+                elif(data_summary is not None):
 
                     if(type(data_summary)==list):
                         this_data_summary=data_summary[pdf_index]
                     else:
                         this_data_summary=data_summary
 
+                    if(conditional_input_index is not None):
+                        this_data_summary=this_data_summary[conditional_input_index]
+
                     if(len(extra_conditional_input)>0):
                         this_data_summary=torch.cat([this_data_summary]+extra_conditional_input, dim=1)
                     
@@ -1280,7 +1431,8 @@ class pdf(nn.Module):
                force_intrinsic_coordinates=False,
                failsafe_crosscheck_tolerance=None,
                dtype=None,
-               device=None):
+               device=None,
+               base_sampling="mc"):
         """ 
         Samples from the (conditional) PDF. 
 
@@ -1294,6 +1446,7 @@ class pdf(nn.Module):
             force_intrinsic_coordinates (bool): Enforces intrinsic coordinates for the sample.
             dtype (torch dtype): Dtype and device are normally inferred by parameters or conditional input. If no parameters are part of the 
             device (torch.device): If given, uses this device. Otherwise uses device from parameters.
+            base_sampling (str): "mc" (default) for pseudo-random base samples, "antithetic" for antithetic pairs (z,-z) and "sobol" for scrambled Sobol points (see *_draw_base_samples*).
 
         Returns:
 
@@ -1321,7 +1474,8 @@ class pdf(nn.Module):
                                                                                          force_intrinsic_coordinates=force_intrinsic_coordinates,
                                                                                          failsafe_crosscheck_tolerance=failsafe_crosscheck_tolerance,
                                                                                          device=device,
-                                                                                         dtype=dtype)
+                                                                                         dtype=dtype,
+                                                                                         base_sampling=base_sampling)
 
 
             return sample, normal_base_sample, log_pdf_target, log_pdf_base
@@ -1336,17 +1490,299 @@ class pdf(nn.Module):
                                                                                              force_intrinsic_coordinates=force_intrinsic_coordinates,
                                                                                              failsafe_crosscheck_tolerance=failsafe_crosscheck_tolerance,
                                                                                              device=device,
-                                                                                             dtype=dtype)
+                                                                                             dtype=dtype,
+                                                                                             base_sampling=base_sampling)
            
             return sample, normal_base_sample, log_pdf_target, log_pdf_base
 
-    def all_layer_forward(self, 
+    def sample_iter(self,
+                    samplesize=1,
+                    chunk_size=10000,
+                    conditional_input=None,
+                    seed=None,
+                    amortization_parameters=None,
+                    force_embedding_coordinates=False,
+                    force_intrinsic_coordinates=False,
+                    dtype=None,
+                    device=None,
+                    out=None):
+        """
+        Streaming version of *sample*. Draws samples chunk by chunk, which bounds peak memory by *chunk_size* instead of *samplesize*. 
+        With a given seed, the samples are identical to a single call of *sample* with the same seed.
+
+        Parameters:
+            samplesize (int): Total samplesize. If *conditional_input* or *amortization_parameters* are given, their batch size defines the samplesize.
+            chunk_size (int): Maximum number of samples per chunk.
+            conditional_input (Tensor/list(Tensor)/None): See *sample*.
+            seed (None/int): Seed that is set once before the first chunk.
+            amortization_parameters (Tensor/None): See *sample*.
+            force_embedding_coordinates (bool): Enforces embedding coordinates for the sample.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates for the sample.
+            dtype (torch dtype): See *sample*.
+            device (torch.device): See *sample*.
+            out (dict/None): Preallocated outputs, e.g. torch tensors or numpy memmaps of size *samplesize* in the first dimension. 
+                             Possible keys are "sample", "base_sample", "log_pdf" and "log_pdf_base". Results are written in place for every chunk.
+
+        Yields:
+
+            tuple
+                (start index, sample, base sample, log-pdf in target space, log-pdf in base space) of the current chunk.
+        """
+
+        assert(chunk_size>0)
+
+        total_size=samplesize
+        if(amortization_parameters is not None):
+            total_size=amortization_parameters.shape[0]
+        elif(conditional_input is not None):
+            if(type(conditional_input)==list):
+                total_size=conditional_input[0].shape[0]
+            else:
+                total_size=conditional_input.shape[0]
+
+        if(seed is not None):
+            numpy.random.seed(seed)
+
+        for start_index in range(0, total_size, chunk_size):
+
+            end_index=min(start_index+chunk_size, total_size)
+
+            sample, normal_base_sample, log_pdf_target, log_pdf_base=self.sample(conditional_input=_slice_conditional_input(conditional_input, start_index, end_index),
+                                                                                 samplesize=end_index-start_index,
+                                                                                 amortization_parameters=None if amortization_parameters is None else amortization_parameters[start_index:end_index],
+                                                                                 force_embedding_coordinates=force_embedding_coordinates,
+                                                                                 force_intrinsic_coordinates=force_intrinsic_coordinates,
+                                                                                 dtype=dtype,
+                                                                                 device=device)
+
+            _write_chunk_to_output(out, start_index, dict(sample=sample, base_sample=normal_base_sample, log_pdf=log_pdf_target, log_pdf_base=log_pdf_base))
+
+            yield start_index, sample, normal_base_sample, log_pdf_target, log_pdf_base
+
+    def log_prob_iter(self,
+                      data,
+                      chunk_size=10000,
+                      conditional_input=None,
+                      amortization_parameters=None,
+                      force_embedding_coordinates=False,
+                      force_intrinsic_coordinates=False,
+                      out=None):
+        """
+        Streaming version of *forward* without gradients. Evaluates the log-probability chunk by chunk to bound peak memory.
+
+        Parameters:
+            data (Tensor/iterable): Either a tensor of shape (B,D) that is split into chunks of *chunk_size*, or an iterable (e.g. a DataLoader) 
+                                    that yields target tensors or (target, conditional input) tuples.
+            chunk_size (int): Maximum number of items per chunk if *data* is a tensor.
+            conditional_input (Tensor/list(Tensor)/None): Conditional input with the same batch size as *data*. Only used if *data* is a tensor.
+            amortization_parameters (Tensor/None): Only used if *data* is a tensor.
+            force_embedding_coordinates (bool): Enforces embedding coordinates in the input.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates in the input.
+            out (dict/None): Preallocated outputs, e.g. torch tensors or numpy memmaps. Possible keys are "log_pdf", "log_pdf_base" and "base_pos".
+
+        Yields:
+
+            tuple
+                (start index, log-pdf, log-pdf at base distribution, position at base distribution) of the current chunk.
+        """
+
+        if(type(data)==torch.Tensor):
+
+            assert(chunk_size>0)
+
+            def chunk_generator():
+                for start_index in range(0, data.shape[0], chunk_size):
+                    end_index=min(start_index+chunk_size, data.shape[0])
+                    yield data[start_index:end_index], _slice_conditional_input(conditional_input, start_index, end_index), None if amortization_parameters is None else amortization_parameters[start_index:end_index]
+
+            chunks=chunk_generator()
+        else:
+            assert(conditional_input is None and amortization_parameters is None), "Conditional input must be part of the iterable if *data* is not a tensor."
+
+            def chunk_generator():
+                for item in data:
+                    if(type(item)==tuple or type(item)==list):
+                        yield item[0], item[1], None
+                    else:
+                        yield item, None, None
+
+            chunks=chunk_generator()
+
+        start_index=0
+
+        with torch.no_grad():
+            for x, cinput, amort_pars in chunks:
+
+                log_pdf, log_pdf_base, base_pos=self.forward(x, 
+                                                             conditional_input=cinput, 
+                                                             amortization_parameters=amort_pars, 
+                                                             force_embedding_coordinates=force_embedding_coordinates, 
+                                                             force_intrinsic_coordinates=force_intrinsic_coordinates)
+
+                _write_chunk_to_output(out, start_index, dict(log_pdf=log_pdf, log_pdf_base=log_pdf_base, base_pos=base_pos))
+
+                yield start_index, log_pdf, log_pdf_base, base_pos
+
+                start_index+=x.shape[0]
+
+    def compile_for_inference(self,
+                              force_embedding_coordinates=False,
+                              force_intrinsic_coordinates=False,
+                              backend="inductor",
+                              mode=None,
+                              dynamic=True,
+                              verbose=False):
+        """
+        Freezes the autoregressive branch structure for a fixed configuration and compiles *log_prob* and *sample* via *torch.compile*.
+        Reduces the per-call overhead at small batch sizes (e.g. single-event reconstruction). Layers that can not be compiled (e.g. the torchdiffeq-based *cnf_sphere_charts*)
+        make the returned object fall back to the frozen, uncompiled mapping. Not available for fully amortized PDFs. The returned object
+        holds a reference to this PDF, so later parameter updates are picked up (possibly triggering a recompilation).
+
+        Parameters:
+            force_embedding_coordinates (bool): Enforces embedding coordinates in the inputs of *log_prob* and the outputs of *sample*.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates in the inputs of *log_prob* and the outputs of *sample*.
+            backend (str): *torch.compile* backend.
+            mode (str/None): *torch.compile* mode.
+            dynamic (bool): Compile with dynamic shapes to avoid recompilation for new batch sizes.
+            verbose (bool): Print the reason if a fallback is used.
+
+        Returns:
+            compiled_inference
+                Object with *log_prob(x, conditional_input=None)* and *sample(samplesize=1, conditional_input=None, seed=None, dtype=None, device=None)* methods, which return the same outputs as *forward* and *sample*.
+        """
+
+        return compiled_inference(self,
+                                  force_embedding_coordinates=force_embedding_coordinates,
+                                  force_intrinsic_coordinates=force_intrinsic_coordinates,
+                                  backend=backend,
+                                  mode=mode,
+                                  dynamic=dynamic,
+                                  verbose=verbose)
+
+    def profile(self, synchronize_cuda=True):
+        """
+        Opt-in per-layer profiling. Used as a context manager, it records wall time, bisection/Newton iteration counts, ODE function evaluations and peak allocated CUDA memory
+        of each layer mapping, each MLP predictor call and each *transform_target_space* call while active.
+
+        Example:
+            with pdf.profile() as profiler:
+                pdf.sample(samplesize=1000)
+            print(profiler.summary())
+            report=profiler.report()
+
+        Parameters:
+            synchronize_cuda (bool): Synchronize CUDA around each timed call.
+
+        Returns:
+            layer_profiler
+                Profiler object with *report()* (nested dict keyed by sub-pdf and layer letter) and *summary()* (printable table).
+        """
+
+        return layer_profiler(self, synchronize_cuda=synchronize_cuda)
+
+    def obtain_cached_flow_params(self, conditional_input):
+        """
+        Evaluates the MLP predictors whose input consists of the conditional input only (i.e. the one of the first sub-pdf) once per conditional row.
+        The result can be passed as *cached_flow_params* to the layer mappings together with a *conditional_input_index*, which then only gather the flow parameters
+        instead of re-evaluating the MLP for every repeated row.
+
+        Parameters:
+            conditional_input (Tensor/list(Tensor)/None): Conditional input with one row per conditioning.
+
+        Returns:
+            dict/None
+                Predictor outputs keyed by sub-pdf index, or None if there is nothing to cache.
+        """
+
+        if(conditional_input is None or self.amortize_everything or self.mlp_predictors[0] is None):
+            return None
+
+        if(type(conditional_input)==list):
+            return {0: self.mlp_predictors[0](conditional_input[0])}
+
+        return {0: self.mlp_predictors[0](conditional_input)}
+
+    def condition(self, conditional_input):
+        """
+        Returns a handle with fixed conditional input. The flow parameters that only depend on the conditional input are predicted once per conditional row
+        and gathered for all samples/evaluations of that row, instead of repeating the conditional input and re-evaluating the MLP for each copy.
+        The handle is frozen: if parameters of the PDF change (e.g. during training), a new handle has to be created.
+
+        Example:
+            conditioned=pdf.condition(conditional_input)
+            samples, base_samples, log_pdfs, log_pdfs_base=conditioned.sample(samplesize=10000)
+            log_pdfs, _, _=conditioned.forward(samples)
+
+        Parameters:
+            conditional_input (Tensor/list(Tensor)): Conditional input of shape (B,A), or list of such tensors.
+
+        Returns:
+            conditioned_pdf
+                Handle with *sample* and *forward* methods that work with *samplesize* items per conditional row.
+        """
+
+        return conditioned_pdf(self, conditional_input)
+
+    def sample_ragged(self,
+                      conditional_input,
+                      samples_per_row,
+                      seed=None,
+                      allow_gradients=False,
+                      force_embedding_coordinates=False,
+                      force_intrinsic_coordinates=False,
+                      failsafe_crosscheck_tolerance=None):
+        """
+        Draws a different number of samples for each conditional input row without repeating the conditional input.
+        Each sample only carries the index of its conditional row, which is used to gather the conditional input inside the layer mappings.
+        The samples of row b are stored at [offsets[b], offsets[b+1]) (CSR layout).
+
+        Parameters:
+            conditional_input (Tensor/list(Tensor)): Conditional input of shape (B,A), or list of such tensors.
+            samples_per_row (Tensor/list(int)/numpy array): Number of samples for each of the B rows. Zero is allowed.
+            seed (None/int): Numpy seed for the base samples.
+            allow_gradients (bool): If False, does not build the graph.
+            force_embedding_coordinates (bool): Enforces embedding coordinates for the sample.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates for the sample.
+            failsafe_crosscheck_tolerance (float/None): See *sample*.
+
+        Returns:
+
+            Tensor
+                Sample in target space, shape (N,D) with N=sum(samples_per_row).
+            Tensor
+                Sample in base space.
+            Tensor
+                Log-pdf evaluation in target space
+            Tensor
+                Log-pdf evaluation in base space
+            Tensor
+                Segment index, i.e. conditional row of each sample, shape (N,).
+            Tensor
+                Offsets of shape (B+1,).
+        """
+
+        conditioned=self.condition(conditional_input)
+
+        segment_index=conditioned._repeated_index(samples_per_row)
+
+        sample, normal_base_sample, log_pdf_target, log_pdf_base=conditioned.sample(samplesize=samples_per_row,
+                                                                                    seed=seed,
+                                                                                    allow_gradients=allow_gradients,
+                                                                                    force_embedding_coordinates=force_embedding_coordinates,
+                                                                                    force_intrinsic_coordinates=force_intrinsic_coordinates,
+                                                                                    failsafe_crosscheck_tolerance=failsafe_crosscheck_tolerance)
+
+        return sample, normal_base_sample, log_pdf_target, log_pdf_base, segment_index, conditioned.segment_offsets(samples_per_row)
+
+    def all_layer_forward(self,
                           x,   
                           log_det,   
                           data_summary, 
                           amortization_parameters=None,
                           force_embedding_coordinates=False, 
-                          force_intrinsic_coordinates=False):
+                          force_intrinsic_coordinates=False,
+                          conditional_input_index=None,
+                          cached_flow_params=None):
 
         """
         Performs the autoregressive (IAF) forward normalizing-flow mapping of all sub-manifold flows.
@@ -1358,6 +1794,8 @@ class pdf(nn.Module):
             amortization_parameters (Tensor/None): Used to amortize the whole PDF. Otherwise None.
             force_embedding_coordinates (bool): Enforces embedding coordinates in the output sample.
             force_intrinsic_coordinates (bool): Enforces intrinsic coordinates in the output sample.
+            conditional_input_index (Tensor/None): If given, *data_summary* holds one row per conditioning and row b of *x* uses the conditional row *conditional_input_index[b]*. Avoids repeating the conditional input.
+            cached_flow_params (dict/None): Predictor outputs per conditional row, keyed by sub-pdf index (see *obtain_cached_flow_params*). Replaces the respective MLP predictor calls.
 
         Returns: 
             Tensor
@@ -1388,12 +1826,21 @@ class pdf(nn.Module):
 
             if(self.mlp_predictors[pdf_index] is not None):
 
-                if(data_summary is not None):
+                if(cached_flow_params is not None and pdf_index in cached_flow_params):
+                    ## predictor output was calculated once per conditional row .. only gather it
+                    extra_params=cached_flow_params[pdf_index]
+
+                    if(conditional_input_index is not None):
+                        extra_params=extra_params[conditional_input_index]
+
+                elif(data_summary is not None):
                     # conditional PDF (data_summary!=None) and MLP predictor given
                     if(type(data_summary)==list):
                         this_data_summary=data_summary[pdf_index]
                     else:   
                         this_data_summary=data_summary
+                    if(conditional_input_index is not None):
+                        this_data_summary=this_data_summary[conditional_input_index]
                     if(len(extra_conditional_input)>0):
                         this_data_summary=torch.cat([this_data_summary]+extra_conditional_input, dim=1)
 
@@ -1498,7 +1945,10 @@ class pdf(nn.Module):
                        force_intrinsic_coordinates=False,
                        failsafe_crosscheck_tolerance=None,
                        dtype=None,
-                       device=None):
+                       device=None,
+                       conditional_input_index=None,
+                       cached_flow_params=None,
+                       base_sampling="mc"):
         """
         Obtains a sample from the Multivariate Standard Normal, evaluates it and passes it through forward machinery. 
         When *predefined_target_input* is given, takes this as a sample.
@@ -1514,6 +1964,9 @@ class pdf(nn.Module):
             force_intrinsic_coordinates (bool): Enforces intrinsic coordinates in the output sample.
             dtype (torch dtype): If given, uses this dtype. Otherwise uses dtype from parameters.
             device (torch.device): If given, uses this device. Otherwise uses device from parameters.
+            conditional_input_index (Tensor/None): Conditional row of each sample (see *all_layer_forward*). If given, its length defines the samplesize.
+            cached_flow_params (dict/None): Predictor outputs per conditional row (see *obtain_cached_flow_params*).
+            base_sampling (str): How the base samples are drawn, see *_draw_base_samples*.
 
         Returns:
 
@@ -1573,6 +2026,9 @@ class pdf(nn.Module):
                     data_type = conditional_input.dtype
                     used_device = conditional_input.device
 
+                if(conditional_input_index is not None):
+                    used_sample_size = conditional_input_index.shape[0]
+
         else:
             ## if one blindly uses next() on an empty param generator, it throws an error
             data_type, used_device=self.obtain_current_dtype_n_device()
@@ -1599,11 +2055,11 @@ class pdf(nn.Module):
                 ## make sure inputs agree
 
                 if(type(conditional_input)==list):
-                    assert(x.shape[0]==conditional_input[0].shape[0])
+                    assert(x.shape[0]==used_sample_size)
                     assert(x.dtype==conditional_input[0].dtype)
                     assert(x.device==conditional_input[0].device)
                 else:
-                    assert(x.shape[0]==conditional_input.shape[0])
+                    assert(x.shape[0]==used_sample_size)
                     assert(x.dtype==conditional_input.dtype)
                     assert(x.device==conditional_input.device)
 
@@ -1618,11 +2074,7 @@ class pdf(nn.Module):
             if(seed is not None):
                 numpy.random.seed(seed)
 
-            std_normal = numpy.random.normal(size=(used_sample_size, self.total_base_dim))
-
-            std_normal_samples = (
-                torch.from_numpy(std_normal).type(data_type).to(used_device)
-            )
+            std_normal_samples = _draw_base_samples(used_sample_size, self.total_base_dim, base_sampling=base_sampling, dtype=data_type, device=used_device)
 
             log_gauss_evals=torch.distributions.Normal(0.0,1.0).log_prob(std_normal_samples).sum(dim=-1)
             
@@ -1630,7 +2082,7 @@ class pdf(nn.Module):
 
         log_det = torch.zeros(used_sample_size).type(data_type).to(used_device)
         
-        new_targets, log_det=self.all_layer_forward(x, log_det, conditional_input, amortization_parameters=amortization_parameters, force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
+        new_targets, log_det=self.all_layer_forward(x, log_det, conditional_input, amortization_parameters=amortization_parameters, force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates, conditional_input_index=conditional_input_index, cached_flow_params=cached_flow_params)
 
         ## failsafe crosscheck?
 
@@ -1646,7 +2098,7 @@ class pdf(nn.Module):
                       return_log_pdf,
                       log_gauss_evals,
                       failsafe_crosscheck_tolerance=failsafe_crosscheck_tolerance,
-                      conditional_input=conditional_input,
+                      conditional_input=_gather_conditional_input(conditional_input, conditional_input_index),
                       amortization_parameters=amortization_parameters,
                       force_embedding_coordinates=force_embedding_coordinates,
                       force_intrinsic_coordinates=force_intrinsic_coordinates,
@@ -1978,6 +2430,170 @@ class pdf(nn.Module):
 
         return return_dict
 
+    def _project_onto_embedding_tangent_space(self, positions, vectors):
+        """
+        Projects *vectors* at the embedding *positions* onto the tangent space of each sub-manifold. Spheres remove the radial component, 
+        simplices remove the component that changes the coordinate sum.
+        """
+        projected=[]
+
+        for pdf_index, pdf_def in enumerate(self.pdf_defs_list):
+
+            start, end=self.target_dim_indices_embedded[pdf_index]
+            this_vectors=vectors[:,start:end]
+
+            if(pdf_def[0]=="s"):
+                this_positions=positions[:,start:end]
+                this_vectors=this_vectors-(this_vectors*this_positions).sum(dim=1, keepdim=True)*this_positions
+            elif(pdf_def[0]=="a"):
+                this_vectors=this_vectors-this_vectors.mean(dim=1, keepdim=True)
+
+            projected.append(this_vectors)
+
+        return torch.cat(projected, dim=1)
+
+    def _project_onto_embedding_manifold(self, positions, boundary_offset=1e-6):
+        """
+        Maps embedding *positions* back onto each sub-manifold. Sphere coordinates are normalized, interval coordinates are clamped to the interval 
+        and simplex coordinates are clamped to be positive and normalized to unit sum.
+        """
+        projected=[]
+
+        for pdf_index, pdf_def in enumerate(self.pdf_defs_list):
+
+            start, end=self.target_dim_indices_embedded[pdf_index]
+            this_positions=positions[:,start:end]
+
+            if(pdf_def[0]=="s"):
+                this_positions=this_positions/this_positions.norm(dim=1, keepdim=True)
+            elif(pdf_def[0]=="i"):
+                this_positions=this_positions.clamp(min=self.layer_list[pdf_index][-1].low_boundary+boundary_offset, max=self.layer_list[pdf_index][-1].high_boundary-boundary_offset)
+            elif(pdf_def[0]=="a"):
+                this_positions=this_positions.clamp(min=boundary_offset)
+                this_positions=this_positions/this_positions.sum(dim=1, keepdim=True)
+
+            projected.append(this_positions)
+
+        return torch.cat(projected, dim=1)
+
+    def find_mode(self,
+                  conditional_input=None,
+                  samplesize=1000,
+                  num_starts=4,
+                  num_steps=200,
+                  initial_step_size=None,
+                  min_step_size=1e-8,
+                  seed=None,
+                  force_embedding_coordinates=False,
+                  force_intrinsic_coordinates=False):
+        """
+        Finds the mode (MAP) of the PDF for every conditional input row with batched gradient ascent on the log-pdf. The ascent starts from the *num_starts* 
+        best of *samplesize* samples of each row and works in embedding coordinates. On spheres, steps are taken in the tangent space and projected back onto the sphere.
+        Interval coordinates are clamped to the interval and simplex coordinates are projected back onto the simplex.
+        Every item has its own step size along the normalized gradient. Steps are only accepted if they increase the log-pdf, in which case the step size grows, and otherwise the step size is halved.
+        All rows and starting points are optimized in a single batch.
+
+        Parameters:
+            conditional_input (Tensor/list(Tensor)/None): Conditional input of shape (B,A). If None, the mode of the unconditional PDF is returned (B=1).
+            samplesize (int): Number of samples per row to select starting points.
+            num_starts (int): Number of starting points per row.
+            num_steps (int): Maximum number of gradient steps.
+            initial_step_size (float/None): Initial step size. Defaults to a tenth of the sample spread of each row.
+            min_step_size (float): The ascent stops once the step sizes of all items are below this value.
+            seed (None/int): Seed for the starting samples.
+            force_embedding_coordinates (bool): Return the mode in embedding coordinates.
+            force_intrinsic_coordinates (bool): Return the mode in intrinsic coordinates.
+
+        Returns:
+
+            Tensor
+                Mode of each conditional row, shape (B,D).
+            Tensor
+                Log-pdf at the mode, shape (B,).
+        """
+
+        assert(self.use_as_passthrough_instead_of_pdf == False), "The module is only used as a passthrough of all layers, not as actually evaluating the pdf!"
+        assert(num_starts>0 and num_starts<=samplesize)
+
+        with torch.no_grad():
+
+            if(conditional_input is None):
+                batch_size=1
+                conditioned=None
+
+                samples,_,log_pdfs,_=self.sample(samplesize=samplesize, seed=seed, force_embedding_coordinates=True)
+            else:
+                conditioned=self.condition(conditional_input)
+                batch_size=conditioned.batch_size
+
+                samples,_,log_pdfs,_=conditioned.sample(samplesize=samplesize, seed=seed, force_embedding_coordinates=True)
+
+        event_index=torch.arange(batch_size, device=samples.device).repeat_interleave(num_starts)
+
+        def evaluate(positions):
+            if(conditioned is None):
+                return self.forward(positions, force_embedding_coordinates=True)[0]
+
+            return conditioned.forward(positions, conditional_input_index=event_index, force_embedding_coordinates=True)[0]
+
+        samples=samples.reshape(batch_size, samplesize, -1)
+
+        log_pdfs=log_pdfs.reshape(batch_size, samplesize)
+        log_pdfs=torch.where(torch.isfinite(log_pdfs), log_pdfs, torch.full_like(log_pdfs, -float("inf")))
+
+        ## best samples of each row as starting points
+        best_indices=log_pdfs.topk(num_starts, dim=1).indices
+
+        positions=torch.gather(samples, 1, best_indices[:,:,None].expand(-1,-1,samples.shape[2])).reshape(batch_size*num_starts, -1)
+
+        with torch.no_grad():
+            cur_log_pdfs=evaluate(positions)
+
+        cur_log_pdfs=torch.where(torch.isfinite(cur_log_pdfs), cur_log_pdfs, torch.full_like(cur_log_pdfs, -float("inf")))
+
+        if(initial_step_size is None):
+            step_sizes=0.1*samples.std(dim=1).mean(dim=1).repeat_interleave(num_starts)
+        else:
+            step_sizes=torch.ones_like(cur_log_pdfs)*initial_step_size
+
+        for _ in range(num_steps):
+
+            with torch.enable_grad():
+                grad_positions=positions.detach().requires_grad_(True)
+                grads=torch.autograd.grad(evaluate(grad_positions).sum(), grad_positions)[0]
+
+            grads=torch.where(torch.isfinite(grads), grads, torch.zeros_like(grads))
+            grads=self._project_onto_embedding_tangent_space(positions, grads)
+
+            directions=grads/grads.norm(dim=1, keepdim=True).clamp(min=1e-30)
+
+            with torch.no_grad():
+                proposed_positions=self._project_onto_embedding_manifold(positions+step_sizes[:,None]*directions)
+                proposed_log_pdfs=evaluate(proposed_positions)
+
+            accepted=torch.isfinite(proposed_log_pdfs) & (proposed_log_pdfs>cur_log_pdfs)
+
+            positions=torch.where(accepted[:,None], proposed_positions, positions)
+            cur_log_pdfs=torch.where(accepted, proposed_log_pdfs, cur_log_pdfs)
+            step_sizes=torch.where(accepted, step_sizes*1.2, step_sizes*0.5)
+
+            if((step_sizes<min_step_size).all()):
+                break
+
+        ## best starting point of each row
+        best_starts=cur_log_pdfs.reshape(batch_size, num_starts).argmax(dim=1)
+        best_items=torch.arange(batch_size, device=positions.device)*num_starts+best_starts
+
+        modes=positions[best_items]
+        mode_log_pdfs=cur_log_pdfs[best_items]
+
+        if(force_intrinsic_coordinates):
+            modes,_=self.transform_target_space(modes, transform_from="embedding", transform_to="intrinsic")
+        elif(force_embedding_coordinates==False):
+            modes,_=self.transform_target_space(modes, transform_from="embedding", transform_to="default")
+
+        return modes.detach(), mode_log_pdfs.detach()
+
     def coverage_and_or_pdf_scan(self,
                                  labels=None,
                                  conditional_input=None,
@@ -1986,7 +2602,12 @@ class pdf(nn.Module):
                                  sub_manifolds=[-1],
                                  exact_coverage_calculation=False,
                                  save_pdf_scan=False,
-                                 calculate_MAP=False):
+                                 calculate_MAP=False,
+                                 batched_scan=False,
+                                 scan_chunk_size=16,
+                                 exact_coverage_method="contours",
+                                 adaptive_scan=False,
+                                 refine_MAP=False):
 
         """
         Calculates coverage (approximate) and possibly exact. Performs pdf scan for exact coverage and save scan if desired.
@@ -2005,6 +2626,13 @@ class pdf(nn.Module):
             exact_coverage_calculation (bool): Calculate exact coverage based on pdf scan?
             save_pdf_scan (bool): Save a pdf scan?
             calculate_MAP (bool): Calculate Maximum APosterior (MAP) coordinates based on pdf scan?
+            batched_scan (bool): Sample and evaluate the pdf scan for many events in a single tensor pass instead of event by event.
+            scan_chunk_size (int): Number of events that are processed together in a batched scan. Limits memory usage.
+            exact_coverage_method (str): One of ["contours", "density_rank"]. "contours" builds contours on the pdf scan and finds the closest one to the truth (pure Euclidean or pure s2 PDFs only).
+                                         "density_rank" estimates the probability mass with a higher density than at the truth directly from samples, without contours. Works for any manifold combination.
+            adaptive_scan (bool): Use a sample-driven k-d tree mesh instead of a regular grid for the pdf scan of Euclidean and interval PDFs. The scan positions of each event 
+                                  then have shape (1,N,D), the log-evals shape (1,N) and the volume sizes shape (N,).
+            refine_MAP (bool): Calculate the MAP with gradient ascent via *find_mode* instead of taking the best sample or scan position. Works for any manifold combination and does not require a pdf scan.
         Returns:
 
             return_dict (dict): Dictionary of requested coverage and/or pdf scan values.
@@ -2020,6 +2648,10 @@ class pdf(nn.Module):
         embedded_labels=None
         if(exact_coverage_calculation):
             assert(labels is not None)
+            assert(exact_coverage_method in ["contours", "density_rank"]), ("Unknown exact coverage method ", exact_coverage_method)
+
+        density_rank_coverage=exact_coverage_calculation and exact_coverage_method=="density_rank"
+        contour_coverage=exact_coverage_calculation and exact_coverage_method=="contours"
 
         batch_size=1
         if(conditional_input is not None):
@@ -2056,7 +2688,15 @@ class pdf(nn.Module):
                 return_dict["log_pdf_labels"]=log_pdf_target
                 return_dict["log_pdf_base_labels"]=log_pdf_base
 
-            if(exact_coverage_calculation or save_pdf_scan or calculate_MAP):
+            if(density_rank_coverage):
+                return_dict["real_cov_values"]=self._density_rank_coverage(return_dict["log_pdf_labels"], 
+                                                                           conditional_input, 
+                                                                           samples_per_event=10000, 
+                                                                           chunk_size=scan_chunk_size)
+
+            scan_MAP=calculate_MAP and refine_MAP==False
+
+            if(contour_coverage or save_pdf_scan or scan_MAP):
 
                 max_positions=[]
                 real_cov_values=[]
@@ -2066,48 +2706,31 @@ class pdf(nn.Module):
 
                 samples_per_event=10000
 
-                data_summary_repeated=None
                 print("self pdf defs list", self.pdf_defs_list)
-                if(self.pdf_defs_list[0][0]=="e"):
-                    ## make sure only Euclidean sub dimensions
+                if(self.pdf_defs_list[0][0]=="e" or (adaptive_scan and self.pdf_defs_list[0][0]=="i")):
+                    ## make sure only Euclidean sub dimensions (or Euclidean and interval sub dimensions for the adaptive scan)
 
                     strs="".join([e[0] for e in self.pdf_defs_list])
-                    assert(len(list(set(strs)))==1), ("Only pure Euclidean sub spaces supported at the moment!", self.pdf_defs_list)
-
-                    # loop through all batch items and perform scan for each
-                    for cur_batch_ind in range(batch_size):
-
-                        if(conditional_input is not None):
-                            if(type(conditional_input)==list):  
-                                data_summary_repeated=[ci[cur_batch_ind:cur_batch_ind+1].repeat_interleave(samples_per_event, dim=0) for ci in conditional_input]
-                            else:
-                                data_summary_repeated=conditional_input[cur_batch_ind:cur_batch_ind+1].repeat_interleave(samples_per_event, dim=0)
-                            ####
+                    if(adaptive_scan):
+                        assert(set(strs).issubset(set(["e", "i"]))), ("Only Euclidean and interval sub spaces supported for the adaptive scan!", self.pdf_defs_list)
+                    else:
+                        assert(len(list(set(strs)))==1), ("Only pure Euclidean sub spaces supported at the moment!", self.pdf_defs_list)
 
-                        samples,_,log_pdf_at_samples,_=self.sample(conditional_input=data_summary_repeated, samplesize=samples_per_event)
-                        log_pdf_at_samples=log_pdf_at_samples.cpu().numpy()
+                    # loop through all batch items and perform scan for each (batched over chunks of events if desired)
+                    for cur_batch_ind, max_position, evalpositions, log_evals, bin_volumes in self._euclidean_pdf_scan_events(conditional_input, 
+                                                                                                                             batch_size, 
+                                                                                                                             samples_per_event, 
+                                                                                                                             batched_scan=batched_scan, 
+                                                                                                                             scan_chunk_size=scan_chunk_size,
+                                                                                                                             adaptive_scan=adaptive_scan):
 
-                        ## calculate maximum value for completeness from samples
-                        mi=numpy.argmax(log_pdf_at_samples)
-                        max_position=samples[mi:mi+1].cpu().numpy()
                         max_positions.append(max_position)
-                        
-                        ### loop through different events with batch size 1 each (TODO: make this batchable)
-
-                        _, density_bounds,_=grid_functions.obtain_bins_and_visualization_regions(samples, self, percentiles=[0.5,99.5])
-
-                        npts_per_dim=int((samples_per_event)**(1.0/float(self.total_target_dim)))
 
-
-                        evalpositions, log_evals, bin_volumes, _, _= grid_functions.get_pdf_on_grid(density_bounds,
-                                                                                                            npts_per_dim,
-                                                                                                            self,
-                                                                                                            conditional_input=None if conditional_input is None else data_summary_repeated[:1],
-                                                                                                            s2_norm="standard",
-                                                                                                            s2_rotate_to_true_value=False,
-                                                                                                            true_values=None)
-                        #  expected shape here (1,num_points,dim)
-                        assert(len(evalpositions.shape)==3)
+                        #  expected shape here (1,num_points_dim_1,...,num_points_dim_D,dim), or (1,num_points,dim) for the adaptive scan
+                        if(adaptive_scan):
+                            assert(len(evalpositions.shape)==3)
+                        else:
+                            assert(len(evalpositions.shape)==(self.total_target_dim+2))
 
                         if(save_pdf_scan):
                                                                                                     
@@ -2116,7 +2739,7 @@ class pdf(nn.Module):
                             pdf_scan_volume_sizes.append(bin_volumes)                                                                  
                                                                                                            
                                                                                                   
-                        if(exact_coverage_calculation):
+                        if(contour_coverage):
 
                             exp_log_evals_list=numpy.exp(log_evals)[0].flatten()
                             ## expected coverage
@@ -2132,7 +2755,7 @@ class pdf(nn.Module):
                             all_joined_contours=contours.compute_contours(actual_expected_coverage, exp_log_evals_list, bin_volumes, sample_points=evalpositions[0])
 
                             ## find closest contour to truth
-                            cb=contours.find_closest_contour(self, embedded_labels[cur_batch_ind], all_joined_contours, actual_expected_coverage)
+                            cb=contours.find_closest_contour(embedded_labels[cur_batch_ind], all_joined_contours, actual_expected_coverage)
                             real_cov_values.append(cb)
 
                 elif(self.pdf_defs_list[0][0]=="s"):
@@ -2141,17 +2764,12 @@ class pdf(nn.Module):
                     assert(self.pdf_defs_list[0]=="s2"), "Only s2 supported at the moment!"
                     max_positions_angles=[]
 
-                    for cur_sample in range(batch_size):
-                        
-                        single_conditional_input=None
-                        if(conditional_input is not None):
-                        
-                            if(type(conditional_input)==list):  
-                                single_conditional_input=[ci[cur_sample:cur_sample+1] for ci in conditional_input]
-                            else:
-                                single_conditional_input=conditional_input[cur_sample:cur_sample+1]
+                    for cur_sample, eval_positions, log_pdf_evals, pdf_evals, eval_areas in self._s2_pdf_scan_events(conditional_input, 
+                                                                                                                   batch_size, 
+                                                                                                                   samples_per_event, 
+                                                                                                                   batched_scan=batched_scan, 
+                                                                                                                   scan_chunk_size=scan_chunk_size):
                         
-                        eval_positions, log_pdf_evals, pdf_evals, eval_areas, _ = get_multiresolution_evals(self, samplesize=10000, conditional_input=single_conditional_input, max_entries_per_pixel=5)
                         if((~numpy.isfinite(log_pdf_evals)).sum()>0):
                             print("nonfint")
                             print(log_pdf_evals[~numpy.isfinite(log_pdf_evals)])
@@ -2168,7 +2786,7 @@ class pdf(nn.Module):
                         embedding_max_position,_=self.transform_target_space(torch.from_numpy(max_positions_angles[-1]), transform_from="intrinsic", transform_to="embedding")
                         max_positions.append(embedding_max_position.numpy())
                         
-                        if(exact_coverage_calculation):
+                        if(contour_coverage):
                             ## interested proportions for target space coverage
                             ## TODO: fix start/ending to 0/1
                             actual_expected_coverage=numpy.linspace(0.02, 0.98, coverage_num_percentile_points)
@@ -2182,20 +2800,20 @@ class pdf(nn.Module):
                             
                             ## obtain coverage value of truth
 
-                            real_cov_value=contours.find_closest_contour(self, embedded_labels[cur_sample], xy_contours_for_coverage, actual_expected_coverage)
+                            real_cov_value=contours.find_closest_contour(embedded_labels[cur_sample], xy_contours_for_coverage, actual_expected_coverage)
                             #real_cov_value=sl_env_helper_fns.get_real_coverage_value(embedded_labels[cur_sample:cur_sample+1], xy_contours_for_coverage, interested_proportions)
 
                             real_cov_values.append(real_cov_value)
 
-                    if(calculate_MAP):
+                    if(scan_MAP):
                         return_dict["map_positions_angles"]=numpy.concatenate(max_positions_angles)
 
                 else:
                     raise NotImplementedError("Mixed sub dimensions and manifolds other than Euclidean (e) and Sphere (s) not supported for pdf scan/exact coverage at the moment!")
 
-                if(calculate_MAP):  
+                if(scan_MAP):  
                     return_dict["map_positions"]=numpy.concatenate(max_positions)
-                if(exact_coverage_calculation):
+                if(contour_coverage):
                     return_dict["real_cov_values"]=numpy.array(real_cov_values)
 
                 if(save_pdf_scan):
@@ -2203,50 +2821,386 @@ class pdf(nn.Module):
                     return_dict["pdf_scan_volume_sizes"]=pdf_scan_volume_sizes
                     return_dict["pdf_scan_log_evals"]=pdf_log_evals
 
+        if(calculate_MAP and refine_MAP):
 
-        return return_dict
-   
+            modes,_=self.find_mode(conditional_input=conditional_input, force_embedding_coordinates=True)
 
-#### Experimental functions
-#### Some of these functions generalize existing functions and will replace them in future release.
+            return_dict["map_positions"]=modes.cpu().numpy()
 
-    def entropy(self, 
-                sub_manifolds=[-1], 
-                conditional_input=None,
-                force_embedding_coordinates=True, 
-                force_intrinsic_coordinates=False,
-                samplesize=100,
-                failsafe_crosscheck_tolerance=None,
-                dtype=None,
-                device=None):
+            if(self.pdf_defs_list==["s2"]):
+                return_dict["map_positions_angles"]=self.transform_target_space(modes, transform_from="embedding", transform_to="intrinsic")[0].cpu().numpy()
+
+        return return_dict
 
+    def _density_rank_coverage(self, log_pdf_labels, conditional_input, samples_per_event=10000, chunk_size=16):
         """
-        Calculates entropy of the PDF.
-    
+        Coverage value of each truth as the probability mass with a higher density than at the truth, estimated from *samples_per_event* samples per event.
+        This is the quantity that the contour-based exact coverage approximates, but requires no pdf scan or contours. Densities are compared in embedding coordinates.
+
         Parameters:
-            sub_manifolds (list(int)): Contains indices of sub-manifolds if entropy should be calculated for marginal PDF of the given sub-manifold. *-1* stands for the total PDF and is the default.
-            conditional_input (Tensor/list(Tensor)/None): If passed defines the input to the PDF.
-            force_embedding_coordinates (bool): Forces embedding coordinates in entropy calculation. Should always be true for correct manifold entropies.
-            force_intrinsic_coordinates (bool): Forces intrinsic coordinates in entropy calculation. Should always be false for correct manifold entropies.
-            samplesize (int): Samplesize to use for entropy approximation.
-            failsafe_crosscheck_tolerance (float / None): If set, is used to crosscheck forward/bakckward pass compatability and resample if necessary. Has been introduced for the v flow in particular, so it should not be necessary for other flows.
-            dtype (torch dtype): If given, uses this dtype. Otherwise uses dtype from parameters.
-            device (torch.device): If given, uses this device. Otherwise uses device from parameters.
+            log_pdf_labels (Tensor): Log-pdf at the truths in embedding coordinates, shape (B,).
+            conditional_input (Tensor/list(Tensor)/None): Conditional input of shape (B,A). If None, all truths share the same PDF.
+            samples_per_event (int): Number of samples per event.
+            chunk_size (int): Number of events that are sampled together.
 
         Returns:
-            dict
-                Dictionary containing entropy for each index defined in parameter *sub_manifolds*. If *-1* was given in *sub_manifolds*, the resulting entropy is stored under the *total* key.
-
+            numpy array
+                Coverage values of shape (B,).
         """
 
-        data_type, used_device=self.obtain_current_dtype_n_device()
+        if(conditional_input is None):
+            _,_,log_pdf_samples,_=self.sample(samplesize=samples_per_event, force_embedding_coordinates=True)
 
-        if(device is not None):
-            used_device=device
-        if(dtype is not None):
-            data_type=dtype
+            return (log_pdf_samples[None,:]>log_pdf_labels[:,None]).double().mean(dim=1).cpu().numpy()
 
-        data_summary = None
+        batch_size=log_pdf_labels.shape[0]
+
+        assert(chunk_size>0)
+
+        coverage_values=[]
+
+        for chunk_start in range(0, batch_size, chunk_size):
+
+            chunk_end=min(chunk_start+chunk_size, batch_size)
+
+            _,_,log_pdf_samples,_=self.condition(_slice_conditional_input(conditional_input, chunk_start, chunk_end)).sample(samplesize=samples_per_event, force_embedding_coordinates=True)
+
+            log_pdf_samples=log_pdf_samples.reshape(chunk_end-chunk_start, samples_per_event)
+
+            coverage_values.append((log_pdf_samples>log_pdf_labels[chunk_start:chunk_end,None]).double().mean(dim=1))
+
+        return torch.cat(coverage_values).cpu().numpy()
+
+    def _euclidean_pdf_scan_events(self, conditional_input, batch_size, samples_per_event, batched_scan=False, scan_chunk_size=16, adaptive_scan=False):
+        """
+        Generator that performs the Euclidean pdf scan used in *coverage_and_or_pdf_scan*. Yields one tuple 
+        (batch index, max sample position, grid positions, log-pdf on grid, bin volume) per event. 
+        If *batched_scan* is set, sampling and grid evaluation is done for *scan_chunk_size* events at once.
+        If *adaptive_scan* is set, the grid is replaced by a k-d tree mesh based on the samples of each event and the bin volume by the volume of every mesh cell.
+        """
+        used_dtype, used_device=self.obtain_current_dtype_n_device()
+
+        npts_per_dim=int((samples_per_event)**(1.0/float(self.total_target_dim)))
+
+        if(batched_scan or adaptive_scan):
+            assert(scan_chunk_size>0)
+            chunk_size=scan_chunk_size
+        else:
+            chunk_size=1
+
+        for chunk_start in range(0, batch_size, chunk_size):
+
+            chunk_end=min(chunk_start+chunk_size, batch_size)
+            num_events=chunk_end-chunk_start
+
+            chunk_input=None
+            if(conditional_input is not None):
+                chunk_input=_slice_conditional_input(conditional_input, chunk_start, chunk_end)
+
+                ## predicts the flow parameters once per event instead of once per sample
+                samples,_,log_pdf_at_samples,_=self.condition(chunk_input).sample(samplesize=samples_per_event)
+            else:
+                samples,_,log_pdf_at_samples,_=self.sample(samplesize=num_events*samples_per_event)
+            
+            samples=samples.reshape(num_events, samples_per_event, -1)
+            log_pdf_at_samples=log_pdf_at_samples.reshape(num_events, samples_per_event).cpu().numpy()
+
+            ## calculate maximum value for completeness from samples
+            max_indices=numpy.argmax(log_pdf_at_samples, axis=1)
+            max_positions=samples[torch.arange(num_events), torch.from_numpy(max_indices)].cpu().numpy()
+
+            if(adaptive_scan):
+
+                scan_results=grid_functions.get_adaptive_pdf_scan_batched(samples, 
+                                                                          self, 
+                                                                          conditional_input=chunk_input, 
+                                                                          dtype=used_dtype, 
+                                                                          device=used_device)
+
+                for ind, (evalpositions, log_evals, cell_volumes) in enumerate(scan_results):
+                    yield chunk_start+ind, max_positions[ind:ind+1], evalpositions[None], log_evals[None], cell_volumes
+
+            elif(batched_scan):
+
+                density_bounds=grid_functions.obtain_density_eval_bounds_batched(samples, percentiles=[0.5,99.5])
+
+                evalpositions, log_evals, bin_volumes=grid_functions.get_pdf_on_grid_batched(density_bounds,
+                                                                                             npts_per_dim,
+                                                                                             self,
+                                                                                             conditional_input=chunk_input,
+                                                                                             dtype=used_dtype,
+                                                                                             device=used_device)
+                
+                for ind in range(num_events):
+                    yield chunk_start+ind, max_positions[ind:ind+1], evalpositions[ind:ind+1], log_evals[ind:ind+1], bin_volumes[ind]
+
+            else:
+
+                _, density_bounds,_=grid_functions.obtain_bins_and_visualization_regions(samples[0], self, percentiles=[0.5,99.5])
+
+                evalpositions, log_evals, bin_volumes, _, _= grid_functions.get_pdf_on_grid(density_bounds,
+                                                                                            npts_per_dim,
+                                                                                            self,
+                                                                                            conditional_input=chunk_input,
+                                                                                            s2_norm="standard",
+                                                                                            s2_rotate_to_true_value=False,
+                                                                                            true_values=None)
+
+                yield chunk_start, max_positions, evalpositions, log_evals, bin_volumes
+
+    def _s2_pdf_scan_events(self, conditional_input, batch_size, samples_per_event, batched_scan=False, scan_chunk_size=16):
+        """
+        Generator that performs the multiresolution s2 pdf scan used in *coverage_and_or_pdf_scan*. Yields one tuple 
+        (batch index, eval positions, log-pdf evals, pdf evals, eval areas) per event. 
+        If *batched_scan* is set, sampling and pdf evaluation is done for *scan_chunk_size* events at once.
+        """
+        
+        if(batched_scan and conditional_input is not None):
+            
+            assert(scan_chunk_size>0)
+
+            for chunk_start in range(0, batch_size, scan_chunk_size):
+                chunk_end=min(chunk_start+scan_chunk_size, batch_size)
+
+                if(type(conditional_input)==list):  
+                    chunk_input=[ci[chunk_start:chunk_end] for ci in conditional_input]
+                else:
+                    chunk_input=conditional_input[chunk_start:chunk_end]
+
+                chunk_results=get_multiresolution_evals_batched(self, chunk_input, samplesize=samples_per_event, max_entries_per_pixel=5)
+
+                for ind, (eval_positions, log_pdf_evals, pdf_evals, eval_areas, _) in enumerate(chunk_results):
+                    yield chunk_start+ind, eval_positions, log_pdf_evals, pdf_evals, eval_areas
+
+        else:
+
+            for cur_sample in range(batch_size):
+                            
+                single_conditional_input=None
+                if(conditional_input is not None):
+                
+                    if(type(conditional_input)==list):  
+                        single_conditional_input=[ci[cur_sample:cur_sample+1] for ci in conditional_input]
+                    else:
+                        single_conditional_input=conditional_input[cur_sample:cur_sample+1]
+                
+                eval_positions, log_pdf_evals, pdf_evals, eval_areas, _ = get_multiresolution_evals(self, samplesize=samples_per_event, conditional_input=single_conditional_input, max_entries_per_pixel=5)
+
+                yield cur_sample, eval_positions, log_pdf_evals, pdf_evals, eval_areas
+   
+
+#### Experimental functions
+#### Some of these functions generalize existing functions and will replace them in future release.
+
+    def entropy(self, 
+                sub_manifolds=[-1], 
+                conditional_input=None,
+                force_embedding_coordinates=True, 
+                force_intrinsic_coordinates=False,
+                samplesize=100,
+                failsafe_crosscheck_tolerance=None,
+                dtype=None,
+                device=None,
+                marginal_block_size=None,
+                base_sampling="mc"):
+
+        """
+        Calculates entropy of the PDF.
+    
+        Parameters:
+            sub_manifolds (list(int)): Contains indices of sub-manifolds if entropy should be calculated for marginal PDF of the given sub-manifold. *-1* stands for the total PDF and is the default.
+            conditional_input (Tensor/list(Tensor)/None): If passed defines the input to the PDF.
+            force_embedding_coordinates (bool): Forces embedding coordinates in entropy calculation. Should always be true for correct manifold entropies.
+            force_intrinsic_coordinates (bool): Forces intrinsic coordinates in entropy calculation. Should always be false for correct manifold entropies.
+            samplesize (int): Samplesize to use for entropy approximation.
+            failsafe_crosscheck_tolerance (float / None): If set, is used to crosscheck forward/bakckward pass compatability and resample if necessary. Has been introduced for the v flow in particular, so it should not be necessary for other flows.
+            dtype (torch dtype): If given, uses this dtype. Otherwise uses dtype from parameters.
+            device (torch.device): If given, uses this device. Otherwise uses device from parameters.
+            marginal_block_size (int/None): If given, marginal entropies of later sub-manifolds stream over the samplesize x samplesize cross product in blocks of this many 
+                                            conditioning samples with an online logsumexp (see *_streaming_marginal_log_pdf*). Memory then grows linearly instead of quadratically with *samplesize*.
+            base_sampling (str): Base sample generation. "mc" (default) for pseudo-random samples, "antithetic" for antithetic pairs and "sobol" for scrambled Sobol points (see *_draw_base_samples*).
+
+        Returns:
+            dict
+                Dictionary containing entropy for each index defined in parameter *sub_manifolds*. If *-1* was given in *sub_manifolds*, the resulting entropy is stored under the *total* key.
+
+        """
+
+        sample_entropies=self._entropy_sample_values(sub_manifolds=sub_manifolds, 
+                                                     conditional_input=conditional_input,
+                                                     force_embedding_coordinates=force_embedding_coordinates,
+                                                     force_intrinsic_coordinates=force_intrinsic_coordinates,
+                                                     samplesize=samplesize,
+                                                     failsafe_crosscheck_tolerance=failsafe_crosscheck_tolerance,
+                                                     dtype=dtype,
+                                                     device=device,
+                                                     marginal_block_size=marginal_block_size,
+                                                     base_sampling=base_sampling)
+
+        entropy_dict=dict()
+
+        for k in sample_entropies.keys():
+            entropy_dict[k]=sample_entropies[k].mean(dim=1)
+
+        return entropy_dict
+
+    def entropy_estimate(self, 
+                         sub_manifolds=[-1], 
+                         conditional_input=None,
+                         force_embedding_coordinates=True, 
+                         force_intrinsic_coordinates=False,
+                         samplesize=128,
+                         base_sampling="mc",
+                         target_standard_error=None,
+                         max_rounds=10,
+                         marginal_block_size=128,
+                         failsafe_crosscheck_tolerance=None,
+                         dtype=None,
+                         device=None):
+        """
+        Entropy with Monte Carlo standard error. Draws rounds of *samplesize* samples per conditional row until every standard error is below *target_standard_error* 
+        or *max_rounds* rounds have been drawn (sequential stopping). Antithetic and Sobol base samples reduce the variance for smooth flows. 
+        Marginal entropies of later sub-manifolds condition on the samples of their own round, so their errors are calculated from round means.
+
+        Parameters:
+            sub_manifolds (list(int)): See *entropy*.
+            conditional_input (Tensor/list(Tensor)/None): See *entropy*.
+            force_embedding_coordinates (bool): See *entropy*.
+            force_intrinsic_coordinates (bool): See *entropy*.
+            samplesize (int): Samplesize per round and conditional row. Should be even for "antithetic" and a power of two for "sobol".
+            base_sampling (str): "mc", "antithetic" or "sobol" (see *_draw_base_samples*).
+            target_standard_error (float/None): Stops once all standard errors are below this value. If None, draws as few rounds as necessary to estimate the errors.
+            max_rounds (int): Maximum number of rounds.
+            marginal_block_size (int/None): See *entropy*.
+            failsafe_crosscheck_tolerance (float / None): See *entropy*.
+            dtype (torch dtype): If given, uses this dtype. Otherwise uses dtype from parameters.
+            device (torch.device): If given, uses this device. Otherwise uses device from parameters.
+
+        Returns:
+            dict
+                Entropies for each index defined in *sub_manifolds* (*total* key for *-1*), shape (B,).
+            dict
+                Standard errors of the entropies, shape (B,).
+        """
+
+        def draw_round():
+            return self._entropy_sample_values(sub_manifolds=sub_manifolds, 
+                                               conditional_input=conditional_input,
+                                               force_embedding_coordinates=force_embedding_coordinates,
+                                               force_intrinsic_coordinates=force_intrinsic_coordinates,
+                                               samplesize=samplesize,
+                                               failsafe_crosscheck_tolerance=failsafe_crosscheck_tolerance,
+                                               dtype=dtype,
+                                               device=device,
+                                               marginal_block_size=marginal_block_size,
+                                               base_sampling=base_sampling)
+
+        with torch.no_grad():
+            return _sequential_monte_carlo_estimate(draw_round, 
+                                                    base_sampling=base_sampling, 
+                                                    target_standard_error=target_standard_error, 
+                                                    max_rounds=max_rounds, 
+                                                    round_units=[sub_mf for sub_mf in sub_manifolds if sub_mf>0])
+
+    def kl_divergence_estimate(self, 
+                               other_pdf,
+                               conditional_input=None,
+                               other_conditional_input=None,
+                               samplesize=128,
+                               base_sampling="mc",
+                               target_standard_error=None,
+                               max_rounds=10,
+                               dtype=None,
+                               device=None):
+        """
+        KL divergence KL(p||q) = E_p[log p(x) - log q(x)] between this PDF (p) and *other_pdf* (q) with Monte Carlo standard error, evaluated in embedding coordinates.
+        Uses the same rounds and sequential stopping as *entropy_estimate*.
+
+        Parameters:
+            other_pdf (jammy_flows.pdf): PDF on the same target manifold.
+            conditional_input (Tensor/list(Tensor)/None): Conditional input of this PDF, shape (B,A).
+            other_conditional_input (Tensor/list(Tensor)/None): Conditional input of *other_pdf* with the same batch size B.
+            samplesize (int): Samplesize per round and conditional row.
+            base_sampling (str): "mc", "antithetic" or "sobol" (see *_draw_base_samples*).
+            target_standard_error (float/None): See *entropy_estimate*.
+            max_rounds (int): Maximum number of rounds.
+            dtype (torch dtype): Only used for unconditional PDFs without parameters.
+            device (torch.device): Only used for unconditional PDFs without parameters.
+
+        Returns:
+            Tensor
+                KL divergence, shape (B,).
+            Tensor
+                Standard error of the KL divergence, shape (B,).
+        """
+
+        assert(self.pdf_defs_list==other_pdf.pdf_defs_list), "Both PDFs must be defined on the same manifold."
+
+        conditioned=None
+        other_conditioned=None
+        batch_size=1
+
+        if(conditional_input is not None):
+            conditioned=self.condition(conditional_input)
+            batch_size=conditioned.batch_size
+
+        if(other_conditional_input is not None):
+            other_conditioned=other_pdf.condition(other_conditional_input)
+            assert(other_conditioned.batch_size==batch_size), "Conditional inputs of both PDFs must have the same batch size."
+
+        def draw_round():
+
+            if(conditioned is not None):
+                samples, _, log_pdfs, _=conditioned.sample(samplesize=samplesize, force_embedding_coordinates=True, base_sampling=base_sampling)
+            else:
+                samples, _, log_pdfs, _=self.sample(samplesize=samplesize*batch_size, force_embedding_coordinates=True, dtype=dtype, device=device, base_sampling=base_sampling)
+
+            if(other_conditioned is not None):
+                other_log_pdfs, _, _=other_conditioned.forward(samples, force_embedding_coordinates=True)
+            else:
+                other_log_pdfs, _, _=other_pdf(samples, force_embedding_coordinates=True)
+
+            return {"kl": (log_pdfs-other_log_pdfs).reshape(batch_size, samplesize)}
+
+        with torch.no_grad():
+            estimates, standard_errors=_sequential_monte_carlo_estimate(draw_round, 
+                                                                        base_sampling=base_sampling, 
+                                                                        target_standard_error=target_standard_error, 
+                                                                        max_rounds=max_rounds)
+
+        return estimates["kl"], standard_errors["kl"]
+
+    def _entropy_sample_values(self, 
+                sub_manifolds=[-1], 
+                conditional_input=None,
+                force_embedding_coordinates=True, 
+                force_intrinsic_coordinates=False,
+                samplesize=100,
+                failsafe_crosscheck_tolerance=None,
+                dtype=None,
+                device=None,
+                marginal_block_size=None,
+                base_sampling="mc"):
+
+        """
+        Per-sample entropy contributions, i.e. negative (marginal) log-probabilities of a sample of the PDF. Parameters as in *entropy*. 
+        *base_sampling* defines how the base samples are drawn (see *_draw_base_samples*).
+
+        Returns:
+            dict
+                Dictionary containing a tensor of shape (B, samplesize) for each index defined in parameter *sub_manifolds*.
+        """
+
+        data_type, used_device=self.obtain_current_dtype_n_device()
+
+        if(device is not None):
+            used_device=device
+        if(dtype is not None):
+            data_type=dtype
+
+        data_summary = None
+        conditional_input_index = None
+        cached_flow_params = None
      
         ## some crosschecks
         if(conditional_input is not None):
@@ -2284,8 +3238,8 @@ class pdf(nn.Module):
                 data_type = conditional_input[0].dtype
                 used_device = conditional_input[0].device
                 
-                # a list of data summaries for the next functions
-                data_summary=[ci.repeat_interleave(samplesize, dim=0) for ci in conditional_input]
+                # a list of data summaries for the next functions .. conditional rows are gathered lazily via *conditional_input_index*
+                data_summary=conditional_input
 
                 batch_size=conditional_input[0].shape[0]
 
@@ -2295,14 +3249,19 @@ class pdf(nn.Module):
                 used_device = conditional_input.device
                 
                 # this behavior is a little differnet than in standard sample .. we sample for every conditional input multiple times
-                data_summary=conditional_input.repeat_interleave(samplesize, dim=0)
+                # conditional rows are gathered lazily via *conditional_input_index* instead of repeating the conditional input
+                data_summary=conditional_input
 
                 batch_size=conditional_input.shape[0]
 
+            ## the first sub-pdf predictor only depends on the conditional input .. evaluate it once per conditional row
+            conditional_input_index=torch.arange(batch_size, device=used_device).repeat_interleave(samplesize)
+            cached_flow_params=self.obtain_cached_flow_params(conditional_input)
+
         else:
             assert(self.conditional_input_dim is None), "We require conditional input, since this is a conditional PDF."
 
-        entropy_dict=dict()
+        sample_entropies=dict()
 
       
         if(use_marginal_subdims==False):
@@ -2314,9 +3273,12 @@ class pdf(nn.Module):
                                                                                           force_embedding_coordinates=force_embedding_coordinates, 
                                                                                           force_intrinsic_coordinates=force_intrinsic_coordinates,
                                                                                           dtype=data_type,
-                                                                                          device=used_device)
+                                                                                          device=used_device,
+                                                                                          conditional_input_index=conditional_input_index,
+                                                                                          cached_flow_params=cached_flow_params,
+                                                                                          base_sampling=base_sampling)
 
-            entropy_dict["total"]=-(log_pdf_dict["total"]).reshape(-1,samplesize).mean(dim=1)
+            sample_entropies["total"]=-(log_pdf_dict["total"]).reshape(-1,samplesize)
             
         else:
 
@@ -2333,7 +3295,10 @@ class pdf(nn.Module):
                                                                                           force_embedding_coordinates=force_embedding_coordinates, 
                                                                                           force_intrinsic_coordinates=force_intrinsic_coordinates,
                                                                                           dtype=data_type,
-                                                                                          device=used_device)
+                                                                                          device=used_device,
+                                                                                          conditional_input_index=conditional_input_index,
+                                                                                          cached_flow_params=cached_flow_params,
+                                                                                          base_sampling=base_sampling)
 
             #targets, log_det_dict_fw=self.all_layer_forward_individual_subdims(std_normal_samples, data_summary, sub_manifolds=sub_manifolds_here, force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
                     
@@ -2342,10 +3307,28 @@ class pdf(nn.Module):
                 ## also calculate total
                 if(-1 == sub_mf):
                     
-                    entropy_dict["total"]=-(log_pdf_dict["total"]).reshape(-1, samplesize).mean(dim=1)
+                    sample_entropies["total"]=-(log_pdf_dict["total"]).reshape(-1, samplesize)
                 elif(0==sub_mf):
                  
-                    entropy_dict[0]=-(log_pdf_dict[0]).reshape(-1, samplesize).mean(dim=1)
+                    sample_entropies[0]=-(log_pdf_dict[0]).reshape(-1, samplesize)
+                elif(marginal_block_size is not None):
+
+                    if(force_embedding_coordinates):
+                        coordinates="embedding"
+                    elif(force_intrinsic_coordinates):
+                        coordinates="intrinsic"
+                    else:
+                        coordinates="default"
+
+                    marginal_log_pdfs=self._streaming_marginal_log_pdf(sub_mf, 
+                                                                       targets, 
+                                                                       data_summary, 
+                                                                       samplesize, 
+                                                                       conditional_input_index=conditional_input_index, 
+                                                                       block_size=marginal_block_size, 
+                                                                       coordinates=coordinates)
+
+                    sample_entropies[sub_mf]=-marginal_log_pdfs
                 else:
 
                     max_target_first_index=0
@@ -2384,10 +3367,8 @@ class pdf(nn.Module):
 
                     if(data_summary is None):
                         new_base_vals, log_det_dict_individual=self.all_layer_inverse_individual_subdims(filled_up, None, sub_manifolds=[sub_mf], force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
-                    elif(type(data_summary)==list):
-                        new_base_vals, log_det_dict_individual=self.all_layer_inverse_individual_subdims(filled_up, [ds.repeat_interleave(samplesize, dim=0) for ds in data_summary], sub_manifolds=[sub_mf], force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
                     else:
-                        new_base_vals, log_det_dict_individual=self.all_layer_inverse_individual_subdims(filled_up, data_summary.repeat_interleave(samplesize, dim=0), sub_manifolds=[sub_mf], force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
+                        new_base_vals, log_det_dict_individual=self.all_layer_inverse_individual_subdims(filled_up, data_summary, sub_manifolds=[sub_mf], force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates, conditional_input_index=conditional_input_index.repeat_interleave(samplesize, dim=0), cached_flow_params=cached_flow_params)
 
 
                     this_base_dim=self.base_dim_indices[sub_mf][1]-self.base_dim_indices[sub_mf][0]
@@ -2398,10 +3379,10 @@ class pdf(nn.Module):
                     
                     log_probs=torch.logsumexp(log_probs, dim=-1)-numpy.log(float(samplesize))
                     
-                    entropy_dict[sub_mf]=-log_probs.mean(dim=1)
+                    sample_entropies[sub_mf]=-log_probs
                    
 
-        return entropy_dict
+        return sample_entropies
 
     def entropy_iterative(self, 
                 sub_manifolds=[-1], 
@@ -2451,6 +3432,8 @@ class pdf(nn.Module):
             data_type=dtype
 
         data_summary = None
+        conditional_input_index = None
+        cached_flow_params = None
 
         assert(samplesize % iterative_samplesize == 0), ("Sample size must be divisble by iterative sample size!", samplesize, iterative_samplesize)
 
@@ -2495,8 +3478,8 @@ class pdf(nn.Module):
                 data_type = conditional_input[0].dtype
                 used_device = conditional_input[0].device
                 
-                # a list of data summaries for the next functions
-                data_summary=[ci.repeat_interleave(samplesize, dim=0) for ci in conditional_input]
+                # a list of data summaries for the next functions .. conditional rows are gathered lazily via *conditional_input_index*
+                data_summary=conditional_input
 
                 batch_size=conditional_input[0].shape[0]
             else:
@@ -2505,9 +3488,14 @@ class pdf(nn.Module):
                 used_device = conditional_input.device
                 
                 # this behavior is a little differnet than in standard sample .. we sample for every conditional input multiple times
-                data_summary=conditional_input.repeat_interleave(samplesize, dim=0)
+                # conditional rows are gathered lazily via *conditional_input_index* instead of repeating the conditional input
+                data_summary=conditional_input
 
                 batch_size=conditional_input.shape[0]
+            ## the first sub-pdf predictor only depends on the conditional input .. evaluate it once per conditional row
+            conditional_input_index=torch.arange(batch_size, device=used_device).repeat_interleave(samplesize)
+            cached_flow_params=self.obtain_cached_flow_params(conditional_input)
+
         else:
             assert(self.conditional_input_dim is None), "We require conditional input, since this is a conditional PDF."
 
@@ -2525,7 +3513,9 @@ class pdf(nn.Module):
                                                                                           force_embedding_coordinates=force_embedding_coordinates, 
                                                                                           force_intrinsic_coordinates=force_intrinsic_coordinates,
                                                                                           dtype=data_type,
-                                                                                          device=used_device)
+                                                                                          device=used_device,
+                                                                                          conditional_input_index=conditional_input_index,
+                                                                                          cached_flow_params=cached_flow_params)
 
             entropy_dict["total"]=-(log_pdf_dict["total"]).reshape(-1,samplesize).mean(dim=1)
         
@@ -2545,7 +3535,9 @@ class pdf(nn.Module):
                                                                                           force_embedding_coordinates=force_embedding_coordinates, 
                                                                                           force_intrinsic_coordinates=force_intrinsic_coordinates,
                                                                                           dtype=data_type,
-                                                                                          device=used_device)
+                                                                                          device=used_device,
+                                                                                          conditional_input_index=conditional_input_index,
+                                                                                          cached_flow_params=cached_flow_params)
 
             for sub_mf in sub_manifolds:
 
@@ -2631,10 +3623,8 @@ class pdf(nn.Module):
 
                             if(data_summary is None):
                                 new_base_vals, log_det_dict_individual=self.all_layer_inverse_individual_subdims(filled_up, None, sub_manifolds=[sub_mf], force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
-                            elif(type(data_summary)==list):
-                                new_base_vals, log_det_dict_individual=self.all_layer_inverse_individual_subdims(filled_up, [ds[cur_batch_slice].repeat_interleave(iterative_samplesize, dim=0) for ds in data_summary], sub_manifolds=[sub_mf], force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
                             else:
-                                new_base_vals, log_det_dict_individual=self.all_layer_inverse_individual_subdims(filled_up, data_summary[cur_batch_slice].repeat_interleave(iterative_samplesize, dim=0), sub_manifolds=[sub_mf], force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
+                                new_base_vals, log_det_dict_individual=self.all_layer_inverse_individual_subdims(filled_up, data_summary, sub_manifolds=[sub_mf], force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates, conditional_input_index=conditional_input_index[cur_batch_slice].repeat_interleave(iterative_samplesize, dim=0), cached_flow_params=cached_flow_params)
 
 
                             this_base_dim=self.base_dim_indices[sub_mf][1]-self.base_dim_indices[sub_mf][0]
@@ -2660,13 +3650,140 @@ class pdf(nn.Module):
         else:
             return entropy_dict
 
+    def _inverse_sub_pdf_layers(self, pdf_index, this_target, extra_params):
+        """
+        Inverse mapping through all layers of sub-pdf *pdf_index* for targets in default coordinates. *extra_params* holds the flow parameters
+        of all layers of this sub-pdf (or None). Returns the base position and the log-det of the sub-pdf.
+        """
+        this_subpdf_log_det=0.0
+        extra_param_counter=0
+
+        for layer in reversed(self.layer_list[pdf_index]):
+
+            this_extra_params = None
+
+            if extra_params is not None:
+
+                if extra_param_counter == 0:
+                        this_extra_params = extra_params[:, -layer.total_param_num :]
+                else:
+
+                    this_extra_params = extra_params[
+                        :,
+                        -extra_param_counter
+                        - layer.total_param_num : -extra_param_counter,
+                    ]
+
+            this_target, this_layer_log_det = layer.inv_flow_mapping([this_target, 0.0], extra_inputs=this_extra_params)
+            
+            this_subpdf_log_det=this_subpdf_log_det+this_layer_log_det
+
+            extra_param_counter += layer.total_param_num
+
+        return this_target, this_subpdf_log_det
+
+    def _streaming_marginal_log_pdf(self, 
+                                    sub_mf, 
+                                    targets, 
+                                    data_summary, 
+                                    samplesize, 
+                                    conditional_input_index=None, 
+                                    block_size=100, 
+                                    coordinates="embedding"):
+        """
+        Monte Carlo estimate of the marginal log-pdf of sub-manifold *sub_mf* at every sample, log(1/S * sum_i p(x_k^j | x_{<k}^i)), using the S samples of the same conditional row.
+        The S x S cross product is streamed in blocks of *block_size* conditioning samples i with an online logsumexp, so memory is O(B*S*block_size) instead of O(B*S*S).
+        The flow parameters of sub-pdf *sub_mf* only depend on the conditioning sample, so they are predicted once per sample and gathered for all pairs,
+        and earlier sub-pdfs are not inverted at all. If sub-pdf *sub_mf* has no predicted parameters, it does not depend on earlier sub-manifolds and is inverted only once per sample.
+
+        Parameters:
+            sub_mf (int): Index of the sub-manifold (>0).
+            targets (Tensor): Samples of shape (B*S, D) in the coordinates given by *coordinates*, S consecutive samples per conditional row.
+            data_summary (Tensor/list(Tensor)/None): Conditional input.
+            samplesize (int): Number of samples S per conditional row.
+            conditional_input_index (Tensor/None): Conditional row of every sample, shape (B*S,).
+            block_size (int): Number of conditioning samples per block.
+            coordinates (str): One of "default"/"intrinsic"/"embedding".
+
+        Returns:
+            Tensor
+                Marginal log-pdf of shape (B, S).
+        """
+        assert(sub_mf>0)
+        assert(block_size>0)
+
+        default_targets, coordinate_log_dets=self.transform_target_space_individual_subdims(targets, transform_from=coordinates, transform_to="default")
+
+        batch_size=targets.shape[0]//samplesize
+
+        this_targets=default_targets[:, self.target_dim_indices[sub_mf][0]:self.target_dim_indices[sub_mf][1]]
+        
+        ## log-det of the coordinate transformation only depends on the evaluated sample
+        eval_log_dets=(torch.zeros(targets.shape[0], dtype=targets.dtype, device=targets.device)+coordinate_log_dets[sub_mf]).reshape(batch_size, samplesize)
+
+        base_normal=torch.distributions.Normal(0.0,1.0)
+
+        if(self.mlp_predictors[sub_mf] is None):
+            ## p(x_k | x_{<k}) = p(x_k) .. the cross product is not required
+            base_vals, log_dets=self._inverse_sub_pdf_layers(sub_mf, this_targets, None)
+
+            return (base_normal.log_prob(base_vals).sum(dim=-1)+log_dets).reshape(batch_size, samplesize)+eval_log_dets
+
+        ## flow parameters of sub-pdf *sub_mf* for every conditioning sample
+        extra_conditional_input=[self.layer_list[pdf_index][-1]._embedding_conditional_return(default_targets[:, self.target_dim_indices[pdf_index][0]:self.target_dim_indices[pdf_index][1]]) for pdf_index in range(sub_mf)]
+
+        if(data_summary is not None):
+            
+            this_data_summary=data_summary[sub_mf] if type(data_summary)==list else data_summary
+
+            if(conditional_input_index is not None):
+                this_data_summary=this_data_summary[conditional_input_index]
+
+            extra_conditional_input=[this_data_summary]+extra_conditional_input
+
+        flow_params=self.mlp_predictors[sub_mf](torch.cat(extra_conditional_input, dim=1))
+
+        flow_params=flow_params.reshape(batch_size, samplesize, -1)
+        this_targets=this_targets.reshape(batch_size, samplesize, -1)
+
+        running_max=None
+        running_sum=None
+
+        for block_start in range(0, samplesize, block_size):
+
+            block_end=min(block_start+block_size, samplesize)
+            num_block=block_end-block_start
+
+            ## pairs (b, i, j) with conditioning sample i in the block and evaluated sample j
+            pair_params=flow_params[:, block_start:block_end, None, :].expand(-1, -1, samplesize, -1).reshape(batch_size*num_block*samplesize, -1)
+            pair_targets=this_targets[:, None, :, :].expand(-1, num_block, -1, -1).reshape(batch_size*num_block*samplesize, -1)
+
+            base_vals, log_dets=self._inverse_sub_pdf_layers(sub_mf, pair_targets, pair_params)
+
+            log_probs=(base_normal.log_prob(base_vals).sum(dim=-1)+log_dets).reshape(batch_size, num_block, samplesize)
+
+            ## online logsumexp over the conditioning samples
+            block_max=log_probs.max(dim=1).values
+
+            if(running_max is None):
+                running_max=block_max
+                running_sum=torch.exp(log_probs-block_max[:,None,:]).sum(dim=1)
+            else:
+                new_max=torch.maximum(running_max, block_max)
+                running_sum=running_sum*torch.exp(running_max-new_max)+torch.exp(log_probs-new_max[:,None,:]).sum(dim=1)
+                running_max=new_max
+
+        return running_max+torch.log(running_sum)-numpy.log(float(samplesize))+eval_log_dets
+
     def all_layer_inverse_individual_subdims(self, 
                                              x, 
                                              data_summary, 
                                              amortization_parameters=None, 
                                              force_embedding_coordinates=False, 
                                              force_intrinsic_coordinates=False,
-                                             sub_manifolds=[-1]):
+                                             sub_manifolds=[-1],
+                                             conditional_input_index=None,
+                                             cached_flow_params=None):
 
 
         ## set maximum iter to last sub dimension
@@ -2735,17 +3852,26 @@ class pdf(nn.Module):
 
         for pdf_index, pdf_layers in enumerate(self.layer_list[:max_iter+1]):
 
-            extra_param_counter = 0
             this_pdf_type=self.pdf_defs_list[pdf_index]
 
             ## mlp preditors can be None for unresponsive layers like x/y
-            if(data_summary is not None and self.mlp_predictors[pdf_index] is not None):
+            if(cached_flow_params is not None and pdf_index in cached_flow_params and self.mlp_predictors[pdf_index] is not None):
+                ## predictor output was calculated once per conditional row .. only gather it
+                extra_params=cached_flow_params[pdf_index]
+
+                if(conditional_input_index is not None):
+                    extra_params=extra_params[conditional_input_index]
+
+            elif(data_summary is not None and self.mlp_predictors[pdf_index] is not None):
                 
                 if(type(data_summary)==list):
                     this_data_summary=data_summary[pdf_index]
                 else:
                     this_data_summary=data_summary
 
+                if(conditional_input_index is not None):
+                    this_data_summary=this_data_summary[conditional_input_index]
+
                 if(len(extra_conditional_input)>0):
                     this_data_summary=torch.cat([this_data_summary]+extra_conditional_input, dim=1)
                 
@@ -2800,36 +3926,8 @@ class pdf(nn.Module):
 
             this_target=x[:,self.target_dim_indices[pdf_index][0]:self.target_dim_indices[pdf_index][1]]
 
-            this_subpdf_log_det=0.0
-            
             ## reverse mapping is required for pdf evaluation
-            for l, layer in reversed(list(enumerate(pdf_layers))):
-
-                this_extra_params = None
-
-                if extra_params is not None:
-
-                    if extra_param_counter == 0:
-                            this_extra_params = extra_params[:, -layer.total_param_num :]
-                    else:
-
-                        this_extra_params = extra_params[
-                            :,
-                            -extra_param_counter
-                            - layer.total_param_num : -extra_param_counter,
-                        ]
-
- 
-                if(l==(len(pdf_layers)-1)):
-                    # force embedding or intrinsic coordinates in the layer that defines the target dimension
-                    this_target, this_layer_log_det = layer.inv_flow_mapping([this_target, 0.0], extra_inputs=this_extra_params)
-                else:
-
-                    this_target, this_layer_log_det = layer.inv_flow_mapping([this_target, 0.0], extra_inputs=this_extra_params)
-                
-                this_subpdf_log_det=this_subpdf_log_det+this_layer_log_det
-
-                extra_param_counter += layer.total_param_num
+            this_target, this_subpdf_log_det=self._inverse_sub_pdf_layers(pdf_index, this_target, extra_params)
 
             if("total" in log_det_dict.keys()):
                 log_det_dict["total"]=log_det_dict["total"]+this_subpdf_log_det
@@ -2858,10 +3956,16 @@ class pdf(nn.Module):
                                        force_intrinsic_coordinates=False,
                                        amortization_parameters=None,
                                        dtype=None,
-                                       device=None
+                                       device=None,
+                                       conditional_input_index=None,
+                                       cached_flow_params=None,
+                                       base_sampling="mc"
                                        ):
 
-        std_normal_samples = torch.randn(size=(total_samplesize, self.total_base_dim), dtype=dtype, device=device)
+        if(base_sampling=="mc"):
+            std_normal_samples = torch.randn(size=(total_samplesize, self.total_base_dim), dtype=dtype, device=device)
+        else:
+            std_normal_samples = _draw_base_samples(total_samplesize, self.total_base_dim, base_sampling=base_sampling, dtype=dtype, device=device)
         
         ## save the easy cases in dict
         base_evals_dict=dict()
@@ -2894,7 +3998,9 @@ class pdf(nn.Module):
                                                   force_embedding_coordinates=force_embedding_coordinates, 
                                                   force_intrinsic_coordinates=force_intrinsic_coordinates,
                                                   sub_manifolds=sub_manifolds,
-                                                  amortization_parameters=amortization_parameters)
+                                                  amortization_parameters=amortization_parameters,
+                                                  conditional_input_index=conditional_input_index,
+                                                  cached_flow_params=cached_flow_params)
 
  
         return_log_pdf=dict()
@@ -2909,7 +4015,7 @@ class pdf(nn.Module):
                       base_evals_dict,
                       sub_manifolds=sub_manifolds,
                       failsafe_crosscheck_tolerance=failsafe_crosscheck_tolerance,
-                      conditional_input=data_summary,
+                      conditional_input=_gather_conditional_input(data_summary, conditional_input_index),
                       amortization_parameters=amortization_parameters,
                       force_embedding_coordinates=force_embedding_coordinates,
                       force_intrinsic_coordinates=force_intrinsic_coordinates,
@@ -2932,7 +4038,9 @@ class pdf(nn.Module):
                                        force_embedding_coordinates=False, 
                                        force_intrinsic_coordinates=False,
                                        sub_manifolds=[-1],
-                                       amortization_parameters=None
+                                       amortization_parameters=None,
+                                       conditional_input_index=None,
+                                       cached_flow_params=None
                                        ):
 
             
@@ -2976,12 +4084,21 @@ class pdf(nn.Module):
                 this_pdf_type=self.pdf_defs_list[pdf_index]
 
                 extra_params = None
-                if(data_summary is not None and self.mlp_predictors[pdf_index] is not None):
+                if(cached_flow_params is not None and pdf_index in cached_flow_params and self.mlp_predictors[pdf_index] is not None):
+                    ## predictor output was calculated once per conditional row .. only gather it
+                    extra_params=cached_flow_params[pdf_index]
+
+                    if(conditional_input_index is not None):
+                        extra_params=extra_params[conditional_input_index]
+
+                elif(data_summary is not None and self.mlp_predictors[pdf_index] is not None):
                     
                     if(type(data_summary)==list):
                         this_data_summary=data_summary[pdf_index]
                     else:
                         this_data_summary=data_summary
+                    if(conditional_input_index is not None):
+                        this_data_summary=this_data_summary[conditional_input_index]
                     if(len(extra_conditional_input)>0):
                         this_data_summary=torch.cat([this_data_summary]+extra_conditional_input, dim=1)
 
@@ -3249,7 +4366,11 @@ class pdf(nn.Module):
                          device=None,
                          verbose=False,
                          s2_entropy_scanning=False,
-                         s2_entropy_scan_nside=32):
+                         s2_entropy_scan_nside=32,
+                         s2_entropy_scan_target_accuracy=1e-3,
+                         s2_entropy_scan_moc_pixel_mass=1e-3,
+                         s2_entropy_scan_max_nside=4096,
+                         s2_entropy_scan_chunk_size=100000):
         """
         Calculate the first and second central moments of the marginal distributions. For Euclidean manifolds it calculates a Gaussian approximation, for spherical distributions calculates
         a von-Mises approximation. Because these are the respective maximum entropy distributions, their entropy should always be larger than the original distribution.
@@ -3266,7 +4387,12 @@ class pdf(nn.Module):
             dtype (torch dtype): If given, uses this dtype. Otherwise uses dtype from parameters.
             device (torch.device): If given, uses this device. Otherwise uses device from parameters.
             verbose (bool): Some extra print statements on runtime.
-            s2_entropy_scanning (bool): Use a healpix scan to determine entropy .. can be faster for certain s2 distributions.
+            s2_entropy_scanning (bool): Use a healpix scan to determine entropy .. can be faster for certain s2 distributions. All events are scanned in a batched way on a shared pixel grid.
+            s2_entropy_scan_nside (int): Base nside of the healpix scan.
+            s2_entropy_scan_target_accuracy (float/None): High-density pixels are refined (MOC) until the scan normalizes to this accuracy. If None, no refinement is done.
+            s2_entropy_scan_moc_pixel_mass (float): Pixels above this probability mass are refined during the scan.
+            s2_entropy_scan_max_nside (int): Maximum nside of refined pixels.
+            s2_entropy_scan_chunk_size (int): Maximum number of pixel evaluations per forward pass during the scan.
 
         Returns:
 
@@ -3289,135 +4415,6 @@ class pdf(nn.Module):
            
         """
 
-        def random_VMF(mu , kappa , size = None):
-            """
-            Von Mises - Fisher distribution sampler with
-            mean direction mu and co nc en tr at io n kappa .
-            Source : https :// hal . science /hal - 04004568
-            """
-            # parse input parameters
-            n = 1 if size is None else numpy.product( size )
-            shape = () if size is None else tuple( numpy.ravel( size ))
-            mu = numpy.asarray( mu )
-            mu = mu / numpy.linalg.norm( mu )
-            (d ,) = mu.shape
-            # z component : radial samples pe rp en dic ul ar to mu
-            z = numpy.random.normal(0 , 1 , (n , d) )
-            z /= numpy.linalg.norm(z , axis =1 , keepdims = True )
-            z = z - (z @ mu[:, None ]) * mu[None , :]
-            z /= numpy.linalg.norm(z , axis =1 , keepdims = True )
-            # sample angles ( in cos and sin form )
-            cos = _random_VMF_cos(d , kappa , n )
-            sin = numpy.sqrt(1 - cos ** 2)
-            # combine angles with the z component
-            x = z * sin[:, None ] + cos[:, None ] * mu[None , :]
-            return x.reshape((*shape , d ))
-
-        def _random_VMF_cos(d: int , kappa : float , n: int):
-            """
-            Generate n iid samples t with density function given by
-            p(t) = someConstant * (1-t**2) **((d-2)/2) * exp ( kappa *t)
-            """
-            # b = Eq. 4 of https :// doi . org / 10. 1080 / 0 3 6 1 0 9 1 9 4 0 8 8 1 3 1 6 1
-            b = ( d - 1) / (2 * kappa + (4 * kappa ** 2 + ( d - 1) ** 2) ** 0.5)
-            x0 = (1 - b) / ( 1 + b)
-            c = kappa * x0 + ( d - 1) * numpy.log(1 - x0 ** 2)
-            found = 0
-            out = []
-            while found < n:
-                m = min(n , int((n-found)*1.5))
-                z = numpy.random.beta(( d - 1 ) / 2 , (d - 1) / 2 , size =m )
-                t = ( 1 - (1 + b) * z) / (1 - (1 - b) * z)
-                test = kappa * t + (d - 1) * numpy.log(1 - x0 * t) - c
-                accept = test >= -numpy.random.exponential( size =m)
-                out.append(t[ accept ])
-                found += len( out [-1])
-            return numpy.concatenate( out )[:n]
-
-        def get_rotation_matrix(target_vector):
-            # Normalize the target vector
-            
-            if(target_vector[0]==0 and target_vector[1]==0 and target_vector[2]==1.0):
-                return numpy.eye(3)
-            
-            target_vector = numpy.array(target_vector) / numpy.linalg.norm(target_vector)
-            
-            # Define the initial vector (0, 0, 1)
-            initial_vector = numpy.array([0, 0, 1])
-            
-            # Calculate the cross product between the initial and target vectors
-            cross_product = numpy.cross(initial_vector, target_vector)
-            
-            # Calculate the dot product between the initial and target vectors
-            dot_product = numpy.dot(initial_vector, target_vector)
-            
-            # Construct the skew-symmetric matrix
-            skew_symmetric_matrix = numpy.array([[0, -cross_product[2], cross_product[1]],
-                                              [cross_product[2], 0, -cross_product[0]],
-                                              [-cross_product[1], cross_product[0], 0]])
-            
-            # Construct the rotation matrix using Rodrigues' rotation formula
-            rotation_matrix = numpy.identity(3) + skew_symmetric_matrix + numpy.dot(skew_symmetric_matrix, skew_symmetric_matrix) * (1 - dot_product) / (numpy.linalg.norm(cross_product) ** 2)
-            
-            return rotation_matrix
-
-        def uniform_to_w(samples, kappa=1.0):
-
-            w_samples=1.0+(1.0/kappa)*numpy.log(samples+(1.0-samples)*numpy.exp(-2*kappa))
-            return w_samples
-
-        def obtain_fisher_mises_samples(mu, kappa, samplesize):
-
-            uniform_samples=numpy.random.uniform(size=(samplesize,))
-            uniform_samples_2=numpy.random.uniform(size=(samplesize,))
-
-            w_samples=uniform_to_w(uniform_samples,kappa=kappa)
-            
-            circle_samples_x=numpy.cos(uniform_samples_2*2*numpy.pi)
-            circle_samples_y=numpy.sin(uniform_samples_2*2*numpy.pi)
-            
-            pre_fac=numpy.sqrt(1.0-w_samples**2)
-                
-            assert(type(mu)==numpy.ndarray)
-            assert(len(mu)==3)
-            assert(len(mu.shape)==1)
-            
-            rot_matrix=get_rotation_matrix(mu)
-            
-            rot_matrix=numpy.repeat(rot_matrix[None,:,:], samplesize, axis=0)
-            
-            vecs=[ (pre_fac*circle_samples_x)[:,None], (pre_fac*circle_samples_y)[:,None], w_samples[:,None]]
-            vecs=numpy.concatenate(vecs, axis=1)
-                
-            return numpy.einsum("...ij,...j -> ...i", rot_matrix, vecs)
-
-        def newton_iter(arg, p, normed_length_summed_pts):
-            """
-            p is the Euclidean embedding dimension: p=3 -> 2-d sphere, p=2 -> 1-d circle
-            """
-            ## p = 2 -> p/2-1 = 0, p/2 = 1
-            ## p = 3 -> p/2-1 = 0.5, p/2 = 1.5
-
-            if(p==2):
-
-                a_p_k=i1(arg)/i0(arg)
-
-                return arg- ((a_p_k-normed_length_summed_pts)/(1.0-a_p_k**2- (1.0/arg)*a_p_k))
-
-               
-            elif(p==3):
-               
-                #a_p_k=iv(1.5, arg)/iv(0.5, arg)
-                # calculate ratio based on exact formulas from abramovitz & stegun (p.443)
-                a_p_k=-1.0/arg+1.0/numpy.tanh(arg)
-              
-              
-                temp=(a_p_k-normed_length_summed_pts)/(1.0-a_p_k**2- (2.0/arg)*a_p_k)
-               
-                return arg- ( (a_p_k-normed_length_summed_pts)/(1.0-a_p_k**2- (2.0/arg)*a_p_k) )
-
-        
-
         used_dtype, used_device=self.obtain_current_dtype_n_device()
 
         if(device is not None):
@@ -3454,6 +4451,7 @@ class pdf(nn.Module):
         with torch.no_grad():
         
             entropy_dict=None
+            scan_results=None
 
             data_summary_repeated=None
             if(conditional_input is not None):
@@ -3467,151 +4465,24 @@ class pdf(nn.Module):
                 # also calculate total entropy [-1], because it is no extra cost 
 
                 if(s2_entropy_scanning):
-                    assert(self.pdf_defs_list[0]=="s2")
-
-                    ent_vec=[]
-                    samp_vec=[]
-
-                    if(conditional_input is None):
-
-                        nside=s2_entropy_scan_nside
-
-                        tot_sum=0.0
-
-                        diff_tol=0.001
-
-                        is_still_bad=True
-
-                        MAX_SIZE=100000
-                        while( is_still_bad):
-
-                            nside=nside*2
-
-                            num_pix=healpy.nside2npix(nside)
-
-                            area_per_pixel=4*numpy.pi/num_pix
-
-                            theta, phi = healpy.pix2ang(nside=nside, ipix=numpy.arange(num_pix))
-
-                            target_angles=torch.from_numpy(numpy.concatenate([theta[:,None], phi[:,None]], axis=1))
-                           
-                            target_xyz,_=self.transform_target_space(target_angles, transform_from="intrinsic", transform_to="embedding")
-
-                            final_target=target_xyz.to(conditional_input)
-                            
-                            all_log_pdfs=[]
-
-                            other_iter=0
-                            next_target=final_target[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-                            
-                            while(len(next_target)>0):
-                                log_pdf,_,_=self.forward(next_target, conditional_input=None, force_embedding_coordinates=True)
-                                log_pdf=log_pdf.cpu().numpy()
-                                all_log_pdfs.append(log_pdf)
-
-                                other_iter+=1
-
-                                next_target=final_target[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-                                
-                            log_pdf=numpy.concatenate(all_log_pdfs)
-                            pdf_eval=numpy.exp(log_pdf)#numpy.exp(log_pdf)
-
-                            assert(len(pdf_eval)==num_pix), (len(pdf_eval), num_pix)
-                            probabilities=pdf_eval*area_per_pixel
-
-                            tot_sum=probabilities.sum()
-                           
-                            sample_indices=numpy.random.choice(numpy.arange(num_pix), samplesize, p=probabilities/tot_sum)
-
-                            num_unique_items=len(set(sample_indices))
-
-                            is_still_bad = (numpy.fabs(tot_sum-1.0)>diff_tol) | (num_unique_items < int(samplesize/10))
-                            print("nside ", nside," sidelen of pixel :", numpy.sqrt(area_per_pixel)*180.0/numpy.pi)
-                            print("num unique, ",num_unique_items)
-                            print("totsum ", tot_sum)
-                            print("BAD ? ", is_still_bad)
                     
-                    else:
-
-                        for cur_cinput in conditional_input:
-
-                            nside=s2_entropy_scan_nside
-
-                            tot_sum=0.0
-
-                            diff_tol=0.001
-
-                            is_still_bad=True
-
-                            MAX_SIZE=100000
-                            while( is_still_bad):
-
-                                nside=nside*2
-
-                                num_pix=healpy.nside2npix(nside)
-
-                                area_per_pixel=4*numpy.pi/num_pix
-
-                                theta, phi = healpy.pix2ang(nside=nside, ipix=numpy.arange(num_pix))
-
-                                target_angles=torch.from_numpy(numpy.concatenate([theta[:,None], phi[:,None]], axis=1))
-                               
-                                target_xyz,_=self.transform_target_space(target_angles, transform_from="intrinsic", transform_to="embedding")
-
-                                final_target=target_xyz.to(conditional_input)
-                                final_cinput=cur_cinput[None,:].repeat(num_pix, 1)
-
-                                all_log_pdfs=[]
-
-                                other_iter=0
-                                next_target=final_target[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-                                next_cinput=final_cinput[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-
-                                while(len(next_target)>0):
-                                    log_pdf,_,_=self.forward(next_target, conditional_input=next_cinput, force_embedding_coordinates=True)
-                                    log_pdf=log_pdf.cpu().numpy()
-                                    all_log_pdfs.append(log_pdf)
-
-                                    other_iter+=1
-
-                                    next_target=final_target[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-                                    next_cinput=final_cinput[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-
-                                    
-                                
-                                log_pdf=numpy.concatenate(all_log_pdfs)
-                                pdf_eval=numpy.exp(log_pdf)#numpy.exp(log_pdf)
-
-                                assert(len(pdf_eval)==num_pix), (len(pdf_eval), num_pix)
-                                probabilities=pdf_eval*area_per_pixel
-
-                                tot_sum=probabilities.sum()
-                               
-                                sample_indices=numpy.random.choice(numpy.arange(num_pix), samplesize, p=probabilities/tot_sum)
-
-                                num_unique_items=len(set(sample_indices))
-
-                                is_still_bad = (numpy.fabs(tot_sum-1.0)>diff_tol) | (num_unique_items < int(samplesize/10))
-                                print("nside ", nside," sidelen of pixel :", numpy.sqrt(area_per_pixel)*180.0/numpy.pi)
-                                print("num unique, ",num_unique_items)
-                                print("totsum ", tot_sum)
-                                print("BAD ? ", is_still_bad)
-                             
-
-                            theta, phi = healpy.pix2ang(nside=nside, ipix=sample_indices)
-
-                            this_samples=torch.from_numpy(numpy.concatenate([theta[:,None], phi[:,None]], axis=1))
-                            this_samples,_=self.transform_target_space(this_samples, transform_from="intrinsic", transform_to="embedding")
-                            ent_vec.append((probabilities*(-log_pdf)).sum())
-                           
-                            samp_vec.append(this_samples.to(conditional_input))
-
-                        entropy_dict=dict()
-                        entropy_dict[0]=torch.from_numpy(numpy.array(ent_vec)).to(conditional_input)
-                        entropy_dict["total"]=entropy_dict[0]
-
-                        samples=torch.cat(samp_vec, dim=0)
-
+                    ## batched healpix scan on a shared pixel grid, which also yields the exact first moment
+                    scan_results=healpix_scan.healpix_scan_s2(self,
+                                                              conditional_input=conditional_input,
+                                                              nside=s2_entropy_scan_nside,
+                                                              chunk_size=s2_entropy_scan_chunk_size,
+                                                              target_accuracy=s2_entropy_scan_target_accuracy,
+                                                              moc_pixel_mass=s2_entropy_scan_moc_pixel_mass,
+                                                              max_nside=s2_entropy_scan_max_nside,
+                                                              samplesize=samplesize,
+                                                              dtype=used_dtype,
+                                                              device=used_device)
+
+                    entropy_dict=dict()
+                    entropy_dict[0]=scan_results["entropy"]
+                    entropy_dict["total"]=entropy_dict[0]
+
+                    samples=scan_results["samples"].reshape(-1, 3)
 
                 else:
                     entropy_dict, samples, log_pdf_dict=self.entropy_iterative(sub_manifolds=[-1]+list(range(len(self.pdf_defs_list))), 
@@ -3632,7 +4503,10 @@ class pdf(nn.Module):
                 
                 # a simple sampling is typically faster than whole entropy calculation, so this might be a viable alternative
 
-                samples,_,sample_logprobs,_=self.sample(conditional_input=data_summary_repeated, samplesize=samplesize, device=used_device, dtype=used_dtype, force_embedding_coordinates=True)
+                if(conditional_input is not None):
+                    samples,_,sample_logprobs,_=self.condition(conditional_input).sample(samplesize=samplesize, force_embedding_coordinates=True)
+                else:
+                    samples,_,sample_logprobs,_=self.sample(samplesize=samplesize, device=used_device, dtype=used_dtype, force_embedding_coordinates=True)
 
             target_dim_embedded=self.total_target_dim_embedded
 
@@ -3726,6 +4600,11 @@ class pdf(nn.Module):
                     ## data summation mean
                     sample_sum=torch.sum(these_subsamples, dim=1)
                     sample_sum_length=(sample_sum**2).sum(dim=1, keepdims=True).sqrt()
+
+                    ## a healpix scan gives the exact first moment
+                    if(scan_results is not None):
+                        sample_sum=scan_results["mean"]*samplesize
+                        sample_sum_length=(sample_sum**2).sum(dim=1, keepdims=True).sqrt()
                     
                     ## mean vec on sphere
                     this_mean=sample_sum/(sample_sum_length)
@@ -3748,55 +4627,12 @@ class pdf(nn.Module):
                     elif("2" in sub_pdf_def):
                         p=3
 
-                    last_vec=(normalized_length_R*(p-normalized_length_R**2)/(1-normalized_length_R**2))
-                    
-                    max_iter=20
-        
-                    new_diff=None
-
-                    last_vec_cpu=last_vec.cpu()
-                    cpu_length=normalized_length_R.cpu()
-
-                    for i in range(max_iter):
-
-                        new_vec=newton_iter(last_vec_cpu, p,cpu_length)
-
-                        new_diff=torch.abs(new_vec-last_vec_cpu)
-
-                        if(new_diff.max()<mises_abs_precision):
-                            last_vec_cpu=new_vec
-                            break
-
-                        last_vec_cpu=new_vec
-                        
-                    ## set back to device before newton iters
-                    this_var=last_vec_cpu
-
-                    if(p==2):
-
-                        c_p_k=(1.0/(2*numpy.pi*i0(this_var))).to(angle_mean)
-                        a_p_k=(i1(this_var)/i0(this_var)).to(angle_mean)
-
-                    elif(p==3):
-
-                        a_p_k=(-1.0/this_var+1.0/numpy.tanh(this_var)).to(angle_mean)
-                        
-                        #c_p_k=(this_var**(0.5)/( (2*numpy.pi)**1.5 * iv(0.5, this_var))).to(angle_mean)
-                        log_c_p_k=torch.zeros_like(a_p_k)
+                    ## batched newton iterations for the concentration parameter
+                    this_var=von_mises_fisher.solve_kappa(normalized_length_R, p, abs_precision=mises_abs_precision)
 
+                    a_p_k=von_mises_fisher.mean_resultant_length(this_var, p)
+                    log_c_p_k=von_mises_fisher.log_normalization(this_var, p)
 
-
-                        log_c_p_k[this_var>50]=(torch.log(this_var)-numpy.log(2*numpy.pi)-this_var)[this_var>50].to(a_p_k)
-                        log_c_p_k[this_var<=50]=(torch.log(this_var)-numpy.log(2*numpy.pi)-torch.log(torch.exp(this_var)-torch.exp(-this_var)))[this_var<=50].to(a_p_k)
-
-                    
-                        #c_p_k*=1e-5
-                        #a_p_k=(iv(1.5, this_var)/iv(0.5, this_var)).to(angle_mean)
-                        
-
-
-                    this_var=this_var.to(angle_mean)
-                        
                     approx_entropy=(-log_c_p_k-this_var*a_p_k).squeeze(1)
 
                     #print("APPROX ENTORPY", approx_entropy)
@@ -3811,26 +4647,16 @@ class pdf(nn.Module):
                         ## cross entropy (true->approx)
                         cross_entropy=-log_probs.mean(dim=1).squeeze(1)
 
+                        if(scan_results is not None):
+                            ## closed form based on the scanned first moment
+                            cross_entropy=(-log_c_p_k-this_var*normalized_length_R).squeeze(1)
+
                         kl_diff=cross_entropy-entropy_dict[sub_pdf_dim]
 
                         ## reverse kl divergence
 
                         if(sub_pdf_dim==0):
-                            mises_samples=[]
-                            for cur_ind, cur_mean in enumerate(this_mean):
-                                
-                                #print("MEAN", cur_mean.cpu().numpy())
-                                #print("KAPPA", this_var[cur_ind].cpu().numpy())
-                                ms=obtain_fisher_mises_samples(cur_mean.cpu().numpy() , this_var[cur_ind].cpu().numpy() , samplesize=samplesize)
-                                #print(ms)
-                                lens=numpy.sqrt(numpy.sum(ms**2, axis=1))
-                                #print("LENS", lens)
-                                ## much slower
-                                #ms=random_VMF(cur_mean.cpu().numpy() , this_var[cur_ind].cpu().numpy() , size = samplesize)
-                               
-                                mises_samples.append(torch.from_numpy(ms).type_as(log_probs).to(log_probs))
-
-                            mises_samples=torch.cat(mises_samples, dim=0)
+                            mises_samples=von_mises_fisher.sample_von_mises_fisher(this_mean, this_var, samplesize).reshape(-1, this_mean.shape[1])
 
                             mises_samp_logprob_exact,_,_=self.forward(mises_samples, conditional_input=data_summary_repeated)
                             
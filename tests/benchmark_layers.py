@@ -0,0 +1,241 @@
+"""
+Benchmark suite covering every flow layer letter in *flow_options.opts_dict*.
+
+For each layer letter, a PDF with that single layer is generated for several dimensions and batch sizes, and forward (log-prob evaluation), sample and backward
+(gradient of the mean log-prob) are timed separately. Results are stored as JSON, so regressions can be diffed between commits.
+
+Usage:
+    python tests/benchmark_layers.py --output results_new.json
+    python tests/benchmark_layers.py --letters g,n,r --batch_sizes 100,10000 --output results_new.json --compare results_old.json
+"""
+import sys
+import os
+import torch
+import numpy
+import time
+import json
+import argparse
+import platform
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import jammy_flows.main.default as f
+from jammy_flows.flow_options import obtain_overall_flow_info
+
+## candidate dimensions per manifold type .. combinations not supported by a layer are skipped and recorded as such
+default_dimensions=dict(e=[1,2,5], s=[1,2], i=[1,2], a=[1,2])
+
+def get_git_commit():
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def time_function(fn, num_repetitions):
+    """
+    Returns the median and minimum wall time of *num_repetitions* calls after one warm-up call.
+    """
+    fn()
+
+    times=[]
+    for _ in range(num_repetitions):
+        tbef=time.perf_counter()
+        fn()
+        times.append(time.perf_counter()-tbef)
+
+    return float(numpy.median(times)), float(numpy.min(times))
+
+def benchmark_layer(letter, manifold_type, dimension, batch_sizes, num_repetitions=3, dtype=torch.float64, seed=1):
+    """
+    Benchmarks a single-layer PDF.
+
+    Returns:
+        list(dict)
+            One entry per batch size, or a single entry with the skip reason if the PDF can not be constructed for this dimension.
+    """
+    pdf_def="%s%d" % (manifold_type, dimension)
+
+    base_entry=dict(letter=letter, pdf_def=pdf_def, dimension=dimension)
+
+    torch.manual_seed(seed)
+    numpy.random.seed(seed)
+
+    try:
+        this_pdf=f.pdf(pdf_def, letter)
+        this_pdf.to(dtype)
+
+        with torch.no_grad():
+            this_pdf.sample(samplesize=2, dtype=dtype, device=torch.device("cpu"))
+
+    except Exception as e:
+        base_entry["skipped"]=repr(e)
+        return [base_entry]
+
+    results=[]
+
+    for batch_size in batch_sizes:
+
+        entry=dict(base_entry)
+        entry["batch_size"]=batch_size
+
+        with torch.no_grad():
+            samples,_,_,_=this_pdf.sample(samplesize=batch_size, dtype=dtype, device=torch.device("cpu"))
+
+        def sample_fn():
+            with torch.no_grad():
+                this_pdf.sample(samplesize=batch_size, dtype=dtype, device=torch.device("cpu"))
+
+        def forward_fn():
+            with torch.no_grad():
+                this_pdf(samples)
+
+        def backward_fn():
+            this_pdf.zero_grad()
+            log_pdf,_,_=this_pdf(samples)
+            log_pdf.mean().backward()
+
+        for name, fn in [("forward", forward_fn), ("sample", sample_fn), ("backward", backward_fn)]:
+
+            ## do-nothing layers have no parameters and no backward pass
+            if(name=="backward" and this_pdf.count_parameters()==0):
+                entry[name]=None
+                continue
+
+            try:
+                median_time, min_time=time_function(fn, num_repetitions)
+                entry[name]=dict(median=median_time, min=min_time)
+            except Exception as e:
+                entry[name]=dict(error=repr(e))
+
+        results.append(entry)
+
+    return results
+
+def run_suite(letters=None, dimensions=None, batch_sizes=[100, 10000], num_repetitions=3, verbose=True):
+    """
+    Runs the benchmark for all (or the given) layer letters.
+
+    Parameters:
+        letters (list(str)/None): Layer letters. Defaults to all letters in *obtain_overall_flow_info()*.
+        dimensions (dict/None): Candidate dimensions per manifold type. Defaults to *default_dimensions*.
+        batch_sizes (list(int)): Batch sizes.
+        num_repetitions (int): Number of timed repetitions per measurement.
+
+    Returns:
+        dict
+            JSON-serializable results including metadata.
+    """
+    flow_info=obtain_overall_flow_info()
+
+    if(letters is None):
+        letters=sorted(flow_info.keys())
+
+    if(dimensions is None):
+        dimensions=default_dimensions
+
+    results=[]
+
+    for letter in letters:
+        manifold_type=flow_info[letter]["type"]
+
+        for dimension in dimensions[manifold_type]:
+            for res in benchmark_layer(letter, manifold_type, dimension, batch_sizes, num_repetitions=num_repetitions):
+                results.append(res)
+
+                if(verbose):
+                    print(format_result(res))
+
+    metadata=dict(git_commit=get_git_commit(),
+                  torch_version=torch.__version__,
+                  python_version=platform.python_version(),
+                  machine=platform.machine(),
+                  processor=platform.processor(),
+                  num_threads=torch.get_num_threads(),
+                  time=time.strftime("%Y-%m-%d %H:%M:%S"),
+                  num_repetitions=num_repetitions)
+
+    return dict(metadata=metadata, results=results)
+
+def format_result(res):
+
+    if("skipped" in res):
+        return "%s / %s ... skipped (%s)" % (res["letter"], res["pdf_def"], res["skipped"][:60])
+
+    timings=[]
+    for name in ["forward", "sample", "backward"]:
+        if(res[name] is None):
+            timings.append("%s: -" % name)
+        elif("error" in res[name]):
+            timings.append("%s: error" % name)
+        else:
+            timings.append("%s: %.5fs" % (name, res[name]["median"]))
+
+    return "%s / %s / B=%d ... %s" % (res["letter"], res["pdf_def"], res["batch_size"], " / ".join(timings))
+
+def compare_results(new_results, old_results, threshold=1.2):
+    """
+    Compares median timings of two result files.
+
+    Parameters:
+        new_results (dict): Output of *run_suite*.
+        old_results (dict): Output of *run_suite* for a reference commit.
+        threshold (float): Ratio new/old above which an entry is flagged as regression.
+
+    Returns:
+        list(tuple)
+            (letter, pdf_def, batch_size, measurement, old median, new median, ratio) for every flagged regression.
+    """
+    def key_dict(results):
+        return dict([((r["letter"], r["pdf_def"], r["batch_size"]), r) for r in results["results"] if "skipped" not in r])
+
+    new_dict=key_dict(new_results)
+    old_dict=key_dict(old_results)
+
+    regressions=[]
+
+    for k in sorted(set(new_dict.keys()) & set(old_dict.keys())):
+        for name in ["forward", "sample", "backward"]:
+            new_entry=new_dict[k][name]
+            old_entry=old_dict[k][name]
+
+            if(new_entry is None or old_entry is None or "median" not in new_entry or "median" not in old_entry):
+                continue
+
+            ratio=new_entry["median"]/old_entry["median"]
+
+            if(ratio>threshold):
+                regressions.append(k+(name, old_entry["median"], new_entry["median"], ratio))
+
+    return regressions
+
+if __name__ == '__main__':
+
+    parser=argparse.ArgumentParser(description="Benchmark all flow layers.")
+    parser.add_argument("--letters", type=str, default=None, help="Comma-separated layer letters. Default: all.")
+    parser.add_argument("--batch_sizes", type=str, default="100,10000", help="Comma-separated batch sizes.")
+    parser.add_argument("--num_repetitions", type=int, default=3)
+    parser.add_argument("--output", type=str, default="benchmark_results.json")
+    parser.add_argument("--compare", type=str, default=None, help="JSON file of a previous run to compare against.")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio that is reported as regression.")
+
+    args=parser.parse_args()
+
+    letters=None if args.letters is None else args.letters.split(",")
+    batch_sizes=[int(b) for b in args.batch_sizes.split(",")]
+
+    results=run_suite(letters=letters, batch_sizes=batch_sizes, num_repetitions=args.num_repetitions)
+
+    with open(args.output, "w") as out_file:
+        json.dump(results, out_file, indent=1)
+
+    if(args.compare is not None):
+        with open(args.compare) as in_file:
+            old_results=json.load(in_file)
+
+        regressions=compare_results(results, old_results, threshold=args.threshold)
+
+        print("%d regressions above a ratio of %.2f" % (len(regressions), args.threshold))
+        for reg in regressions:
+            print("%s / %s / B=%d / %s ... %.5fs -> %.5fs (x%.2f)" % reg)
@@ -21,11 +21,12 @@ def test_gf_modes():
 
         extra_flow_defs=dict()
         extra_flow_defs["g"]=dict()
-        extra_flow_defs["g"]["kwargs"]=dict()
 
-        extra_flow_defs["g"]["kwargs"]["inverse_function_type"]=icdf_approx
+        extra_flow_defs["g"]["inverse_function_type"]=icdf_approx
+
+        this_flow=f.pdf("e5", "gggg", options_overwrite=extra_flow_defs)
+        this_flow.double()
 
-        this_flow=f.pdf("e5", "gggg", flow_defs_detail=extra_flow_defs)
         with torch.no_grad():
             tbef=time.time()
             
@@ -0,0 +1,51 @@
+import sys
+import os
+import torch
+import numpy
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from jammy_flows.layers import matrix_fns
+
+def benchmark_rotation_application(batch_size=1000000, dimension=5, num_repetitions=5, device=torch.device("cpu")):
+    """
+    Compares the broadcast matmul path for a shared rotation matrix with the previous batch-repeated bmm.
+    """
+
+    x=torch.randn(size=(batch_size, dimension), device=device).type(torch.float64)
+    mat=torch.randn(size=(1, dimension, dimension), device=device).type(torch.float64)
+
+    def repeated_bmm():
+        return torch.bmm(mat.repeat(batch_size, 1,1), x.unsqueeze(-1)).squeeze(-1)
+
+    def broadcast_matmul():
+        return matrix_fns.apply_matrix(mat, x)
+
+    for name, fn in [("repeat + bmm", repeated_bmm), ("broadcast matmul", broadcast_matmul)]:
+
+        if(device.type=="cuda"):
+            torch.cuda.reset_peak_memory_stats(device)
+
+        times=[]
+        for _ in range(num_repetitions):
+            tbef=time.time()
+            res=fn()
+            if(device.type=="cuda"):
+                torch.cuda.synchronize(device)
+            times.append(time.time()-tbef)
+
+        ## the repeated matrix alone takes B*D*D entries
+        extra_mem=batch_size*dimension*dimension*x.element_size()/1e6 if name=="repeat + bmm" else 0.0
+        peak_mem=""
+        if(device.type=="cuda"):
+            peak_mem=" / peak memory %.1f MB" % (torch.cuda.max_memory_allocated(device)/1e6)
+
+        print("%s (B=%d, D=%d) ... median time %.4f s / materialized matrix memory %.1f MB%s" % (name, batch_size, dimension, numpy.median(times), extra_mem, peak_mem))
+
+if __name__ == '__main__':
+
+    benchmark_rotation_application()
+
+    if(torch.cuda.is_available()):
+        benchmark_rotation_application(device=torch.device("cuda"))
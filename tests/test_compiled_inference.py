@@ -0,0 +1,78 @@
+import unittest
+import sys
+import os
+import torch
+import numpy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import jammy_flows.main.default as f
+
+def seed_everything(seed_no):
+    torch.manual_seed(seed_no)
+    numpy.random.seed(seed_no)
+
+class Test(unittest.TestCase):
+    def setUp(self):
+
+        seed_everything(1)
+
+        self.pdf=f.pdf("e2+s2", "gg+n", conditional_input_dim=2)
+        self.pdf.double()
+
+        self.conditional_input=torch.randn(size=(50,2)).type(torch.float64)
+
+    def test_frozen_equivalence(self):
+        """
+        The frozen/compiled mappings must reproduce *forward* and *sample*, also when forcing embedding coordinates.
+        """
+        for force_embedding in [False, True]:
+
+            compiled=self.pdf.compile_for_inference(backend="eager", force_embedding_coordinates=force_embedding)
+
+            samples, base_samples, log_pdfs, log_pdfs_base=self.pdf.sample(conditional_input=self.conditional_input, seed=3, force_embedding_coordinates=force_embedding)
+            compiled_samples, compiled_base_samples, compiled_log_pdfs, compiled_log_pdfs_base=compiled.sample(conditional_input=self.conditional_input, seed=3)
+
+            self.assertTrue(torch.allclose(samples, compiled_samples))
+            self.assertTrue(torch.allclose(base_samples, compiled_base_samples))
+            self.assertTrue(torch.allclose(log_pdfs, compiled_log_pdfs))
+            self.assertTrue(torch.allclose(log_pdfs_base, compiled_log_pdfs_base))
+
+            with torch.no_grad():
+                evals, base_evals, base_pos=self.pdf(samples, conditional_input=self.conditional_input, force_embedding_coordinates=force_embedding)
+
+            compiled_evals, compiled_base_evals, compiled_base_pos=compiled.log_prob(samples, conditional_input=self.conditional_input)
+
+            self.assertTrue(torch.allclose(evals, compiled_evals))
+            self.assertTrue(torch.allclose(base_evals, compiled_base_evals))
+            self.assertTrue(torch.allclose(base_pos, compiled_base_pos))
+
+            self.assertTrue(compiled.is_compiled)
+
+    def test_fallback(self):
+        """
+        Non-compilable layers and failing compilation must fall back to the frozen mapping.
+        """
+        cnf_pdf=f.pdf("s2", "c")
+        cnf_pdf.double()
+
+        compiled=cnf_pdf.compile_for_inference(backend="eager")
+        self.assertFalse(compiled.is_compiled)
+
+        samples,_,log_pdfs,_=compiled.sample(samplesize=5, seed=1)
+        evals,_,_=compiled.log_prob(samples)
+
+        self.assertTrue(torch.isfinite(evals).all())
+
+        compiled=self.pdf.compile_for_inference(backend="non_existing_backend")
+        self.assertFalse(compiled.is_compiled)
+
+        compiled_evals,_,_=compiled.log_prob(self.pdf.sample(conditional_input=self.conditional_input)[0], conditional_input=self.conditional_input)
+        self.assertTrue(torch.isfinite(compiled_evals).all())
+
+        ## fully amortized PDFs are not supported
+        with self.assertRaises(Exception):
+            f.pdf("e2", "gg", amortize_everything=True).compile_for_inference()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import sys
+import os
+import torch
+import numpy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import jammy_flows.main.default as f
+
+def seed_everything(seed_no):
+    torch.manual_seed(seed_no)
+    numpy.random.seed(seed_no)
+
+class Test(unittest.TestCase):
+    def setUp(self):
+
+        seed_everything(1)
+
+        self.pdf=f.pdf("e2+s2", "gg+n", conditional_input_dim=2)
+        self.pdf.double()
+
+        self.conditional_input=torch.randn(size=(5,2)).type(torch.float64)
+
+    def test_condition(self):
+        """
+        The conditioned handle must reproduce sampling and evaluation with repeated conditional input.
+        """
+        samplesize=20
+
+        repeated_input=self.conditional_input.repeat_interleave(samplesize, dim=0)
+
+        conditioned=self.pdf.condition(self.conditional_input)
+
+        samples, base_samples, log_pdfs, log_pdfs_base=self.pdf.sample(conditional_input=repeated_input, seed=3)
+        cond_samples, cond_base_samples, cond_log_pdfs, cond_log_pdfs_base=conditioned.sample(samplesize=samplesize, seed=3)
+
+        self.assertTrue(torch.allclose(samples, cond_samples))
+        self.assertTrue(torch.allclose(base_samples, cond_base_samples))
+        self.assertTrue(torch.allclose(log_pdfs, cond_log_pdfs))
+        self.assertTrue(torch.allclose(log_pdfs_base, cond_log_pdfs_base))
+
+        with torch.no_grad():
+            evals,_,base_pos=self.pdf(samples, conditional_input=repeated_input)
+            cond_evals,_,cond_base_pos=conditioned.forward(samples)
+
+            ## explicit index with a permutation of the items
+            perm=torch.randperm(samples.shape[0])
+            index_evals,_,_=conditioned.forward(samples[perm], conditional_input_index=torch.arange(5).repeat_interleave(samplesize)[perm])
+
+        self.assertTrue(torch.allclose(evals, cond_evals))
+        self.assertTrue(torch.allclose(base_pos, cond_base_pos))
+        self.assertTrue(torch.allclose(evals[perm], index_evals))
+
+    def test_ragged(self):
+        """
+        Ragged sampling must agree with sampling from explicitly repeated conditional input.
+        """
+        samples_per_row=[3,0,7,1,4]
+
+        samples, base_samples, log_pdfs, _, segment_index, offsets=self.pdf.sample_ragged(self.conditional_input, samples_per_row, seed=2)
+
+        self.assertEqual(samples.shape[0], sum(samples_per_row))
+        self.assertEqual(offsets.tolist(), [0,3,3,10,11,15])
+        self.assertEqual(segment_index.tolist(), [0,0,0,2,2,2,2,2,2,2,3,4,4,4,4])
+
+        repeated_input=self.conditional_input.repeat_interleave(torch.tensor(samples_per_row), dim=0)
+
+        rep_samples, rep_base_samples, rep_log_pdfs, _=self.pdf.sample(conditional_input=repeated_input, seed=2)
+
+        self.assertTrue(torch.allclose(samples, rep_samples))
+        self.assertTrue(torch.allclose(log_pdfs, rep_log_pdfs))
+
+        with torch.no_grad():
+            evals,_,_=self.pdf.condition(self.conditional_input).forward(samples, conditional_input_index=segment_index)
+
+        self.assertTrue(torch.allclose(evals, log_pdfs))
+
+    def test_entropy(self):
+        """
+        Entropies calculated with lazily gathered conditional input must be finite and have one entry per conditional row.
+        """
+        entropies=self.pdf.entropy(sub_manifolds=[-1,0,1], conditional_input=self.conditional_input, samplesize=30)
+
+        for k in ["total", 0, 1]:
+            self.assertEqual(entropies[k].shape[0], 5)
+            self.assertTrue(torch.isfinite(entropies[k]).all())
+
+if __name__ == '__main__':
+    unittest.main()
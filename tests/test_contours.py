@@ -0,0 +1,86 @@
+import unittest
+import sys
+import os
+import numpy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from jammy_flows.helper_fns import contours, coverage
+
+def loop_contour_levels(proportions, pdf_evals, areas):
+    """
+    Reference levels with a per-event binary search, for distinct and reachable proportions.
+    """
+    levels=[]
+
+    for ind in range(pdf_evals.shape[0]):
+        sorted_pdf=numpy.sort(pdf_evals[ind])[::-1]
+        cumulative=numpy.cumsum(numpy.sort(pdf_evals[ind]*areas[ind])[::-1])
+
+        level_indices=numpy.searchsorted(cumulative, proportions, side="right")
+        levels.append((sorted_pdf[level_indices]+sorted_pdf[level_indices+1])/2.0)
+
+    return numpy.array(levels)
+
+class Test(unittest.TestCase):
+
+    def test_contour_levels(self):
+        """
+        Levels must be strictly decreasing, enclose the requested proportions and agree between the single and batched versions.
+        """
+        numpy.random.seed(1)
+
+        pdf_evals=numpy.random.uniform(size=(3,1000))
+        areas=1.0/pdf_evals.sum(axis=1, keepdims=True)
+
+        ## includes repeated and unreachable proportions
+        proportions=[0.1,0.5,0.5,0.9,1.5,2.0]
+
+        batched_levels=contours.find_contour_levels_batched(proportions, pdf_evals, areas)
+
+        self.assertEqual(batched_levels.shape, (3,6))
+
+        for ind in range(3):
+            levels=contours.find_contour_levels(proportions, pdf_evals[ind], areas[ind])
+
+            self.assertTrue(numpy.allclose(levels, batched_levels[ind]))
+            self.assertTrue((numpy.diff(levels)<0).all())
+
+            enclosed=(pdf_evals[ind]*areas[ind])[pdf_evals[ind]>levels[1]].sum()
+            self.assertTrue(abs(enclosed-0.5)<0.01)
+
+    def test_contour_levels_many_events(self):
+        """
+        Batched levels of many events must agree with a per-event binary search.
+        """
+        numpy.random.seed(3)
+
+        pdf_evals=numpy.random.uniform(size=(20000,20))
+        areas=1.0/pdf_evals.sum(axis=1, keepdims=True)
+
+        proportions=[0.3,0.6,0.9]
+
+        self.assertTrue(numpy.allclose(contours.find_contour_levels_batched(proportions, pdf_evals, areas), loop_contour_levels(proportions, pdf_evals, areas)))
+
+    def test_closest_contour(self):
+        """
+        The KD-tree search must agree with a brute-force search over all contour vertices, also for batched queries.
+        """
+        numpy.random.seed(2)
+
+        ## contour levels with one or several pieces
+        all_contours=[[numpy.random.normal(size=(20,2))*(ind+1) for _ in range(ind%3+1)] for ind in range(10)]
+        contour_probs=numpy.linspace(0.1,0.9,10)
+
+        truths=numpy.random.normal(size=(50,2))*3
+
+        brute_force=[]
+        for truth in truths:
+            min_dists=[min(numpy.sqrt(((numpy.concatenate(c, axis=0)-truth)**2).sum(axis=1))) for c in all_contours]
+            brute_force.append(contour_probs[numpy.argmin(min_dists)])
+
+        self.assertTrue(numpy.allclose(contours.find_closest_contour(truths, all_contours, contour_probs), brute_force))
+        self.assertEqual(coverage.find_closest(truths[3], [numpy.concatenate(c, axis=0) for c in all_contours], contour_probs), brute_force[3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,6 +14,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 import jammy_flows.main.default as f
 
 import jammy_flows.helper_fns as helper_fns
+from jammy_flows.helper_fns import von_mises_fisher, healpix_scan
 
 
 def seed_everything(seed_no):
@@ -442,8 +443,175 @@ class Test(unittest.TestCase):
             #compare_two_arrays(base_samples.detach().numpy(), base_samples2.detach().numpy(), "base_samples", "base_samples2", diff_value=tolerance)
             #compare_two_arrays(evals.detach().numpy(), evals2.detach().numpy(), "evals", "evals2", diff_value=tolerance)
             #compare_two_arrays(base_evals.detach().numpy(), base_evals2.detach().numpy(), "base_evals", "base_evals2", diff_value=tolerance)
-    
-    
+
+    def test_streaming_marginal_entropy(self):
+
+        print("-> Testing streaming marginal entropy calculation <-")
+
+        for init in self.flow_inits:
+
+            seed_everything(1)
+
+            this_flow=f.pdf(*init[0], **init[1])
+            this_flow.double()
+
+            num_sub_manifolds=len(this_flow.flow_defs_list)
+
+            if(num_sub_manifolds==1):
+                continue
+
+            cinput=None
+            if("conditional_input_dim" in init[1].keys()):
+                cinput=torch.from_numpy(numpy.random.normal(size=(4,init[1]["conditional_input_dim"])))
+
+            with torch.no_grad():
+
+                seed_everything(1)
+                entropy_dict=this_flow.entropy(samplesize=20,
+                                               sub_manifolds=list(range(num_sub_manifolds)),
+                                               conditional_input=cinput)
+
+                ## block size that does not divide the samplesize
+                seed_everything(1)
+                streamed_entropy_dict=this_flow.entropy(samplesize=20,
+                                                        sub_manifolds=list(range(num_sub_manifolds)),
+                                                        conditional_input=cinput,
+                                                        marginal_block_size=7)
+
+            for sub_manifold in entropy_dict.keys():
+                compare_two_arrays(entropy_dict[sub_manifold].numpy(), streamed_entropy_dict[sub_manifold].numpy(), "default", "streamed", diff_value=1e-10)
+
+    def test_entropy_estimate_with_errors(self):
+
+        print("-> Testing entropy and KL estimates with standard errors <-")
+
+        seed_everything(1)
+
+        this_flow=f.pdf("e2+s2", "gg+n", conditional_input_dim=2)
+        this_flow.double()
+
+        cinput=torch.from_numpy(numpy.random.normal(size=(3,2)))
+
+        with torch.no_grad():
+
+            ## plain Monte Carlo with a single round reproduces *entropy*
+            seed_everything(2)
+            entropy_dict=this_flow.entropy(samplesize=64, sub_manifolds=[-1,0], conditional_input=cinput)
+            seed_everything(2)
+            estimates, errors=this_flow.entropy_estimate(samplesize=64, sub_manifolds=[-1,0], conditional_input=cinput)
+
+            for k in entropy_dict.keys():
+                compare_two_arrays(entropy_dict[k].numpy(), estimates[k].numpy(), "entropy", "estimate", diff_value=1e-10)
+
+            seed_everything(3)
+            reference, reference_errors=this_flow.entropy_estimate(samplesize=1024, sub_manifolds=[-1,1], conditional_input=cinput, max_rounds=2)
+
+            for base_sampling in ["antithetic", "sobol"]:
+
+                seed_everything(4)
+                estimates, errors=this_flow.entropy_estimate(samplesize=128, 
+                                                             sub_manifolds=[-1,1], 
+                                                             conditional_input=cinput, 
+                                                             base_sampling=base_sampling, 
+                                                             target_standard_error=0.05, 
+                                                             max_rounds=50)
+
+                for k in estimates.keys():
+                    self.assertTrue(torch.isfinite(errors[k]).all())
+                    self.assertTrue(((estimates[k]-reference[k]).abs()<5*(errors[k]+reference_errors[k])+0.05).all())
+
+                self.assertTrue((errors["total"]<=0.05).all())
+
+            ## KL divergence of a PDF with itself vanishes exactly
+            kl, kl_errors=this_flow.kl_divergence_estimate(this_flow, conditional_input=cinput, other_conditional_input=cinput, samplesize=32)
+
+        self.assertEqual(kl.shape[0], 3)
+        self.assertTrue(torch.allclose(kl, torch.zeros_like(kl), atol=1e-5))
+        self.assertTrue(torch.allclose(kl_errors, torch.zeros_like(kl_errors), atol=1e-5))
+
+
+    def test_von_mises_fisher_moments(self):
+        """
+        Batched Fisher-von Mises samples must reproduce the mean direction and concentration, and the marginal moments must run with the batched approximation.
+        """
+        seed_everything(1)
+
+        for p in [2,3]:
+
+            kappa=torch.tensor([0.5,5.0,80.0], dtype=torch.float64)
+
+            mu=torch.randn(size=(3,p), dtype=torch.float64)
+            mu=mu/mu.norm(dim=1, keepdim=True)
+
+            ## kappa solve inverts the mean resultant length
+            lengths=von_mises_fisher.mean_resultant_length(kappa, p)
+            self.assertTrue(torch.allclose(von_mises_fisher.solve_kappa(lengths, p), kappa))
+
+            ## degenerate lengths must still give finite concentrations
+            self.assertTrue(torch.isfinite(von_mises_fisher.solve_kappa(torch.tensor([1.0, 1.0+1e-12], dtype=torch.float64), p)).all())
+
+            samples=von_mises_fisher.sample_von_mises_fisher(mu, kappa, 20000)
+
+            self.assertEqual(samples.shape, (3,20000,p))
+            self.assertTrue(torch.allclose(samples.norm(dim=2), torch.ones(3,20000, dtype=torch.float64)))
+
+            sample_means=samples.mean(dim=1)
+
+            self.assertTrue(torch.allclose(sample_means.norm(dim=1), lengths, atol=0.02))
+            self.assertTrue(((sample_means/sample_means.norm(dim=1, keepdim=True)*mu).sum(dim=1)>0.95).all())
+
+        this_flow=f.pdf("s2", "n", conditional_input_dim=2)
+        this_flow.double()
+
+        cinput=torch.randn(size=(5,2), dtype=torch.float64)
+
+        res=this_flow.marginal_moments(conditional_input=cinput, samplesize=20, calc_kl_diff_and_entropic_quantities=True)
+
+        self.assertEqual(res["varlike_0"].shape, (5,1))
+        self.assertTrue(numpy.isfinite(res["kl_diff_approx_exact_0"]).all())
+        self.assertTrue(numpy.isfinite(res["approx_entropy_0"]).all())
+
+
+    def test_healpix_scan(self):
+        """
+        Batched HEALPix scans must agree between chunk sizes, agree with Monte Carlo entropies and give a vanishing KL divergence to the PDF itself.
+        """
+        seed_everything(1)
+
+        this_flow=f.pdf("s2", "n", conditional_input_dim=2)
+        this_flow.double()
+
+        cinput=torch.randn(size=(3,2), dtype=torch.float64)
+
+        with torch.no_grad():
+
+            def self_log_pdf(xyz, event_indices):
+                log_pdf,_,_=this_flow(xyz, conditional_input=cinput[event_indices], force_embedding_coordinates=True)
+                return log_pdf
+
+            scan=healpix_scan.healpix_scan_s2(this_flow, conditional_input=cinput, nside=16, reference_log_pdf_fn=self_log_pdf)
+            chunked_scan=healpix_scan.healpix_scan_s2(this_flow, conditional_input=cinput, nside=16, chunk_size=1000)
+
+            for key in ["entropy", "normalization", "mean"]:
+                self.assertTrue(torch.allclose(scan[key], chunked_scan[key]))
+
+            self.assertTrue(torch.allclose(scan["kl_diff"], torch.zeros(3, dtype=torch.float64), atol=1e-10))
+
+            refined_scan=healpix_scan.healpix_scan_s2(this_flow, conditional_input=cinput, nside=16, target_accuracy=1e-3, samplesize=50)
+
+            self.assertTrue(((refined_scan["normalization"]-1.0).abs()<=(scan["normalization"]-1.0).abs()+1e-12).all())
+            self.assertTrue((refined_scan["num_evals"]>=12*16**2).all())
+            self.assertEqual(refined_scan["samples"].shape, (3,50,3))
+
+            estimates,errors=this_flow.entropy_estimate(samplesize=1000, sub_manifolds=[-1], conditional_input=cinput)
+
+            self.assertTrue(((refined_scan["entropy"]-estimates["total"]).abs()<5*errors["total"]+0.05).all())
+
+        res=this_flow.marginal_moments(conditional_input=cinput, samplesize=50, calc_kl_diff_and_entropic_quantities=True, s2_entropy_scanning=True, s2_entropy_scan_nside=16)
+
+        self.assertTrue(numpy.allclose(res["entropy_0"], refined_scan["entropy"].numpy()))
+        self.assertTrue((res["kl_diff_exact_approx_0"]>-1e-3).all())
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -60,6 +60,38 @@ class Test(unittest.TestCase):
         assert((res_mlp-res_functional).sum() < 1e-14)
         print("total diff dim 4", (res_mlp-res_functional).sum())
 
+    def test_fused_kernels(self):
+        """
+        The fused matmul/addmm/baddbmm path must agree with the einsum path for permanent and amortized parameters in all highway modes.
+        """
+        torch.manual_seed(1)
+
+        for highway_mode in [0,1,2,3,4]:
+            for low_rank_approximations in [-1, 2]:
+
+                mlp=amortizable_mlp.AmortizableMLP(6, "10-10", 5, highway_mode=highway_mode, low_rank_approximations=low_rank_approximations, use_permanent_parameters=False)
+                mlp.double()
+
+                inputs=torch.randn(size=(20,6)).type(torch.float64)
+                params=torch.randn(size=(20, mlp.num_amortization_params)).type(torch.float64)
+
+                for this_params in [params, params[:1]]:
+                    for sub_mlp_def in mlp.sub_mlp_structures["mlp_list"][:1]+[mlp.sub_mlp_structures.get("linear_highway", None)]:
+
+                        if(sub_mlp_def is None):
+                            continue
+
+                        these_params=this_params[:, :sub_mlp_def["num_params"]]
+                        fused, rest_fused=mlp._apply_amortized_mlp(sub_mlp_def, inputs, these_params)
+                        einsum, rest_einsum=mlp._apply_amortized_mlp(sub_mlp_def, inputs, these_params, use_fused_kernels=False)
+
+                        self.assertTrue(torch.allclose(fused, einsum))
+                        self.assertEqual(rest_fused.shape[1], 0)
+
+                ## full forward with amortized parameters
+                res=mlp(inputs, extra_inputs=params)
+                self.assertEqual(res.shape, (20,5))
+
 
 
 if __name__ == '__main__':
@@ -16,6 +16,8 @@ import jammy_flows.main.default as f
 #from pytorch_lightning import seed_everything
 import jammy_flows.helper_fns as helper_fns
 import jammy_flows.layers.bisection_n_newton as bn
+from jammy_flows.helper_fns import profiling
+from jammy_flows.layers.spheres import exponential_map_s2
 
 def seed_everything(seed):
 
@@ -370,8 +372,117 @@ class Test(unittest.TestCase):
 
             ### now do the same and check gradient compatibility
 
-        
-        
+    def test_adaptive_newton(self):
+        """
+        Compares the adaptive (bracketed, early exit, warm-startable) solver with the standard joint bisection/newton solver.
+        """
+        print("Testing the agreement of adaptive and standard newton iterations")
+
+        samplesize=1000
+
+        for skew in [0,1]:
+
+            extra_flow_defs=dict()
+            extra_flow_defs["g"]=dict()
+            extra_flow_defs["g"]["add_skewness"]=skew
+            extra_flow_defs["g"]["inverse_function_type"]="isigmoid"
+
+            seed_everything(1)
+            flow=f.pdf("e2", "g", options_overwrite=extra_flow_defs)
+            flow.double()
+
+            gf_layer=flow.layer_list[0][0]
+
+            z=torch.randn((samplesize,2), dtype=torch.double)*3
+
+            flow_params,_=gf_layer._obtain_usable_flow_params(z)
+
+            res_standard=bn.inverse_bisection_n_newton_joint_func_and_grad(gf_layer.sigmoid_inv_error_pass_w_params, gf_layer.sigmoid_inv_error_pass_combined_val_n_normal_derivative, z, *flow_params[:5], min_boundary=-1e5, max_boundary=1e5, num_bisection_iter=25, num_newton_iter=20)
+            standard_grad=torch.cat([g.view(-1) for g in torch.autograd.grad(res_standard.sum(), gf_layer.parameters(), allow_unused=True, retain_graph=True) if g is not None])
+
+            lower_bracket, upper_bracket=gf_layer._obtain_inversion_brackets(z, flow_params)
+
+            res_adaptive, stats=bn.inverse_bisection_n_newton_joint_func_and_grad_adaptive(gf_layer.sigmoid_inv_error_pass_w_params, gf_layer.sigmoid_inv_error_pass_combined_val_n_normal_derivative, z, *flow_params[:5], lower_bracket=lower_bracket, upper_bracket=upper_bracket, min_boundary=-1e5, max_boundary=1e5, num_bisection_iter=25, num_newton_iter=20, return_stats=True)
+            adaptive_grad=torch.cat([g.view(-1) for g in torch.autograd.grad(res_adaptive.sum(), gf_layer.parameters(), allow_unused=True, retain_graph=True) if g is not None])
+
+            compare_two_arrays(res_standard.detach().numpy().flatten(), res_adaptive.detach().numpy().flatten(), "standard inverse", "adaptive inverse")
+            compare_two_arrays(standard_grad.numpy(), adaptive_grad.numpy(), "standard grad", "adaptive grad")
+
+            self.assertEqual(stats["num_non_converged"], 0)
+            self.assertEqual(stats["num_items"], samplesize)
+
+            if(skew==0):
+                ## kernel brackets must be valid and save function evaluations
+                self.assertEqual(stats["num_bracket_fallbacks"], 0)
+                self.assertTrue(stats["num_function_evals"] < samplesize*(25+20))
+
+            ## warm start from a perturbed solution skips bisection
+            with torch.no_grad():
+                res_warm, warm_stats=bn.inverse_bisection_n_newton_joint_func_and_grad_adaptive(gf_layer.sigmoid_inv_error_pass_w_params, gf_layer.sigmoid_inv_error_pass_combined_val_n_normal_derivative, z, *flow_params[:5], initial_guess=res_standard+1e-3, num_newton_iter=20, return_stats=True)
+
+            self.assertEqual(warm_stats["num_bisection_iter"], 0)
+            compare_two_arrays(res_standard.detach().numpy().flatten(), res_warm.numpy().flatten(), "standard inverse", "warm started inverse")
+
+    def test_gf_layer_warm_start(self):
+        """
+        A warm start passed to the layer mapping must reproduce the inversion without bisection steps, also with offsets and rotations.
+        """
+        extra_flow_defs=dict()
+        extra_flow_defs["g"]=dict()
+        extra_flow_defs["g"]["inversion_solver"]="adaptive"
+
+        seed_everything(1)
+        flow=f.pdf("e2", "g", options_overwrite=extra_flow_defs)
+        flow.double()
+
+        gf_layer=flow.layer_list[0][0]
+
+        z=torch.randn((500,2), dtype=torch.double)*3
+
+        with torch.no_grad():
+            res,_=gf_layer.flow_mapping([z, torch.zeros(500, dtype=torch.double)])
+            cold_stats=gf_layer.last_inversion_stats
+
+            res_warm,_=gf_layer.flow_mapping([z, torch.zeros(500, dtype=torch.double)], initial_guess=res+1e-3)
+            warm_stats=gf_layer.last_inversion_stats
+
+        self.assertTrue(cold_stats["num_bisection_iter"]>0)
+        self.assertEqual(warm_stats["num_bisection_iter"], 0)
+        self.assertEqual(warm_stats["num_non_converged"], 0)
+
+        compare_two_arrays(res.numpy().flatten(), res_warm.numpy().flatten(), "cold inverse", "warm started layer inverse")
+
+    def test_sphere_newton(self):
+        """
+        The Gauss-Newton inverse of the exponential map on the sphere must recover the forward input in a few iterations for all potentials.
+        """
+        print("Testing the spherical exponential map inverse")
+
+        for exp_map_type in ["linear", "quadratic", "exponential", "splines"]:
+
+            seed_everything(1)
+            layer=exponential_map_s2.exponential_map_s2(2, use_permanent_parameters=True, exp_map_type=exp_map_type, natural_direction=0)
+            layer.double()
+
+            ## one parameter set per item as in conditional PDFs
+            potential_pars=layer.potential_pars.repeat(500,1,1)
+
+            x=torch.randn((500,3), dtype=torch.double)
+            x=x/x.norm(dim=1, keepdim=True)
+
+            with torch.no_grad():
+                target,_,_,_=layer.get_exp_map_and_jacobian(x, potential_pars)
+
+                profiling.iteration_record={"num_solver_calls": 0, "num_bisection_iter": 0, "num_newton_iter": 0}
+                res=bn.inverse_bisection_n_newton_sphere_fast(layer.get_exp_map_and_jacobian, layer.basic_logarithmic_map, layer.basic_exponential_map, target, potential_pars, num_newton_iter=1000)
+                num_newton_iter=profiling.iteration_record["num_newton_iter"]
+                profiling.iteration_record=None
+
+            compare_two_arrays(x.numpy().flatten(), res.numpy().flatten(), "forward input", "sphere newton inverse")
+
+            self.assertTrue(num_newton_iter<=20)
+
+
                 
         
 
@@ -0,0 +1,188 @@
+import unittest
+import sys
+import os
+import torch
+import numpy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import jammy_flows.main.default as f
+from jammy_flows.helper_fns import grid_functions
+
+def seed_everything(seed_no):
+    torch.manual_seed(seed_no)
+    numpy.random.seed(seed_no)
+
+class Test(unittest.TestCase):
+    def setUp(self):
+
+        seed_everything(1)
+
+        self.pdf=f.pdf("e2", "gg", conditional_input_dim=3, verbose=False)
+        self.pdf.double()
+
+        self.conditional_input=torch.randn(size=(4,3)).type(torch.float64)
+
+    def test_batched_grid(self):
+        """
+        Batched grid evaluation should agree with the event-by-event grid evaluation.
+        """
+        bounds=numpy.array([[[-1.0, 2.0],[-3.0, 0.5]],
+                            [[0.0, 1.0],[-1.0, 1.0]],
+                            [[-2.0, -1.0],[2.0, 4.0]],
+                            [[-0.5, 0.5],[-0.5, 0.5]]])
+
+        with torch.no_grad():
+            batched_positions, batched_evals, batched_volumes=grid_functions.get_pdf_on_grid_batched(bounds,
+                                                                                                      20,
+                                                                                                      self.pdf,
+                                                                                                      conditional_input=self.conditional_input)
+
+            for ind in range(len(bounds)):
+                positions, evals, volume, _, _=grid_functions.get_pdf_on_grid(bounds[ind],
+                                                                             20,
+                                                                             self.pdf,
+                                                                             conditional_input=self.conditional_input[ind:ind+1])
+
+                self.assertTrue(numpy.allclose(positions, batched_positions[ind:ind+1]))
+                self.assertTrue(numpy.allclose(evals, batched_evals[ind:ind+1]))
+                self.assertTrue(numpy.isclose(volume, batched_volumes[ind]))
+
+    def test_chunked_grid(self):
+        """
+        Chunked grid evaluation with lazily generated positions should agree with the single pass evaluation, also for chunks spanning several events.
+        """
+        bounds=numpy.array([[[-1.0, 2.0],[-3.0, 0.5]],
+                            [[0.0, 1.0],[-1.0, 1.0]],
+                            [[-2.0, -1.0],[2.0, 4.0]],
+                            [[-0.5, 0.5],[-0.5, 0.5]]])
+
+        with torch.no_grad():
+            batched_positions, batched_evals, _=grid_functions.get_pdf_on_grid_batched(bounds, 10, self.pdf, conditional_input=self.conditional_input)
+            chunked_positions, chunked_evals, _=grid_functions.get_pdf_on_grid_batched(bounds, 10, self.pdf, conditional_input=self.conditional_input, chunk_size=37)
+
+            self.assertTrue(numpy.allclose(batched_positions, chunked_positions))
+            self.assertTrue(numpy.allclose(batched_evals, chunked_evals))
+
+            all_chunked_positions, all_chunked_evals, _, _, _=grid_functions.get_pdf_on_grid(bounds[0], 10, self.pdf, conditional_input=self.conditional_input, chunk_size=37)
+
+            self.assertEqual(all_chunked_evals.shape, (4,10,10))
+
+            for ind in range(len(bounds)):
+                positions, evals, _, _, _=grid_functions.get_pdf_on_grid(bounds[0], 10, self.pdf, conditional_input=self.conditional_input[ind:ind+1])
+
+                self.assertTrue(numpy.allclose(positions[0], all_chunked_positions[ind]))
+                self.assertTrue(numpy.allclose(evals[0], all_chunked_evals[ind]))
+
+        ## mixed manifold with masked lambert region
+        s2_pdf=f.pdf("s2+e1", "n+g", conditional_input_dim=3)
+        s2_pdf.double()
+
+        with torch.no_grad():
+            _, evals, _, _, _=grid_functions.get_pdf_on_grid([[-2.0,2.0],[-2.0,2.0],[-1.0,1.0]], 8, s2_pdf, conditional_input=self.conditional_input[:1], s2_norm="lambert")
+            _, chunked_evals, _, _, _=grid_functions.get_pdf_on_grid([[-2.0,2.0],[-2.0,2.0],[-1.0,1.0]], 8, s2_pdf, conditional_input=self.conditional_input[:1], s2_norm="lambert", chunk_size=50)
+
+        self.assertTrue(numpy.allclose(evals, chunked_evals))
+
+    def test_adaptive_scan(self):
+        """
+        The adaptive k-d tree mesh must tile the scan region, integrate the PDF to roughly one and need fewer evaluations than the regular grid.
+        """
+        with torch.no_grad():
+            samples,_,_,_=self.pdf.condition(self.conditional_input).sample(samplesize=10000)
+        samples=samples.reshape(4, 10000, -1)
+
+        bounds=grid_functions.obtain_density_eval_bounds_batched(samples, percentiles=[0.5,99.5])
+
+        scan_results=grid_functions.get_adaptive_pdf_scan_batched(samples, self.pdf, conditional_input=self.conditional_input, mins_maxs=bounds)
+
+        for ind, (positions, log_evals, volumes) in enumerate(scan_results):
+
+            self.assertEqual(positions.shape[0], log_evals.shape[0])
+            self.assertTrue(positions.shape[0]<10000)
+            self.assertTrue(numpy.isclose(volumes.sum(), numpy.prod(bounds[ind,:,1]-bounds[ind,:,0])))
+            self.assertTrue(abs((numpy.exp(log_evals)*volumes).sum()-1.0)<0.05)
+
+        res=self.pdf.coverage_and_or_pdf_scan(conditional_input=self.conditional_input, save_pdf_scan=True, calculate_MAP=True, adaptive_scan=True, scan_chunk_size=3)
+
+        self.assertEqual(res["map_positions"].shape, (4,2))
+        self.assertEqual(len(res["pdf_scan_positions"]), 4)
+
+        for positions, log_evals, volumes in zip(res["pdf_scan_positions"], res["pdf_scan_log_evals"], res["pdf_scan_volume_sizes"]):
+            self.assertEqual(positions.shape[:2], log_evals.shape)
+            self.assertEqual(volumes.shape, log_evals.shape[1:])
+
+        ## mixed Euclidean and interval PDF
+        interval_pdf=f.pdf("e1+i1_-1.0_1.0", "g+r", conditional_input_dim=3)
+        interval_pdf.double()
+
+        res=interval_pdf.coverage_and_or_pdf_scan(conditional_input=self.conditional_input, save_pdf_scan=True, adaptive_scan=True)
+
+        for positions in res["pdf_scan_positions"]:
+            self.assertTrue((positions[0,:,1]>-1.0).all() and (positions[0,:,1]<1.0).all())
+
+    def test_find_mode(self):
+        """
+        Gradient-ascent modes must be at least as good as the best sample and respect the manifold constraints.
+        """
+        modes, mode_log_pdfs=self.pdf.find_mode(conditional_input=self.conditional_input, seed=1)
+
+        self.assertEqual(modes.shape, (4,2))
+
+        with torch.no_grad():
+            _,_,sample_log_pdfs,_=self.pdf.condition(self.conditional_input).sample(samplesize=1000, seed=1)
+            mode_evals,_,_=self.pdf(modes, conditional_input=self.conditional_input)
+
+        self.assertTrue((mode_log_pdfs>=sample_log_pdfs.reshape(4,1000).max(dim=1).values-1e-8).all())
+        self.assertTrue(torch.allclose(mode_evals, mode_log_pdfs))
+
+        res=self.pdf.coverage_and_or_pdf_scan(conditional_input=self.conditional_input, calculate_MAP=True, refine_MAP=True)
+        self.assertEqual(res["map_positions"].shape, (4,2))
+
+        ## constraints on spheres and intervals
+        mixed_pdf=f.pdf("s2+i1_-1.0_1.0", "n+r", conditional_input_dim=3)
+        mixed_pdf.double()
+
+        modes, mode_log_pdfs=mixed_pdf.find_mode(conditional_input=self.conditional_input, force_embedding_coordinates=True, num_steps=50)
+
+        self.assertEqual(modes.shape, (4,4))
+        self.assertTrue(torch.isfinite(mode_log_pdfs).all())
+        self.assertTrue(torch.allclose(modes[:,:3].norm(dim=1), torch.ones(4, dtype=torch.float64)))
+        self.assertTrue(((modes[:,3]>-1.0) & (modes[:,3]<1.0)).all())
+
+    def test_batched_scan(self):
+        """
+        Batched pdf scan should return the same output structure as the default scan.
+        """
+
+        res_loop=self.pdf.coverage_and_or_pdf_scan(conditional_input=self.conditional_input, save_pdf_scan=True, calculate_MAP=True)
+        res_batched=self.pdf.coverage_and_or_pdf_scan(conditional_input=self.conditional_input, save_pdf_scan=True, calculate_MAP=True, batched_scan=True, scan_chunk_size=3)
+
+        self.assertEqual(res_loop["map_positions"].shape, res_batched["map_positions"].shape)
+
+        for key in ["pdf_scan_positions", "pdf_scan_log_evals"]:
+            self.assertEqual(len(res_loop[key]), len(res_batched[key]))
+
+            for a, b in zip(res_loop[key], res_batched[key]):
+                self.assertEqual(a.shape, b.shape)
+                self.assertTrue(numpy.isfinite(b).all())
+
+    def test_density_rank_coverage(self):
+        """
+        Density-rank coverage must work for mixed manifolds and be roughly uniform for truths drawn from the PDF itself.
+        """
+        mixed_pdf=f.pdf("e1+s2", "gg+n", conditional_input_dim=3, verbose=False)
+        mixed_pdf.double()
+
+        conditional_input=torch.randn(size=(200,3)).type(torch.float64)
+
+        truths,_,_,_=mixed_pdf.sample(conditional_input=conditional_input, force_embedding_coordinates=True)
+
+        res=mixed_pdf.coverage_and_or_pdf_scan(labels=truths, conditional_input=conditional_input, exact_coverage_calculation=True, exact_coverage_method="density_rank", scan_chunk_size=64)
+
+        self.assertEqual(res["real_cov_values"].shape, (200,))
+        self.assertTrue( ((res["real_cov_values"]>=0) & (res["real_cov_values"]<=1)).all())
+        self.assertTrue(abs(res["real_cov_values"].mean()-0.5)<0.1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import sys
+import os
+import torch
+import numpy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import jammy_flows.main.default as f
+
+def seed_everything(seed_no):
+    torch.manual_seed(seed_no)
+    numpy.random.seed(seed_no)
+
+class Test(unittest.TestCase):
+    def setUp(self):
+
+        seed_everything(1)
+
+        self.pdf=f.pdf("e2+s2+i1", "gg+v+r")
+        self.pdf.double()
+
+    def test_profile_report(self):
+        """
+        The profiler must record every layer mapping, MLP predictor and target-space transformation, and must leave the PDF untouched afterwards.
+        """
+        with self.pdf.profile() as profiler:
+            samples,_,sample_evals,_=self.pdf.sample(samplesize=200)
+            evals,_,_=self.pdf(samples)
+            self.pdf.transform_target_space(samples)
+
+        report=profiler.report()
+
+        self.assertEqual(sorted(report.keys()), ["00_e2", "01_s2", "02_i1", "transform_target_space"])
+        self.assertEqual(sorted(report["00_e2"].keys()), ["00_g", "01_g"])
+        self.assertTrue("mlp_predictor" in report["01_s2"])
+        self.assertEqual(report["01_s2"]["mlp_predictor"]["num_calls"], 2)
+
+        for direction in ["flow_mapping", "inv_flow_mapping"]:
+            self.assertEqual(report["02_i1"]["00_r"][direction]["num_calls"], 1)
+
+        ## sampling through the gaussianization flow requires bisection and Newton iterations, evaluation does not
+        self.assertTrue(report["00_e2"]["00_g"]["flow_mapping"]["num_bisection_iter"]>0)
+        ## actually performed bisection steps, at most the configured 25 per solver call
+        self.assertTrue(report["00_e2"]["00_g"]["flow_mapping"]["num_bisection_iter"]<=25*report["00_e2"]["00_g"]["flow_mapping"]["num_solver_calls"])
+        self.assertTrue(report["00_e2"]["00_g"]["flow_mapping"]["num_newton_iter"]>0)
+        self.assertEqual(report["00_e2"]["00_g"]["inv_flow_mapping"]["num_newton_iter"], 0)
+
+        self.assertEqual(report["transform_target_space"]["num_calls"], 1)
+
+        self.assertTrue(len(profiler.summary().split("\n"))==12)
+
+        ## instrumentation is removed
+        for pdf_layers in self.pdf.layer_list:
+            for layer in pdf_layers:
+                self.assertFalse("flow_mapping" in layer.__dict__)
+                self.assertFalse("inv_flow_mapping" in layer.__dict__)
+
+        self.assertFalse("transform_target_space" in self.pdf.__dict__)
+
+        with torch.no_grad():
+            evals_after,_,_=self.pdf(samples)
+
+        self.assertTrue(torch.allclose(evals, evals_after))
+
+    def test_cnf_performance_mode(self):
+        """
+        Fixed-step continuous flows must report their vector-field evaluations, and the Hutchinson trace must only be used when training with gradients.
+        """
+        test_points=torch.randn(size=(50,2)).type(torch.float64)
+
+        evals=dict()
+
+        for trace_estimator in ["exact", "hutchinson"]:
+
+            seed_everything(1)
+            cnf_pdf=f.pdf("s2", "c", options_overwrite={"c": {"solver": "rk4", "num_steps_per_chart": 2, "trace_estimator": trace_estimator, "use_adjoint": 0}})
+            cnf_pdf.double()
+
+            layer=cnf_pdf.layer_list[0][0]
+
+            with cnf_pdf.profile() as profiler:
+                with torch.no_grad():
+                    evals[trace_estimator],_,_=cnf_pdf(test_points)
+
+            report=profiler.report()
+
+            self.assertTrue(layer.last_num_evals>0)
+            self.assertEqual(report["00_s2"]["00_c"]["inv_flow_mapping"]["num_ode_evals"], layer.last_num_evals)
+
+            cnf_pdf.train()
+            train_evals,_,_=cnf_pdf(test_points)
+            train_evals.mean().backward()
+
+            self.assertTrue(torch.isfinite(train_evals).all())
+
+        ## without gradients the hutchinson mode uses the exact divergence
+        self.assertTrue(torch.allclose(evals["exact"], evals["hutchinson"]))
+
+if __name__ == '__main__':
+    unittest.main()
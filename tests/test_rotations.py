@@ -0,0 +1,196 @@
+import unittest
+import sys
+import os
+import torch
+import numpy
+import itertools
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import jammy_flows.main.default as f
+from jammy_flows.layers import matrix_fns
+
+def seed_everything(seed_no):
+    torch.manual_seed(seed_no)
+    numpy.random.seed(seed_no)
+
+def householder_matrix_loop(vs):
+    """
+    Reference implementation with one sequential bmm per reflection.
+    """
+    dim=vs.shape[2]
+
+    Q = torch.eye(dim).type(vs.dtype).unsqueeze(0).repeat(vs.shape[0], 1,1)
+   
+    for i in range(vs.shape[1]):
+    
+        v = vs[:,i].reshape(-1,dim, 1)
+        
+        v = v / v.norm(dim=1).unsqueeze(-1)
+
+        Qi = torch.eye(dim).type(vs.dtype).unsqueeze(0) - 2 * torch.bmm(v, v.permute(0, 2, 1))
+
+        Q = torch.bmm(Q, Qi)
+
+    return Q
+
+def givens_matrix_loop(angles, dim):
+    """
+    Reference implementation with one sequential bmm per Givens rotation.
+    """
+    prev_matrix=torch.eye(dim).type(angles.dtype).unsqueeze(0).repeat(angles.shape[0],1,1)
+
+    for ind, combi in enumerate(itertools.combinations(range(dim), 2)):
+
+        new_matrix=torch.eye(dim).type(angles.dtype).unsqueeze(0).repeat(angles.shape[0],1,1)
+
+        new_matrix[:, combi[0], combi[0]]=torch.cos(angles[:, ind])
+        new_matrix[:, combi[1], combi[1]]=torch.cos(angles[:, ind])
+        new_matrix[:, combi[0], combi[1]]=torch.sin(angles[:, ind])
+        new_matrix[:, combi[1], combi[0]]=-torch.sin(angles[:, ind])
+
+        prev_matrix=torch.bmm(new_matrix, prev_matrix)
+
+    return prev_matrix
+
+class Test(unittest.TestCase):
+    def setUp(self):
+
+        seed_everything(1)
+
+        self.rotation_modes=dict()
+        self.rotation_modes["e3"]=["householder", "triangular_combination", "angles"]
+        self.rotation_modes["e2"]=["cayley"]
+
+    def test_apply_matrix(self):
+        """
+        Shared and amortized matrix application must agree with the batch-repeated bmm.
+        """
+        x=torch.randn(size=(100,4)).type(torch.float64)
+
+        for num_matrices in [1, 100]:
+            mat=torch.randn(size=(num_matrices,4,4)).type(torch.float64)
+            repeated_mat=mat.expand(100,4,4)
+
+            self.assertTrue(torch.allclose(matrix_fns.apply_matrix(mat, x), torch.bmm(repeated_mat, x.unsqueeze(-1)).squeeze(-1)))
+            self.assertTrue(torch.allclose(matrix_fns.apply_matrix(mat, x, transpose=True), torch.bmm(repeated_mat.permute(0,2,1), x.unsqueeze(-1)).squeeze(-1)))
+
+        with self.assertRaises(Exception):
+            matrix_fns.apply_matrix(torch.randn(size=(3,4,4)), torch.randn(size=(5,4)))
+
+    def test_householder_matrix(self):
+        """
+        The compact WY Householder product must agree with the sequential loop in values and gradients, for all layer families.
+        """
+        for num_reflections, dim in [(1,2), (3,3), (5,5), (2,6)]:
+            vs=torch.randn(size=(50,num_reflections,dim)).type(torch.float64).requires_grad_(True)
+
+            fused=matrix_fns.obtain_householder_matrix(vs)
+            looped=householder_matrix_loop(vs)
+
+            self.assertTrue(torch.allclose(fused, looped))
+            self.assertTrue(torch.allclose(torch.bmm(fused, fused.permute(0,2,1)), torch.eye(dim).type(torch.float64).unsqueeze(0)))
+
+            fused_grad,=torch.autograd.grad(fused.sin().sum(), vs)
+            looped_grad,=torch.autograd.grad(looped.sin().sum(), vs)
+
+            self.assertTrue(torch.allclose(fused_grad, looped_grad))
+
+        gf_pdf=f.pdf("e4", "g")
+        psf_pdf=f.pdf("e4", "p")
+        sphere_pdf=f.pdf("s2", "n")
+
+        for this_pdf, vs_name in [(gf_pdf, "vs"), (psf_pdf, "vs"), (sphere_pdf, "householder_params")]:
+            this_pdf.double()
+            layer=this_pdf.layer_list[0][0]
+            vs=getattr(layer, vs_name)
+
+            if(vs_name=="householder_params"):
+                vs=vs.reshape(-1, 3, 3)
+                layer_matrix=layer.compute_householder_matrix(vs, 3)
+            else:
+                layer_matrix=layer.compute_householder_matrix(vs)
+
+            self.assertTrue(torch.allclose(layer_matrix, householder_matrix_loop(vs.reshape(1, -1, layer_matrix.shape[1]))))
+
+    def test_givens_matrix(self):
+        """
+        The tree-reduced Givens product must agree with the sequential loop in values and gradients. Shared sphere rotations are cached without gradients.
+        """
+        for batch_size, dim in [(1,2), (50,3), (50,4), (7,6)]:
+            angles=torch.randn(size=(batch_size, dim*(dim-1)//2)).type(torch.float64).requires_grad_(True)
+
+            fused=matrix_fns.obtain_givens_rotation_matrix(angles, dim)
+            looped=givens_matrix_loop(angles, dim)
+
+            self.assertTrue(torch.allclose(fused, looped))
+
+            fused_grad,=torch.autograd.grad(fused.sin().sum(), angles)
+            looped_grad,=torch.autograd.grad(looped.sin().sum(), angles)
+
+            self.assertTrue(torch.allclose(fused_grad, looped_grad))
+
+        seed_everything(1)
+        sphere_pdf=f.pdf("s2", "n", options_overwrite={"n":{"rotation_mode": "angles"}})
+        sphere_pdf.double()
+
+        layer=sphere_pdf.layer_list[0][0]
+        x=torch.randn(size=(10,3)).type(torch.float64)
+
+        with torch.no_grad():
+            cached=layer.compute_rotation_matrix(x, mode="angles", device=x.device)
+            self.assertTrue(layer.compute_rotation_matrix(x, mode="angles", device=x.device) is cached)
+
+        self.assertTrue(torch.allclose(cached, givens_matrix_loop(layer.householder_params.detach(), 3)))
+
+        optimizer=torch.optim.SGD(sphere_pdf.parameters(), lr=0.1)
+        loss=layer.compute_rotation_matrix(x, mode="angles", device=x.device).sum()
+        loss.backward()
+        optimizer.step()
+
+        with torch.no_grad():
+            updated=layer.compute_rotation_matrix(x, mode="angles", device=x.device)
+
+        self.assertFalse(torch.allclose(cached, updated))
+        self.assertTrue(torch.allclose(updated, givens_matrix_loop(layer.householder_params.detach(), 3)))
+
+    def test_rotation_modes(self):
+        """
+        Flows with shared and amortized rotations must be invertible in all rotation modes.
+        """
+        for space, modes in self.rotation_modes.items():
+            for mode in modes:
+                for cinput_dim in [None, 2]:
+
+                    seed_everything(1)
+                    this_pdf=f.pdf(space, "gg", conditional_input_dim=cinput_dim, options_overwrite={"g":{"rotation_mode": mode}})
+                    this_pdf.double()
+
+                    cinput=None
+                    if(cinput_dim is not None):
+                        cinput=torch.randn(size=(200,cinput_dim)).type(torch.float64)
+
+                    with torch.no_grad():
+                        samples,_,sample_evals,_=this_pdf.sample(samplesize=200, conditional_input=cinput)
+                        evals,_,_=this_pdf(samples, conditional_input=cinput)
+
+                    self.assertTrue(torch.allclose(sample_evals, evals), msg="%s / %s / %s" % (space, mode, str(cinput_dim)))
+
+        for cinput_dim in [None, 2]:
+
+            seed_everything(1)
+            sphere_pdf=f.pdf("s2", "n", conditional_input_dim=cinput_dim, options_overwrite={"n":{"rotation_mode": "angles"}})
+            sphere_pdf.double()
+
+            cinput=None
+            if(cinput_dim is not None):
+                cinput=torch.randn(size=(200,cinput_dim)).type(torch.float64)
+
+            with torch.no_grad():
+                samples,_,sample_evals,_=sphere_pdf.sample(samplesize=200, conditional_input=cinput)
+                evals,_,_=sphere_pdf(samples, conditional_input=cinput)
+
+            self.assertTrue(torch.allclose(sample_evals, evals))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import sys
+import os
+import torch
+import numpy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import jammy_flows.main.default as f
+
+def seed_everything(seed_no):
+    torch.manual_seed(seed_no)
+    numpy.random.seed(seed_no)
+
+class Test(unittest.TestCase):
+    def setUp(self):
+
+        seed_everything(1)
+
+        self.pdf=f.pdf("e2", "gg", options_overwrite={"g":{"nonlinear_stretch_type": "rq_splines"}})
+        self.pdf.double()
+
+        self.test_points=torch.randn(size=(500,2)).type(torch.float64)
+
+    def test_cache_consistency(self):
+        """
+        Cached spline knots (no gradients) must agree with the uncached evaluation and must be invalidated after an optimizer step.
+        """
+
+        with torch.no_grad():
+            cached_evals,_,_=self.pdf(self.test_points)
+            cached_evals_again,_,_=self.pdf(self.test_points)
+
+        for layer in self.pdf.layer_list[0]:
+            self.assertTrue("rq_spline_knots" in layer._parameter_caches)
+
+        uncached_evals,_,_=self.pdf(self.test_points)
+
+        self.assertTrue(torch.allclose(cached_evals, cached_evals_again))
+        self.assertTrue(torch.allclose(cached_evals, uncached_evals.detach()))
+
+        optimizer=torch.optim.SGD(self.pdf.parameters(), lr=0.1)
+        loss=-uncached_evals.mean()
+        loss.backward()
+        optimizer.step()
+
+        with torch.no_grad():
+            cached_evals_after_step,_,_=self.pdf(self.test_points)
+
+        uncached_evals_after_step,_,_=self.pdf(self.test_points)
+
+        self.assertTrue(torch.allclose(cached_evals_after_step, uncached_evals_after_step.detach()))
+        self.assertFalse(torch.allclose(cached_evals_after_step, cached_evals))
+
+        ## sampling uses the same cache in the inverse direction
+        with torch.no_grad():
+            samples,_,sample_evals,_=self.pdf.sample(samplesize=500)
+            sample_evals_again,_,_=self.pdf(samples)
+
+        self.assertTrue(torch.allclose(sample_evals, sample_evals_again))
+
+if __name__ == '__main__':
+    unittest.main()
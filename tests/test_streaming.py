@@ -0,0 +1,71 @@
+import unittest
+import sys
+import os
+import torch
+import numpy
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import jammy_flows.main.default as f
+
+def seed_everything(seed_no):
+    torch.manual_seed(seed_no)
+    numpy.random.seed(seed_no)
+
+class Test(unittest.TestCase):
+    def setUp(self):
+
+        seed_everything(1)
+
+        self.pdf=f.pdf("e2+s2", "gg+n", conditional_input_dim=2)
+        self.pdf.double()
+
+        self.conditional_input=torch.randn(size=(500,2)).type(torch.float64)
+
+    def test_sample_iter(self):
+        """
+        Chunked sampling with a seed must reproduce the full sample and fill preallocated outputs.
+        """
+        samples, base_samples, log_pdfs, _=self.pdf.sample(conditional_input=self.conditional_input, seed=3)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            out=dict()
+            out["sample"]=torch.zeros_like(samples)
+            out["log_pdf"]=numpy.lib.format.open_memmap(os.path.join(tmpdir, "log_pdf.npy"), mode="w+", dtype=numpy.float64, shape=(500,))
+
+            num_chunks=0
+            for start_index, chunk_samples, chunk_base_samples, _, _ in self.pdf.sample_iter(conditional_input=self.conditional_input, chunk_size=128, seed=3, out=out):
+                self.assertTrue(chunk_samples.shape[0]<=128)
+                self.assertTrue(torch.allclose(chunk_base_samples, base_samples[start_index:start_index+chunk_samples.shape[0]]))
+                num_chunks+=1
+
+            self.assertEqual(num_chunks, 4)
+            self.assertTrue(torch.allclose(out["sample"], samples))
+            self.assertTrue(numpy.allclose(out["log_pdf"], log_pdfs.numpy()))
+
+            del out
+
+    def test_log_prob_iter(self):
+        """
+        Chunked evaluation of tensors and data loaders must agree with a single forward pass.
+        """
+        samples, _, _, _=self.pdf.sample(conditional_input=self.conditional_input)
+
+        with torch.no_grad():
+            log_pdfs,_,_=self.pdf(samples, conditional_input=self.conditional_input)
+
+        out=dict(log_pdf=torch.zeros_like(log_pdfs))
+        for _ in self.pdf.log_prob_iter(samples, chunk_size=100, conditional_input=self.conditional_input, out=out):
+            pass
+
+        self.assertTrue(torch.allclose(out["log_pdf"], log_pdfs))
+
+        data_loader=torch.utils.data.DataLoader(torch.utils.data.TensorDataset(samples, self.conditional_input), batch_size=64)
+
+        loader_log_pdfs=torch.cat([res[1] for res in self.pdf.log_prob_iter(data_loader)])
+
+        self.assertTrue(torch.allclose(loader_log_pdfs, log_pdfs))
+
+if __name__ == '__main__':
+    unittest.main()